@@ -0,0 +1,433 @@
+"""
+Order history analytics
+Orders and order details (live and archived) held as NumPy column arrays,
+so the manager reports are a few vectorized passes rather than loops over
+rows
+
+The columns are loaded on first use, then kept current by the writes this
+process makes (new orders and details are appended, payments and status
+changes update their order in place) and reloaded in the background every
+CAFE_ANALYTICS_RESYNC seconds to take in the writes of other worker
+processes. Like the revenue rollups, only completed, paid orders count.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import archive
+import database as db
+from constants import OrderStatus, PaymentStatus
+
+# Seconds between background reloads
+ANALYTICS_RESYNC = float(os.environ.get("CAFE_ANALYTICS_RESYNC", 300))
+
+# Writes buffered between two reports; past this the columns are reloaded
+ANALYTICS_MAX_EVENTS = int(os.environ.get("CAFE_ANALYTICS_MAX_EVENTS", 100000))
+
+# Basket sizes at or above this are counted together
+BASKET_SIZE_CAP = 10
+
+_NAT = np.iinfo(np.int64).min
+
+
+def _floats(values: List[str]) -> np.ndarray:
+    try:
+        return np.array(values, dtype=str).astype(np.float64)
+    except ValueError:
+        result = np.zeros(len(values), dtype=np.float64)
+        for i, value in enumerate(values):
+            try:
+                result[i] = float(value)
+            except ValueError:
+                pass
+        return result
+
+
+def _timestamps(rows: List[Dict]) -> np.ndarray:
+    """Seconds since 1970 (wall clock, no timezone) of created_at, or of the order date"""
+    values = [row.get("created_at") or row.get("date") or "" for row in rows]
+    try:
+        return np.array(values, dtype="datetime64[s]").astype(np.int64)
+    except ValueError:
+        result = np.full(len(values), _NAT, dtype=np.int64)
+        for i, value in enumerate(values):
+            try:
+                result[i] = np.datetime64(value, "s").astype(np.int64)
+            except ValueError:
+                pass
+        return result
+
+
+def _counted(row: Dict) -> bool:
+    return row.get("status") == OrderStatus.COMPLETED and row.get("payment_status") == PaymentStatus.PAID
+
+
+class _Columns:
+    """Column arrays of one table that grow by doubling, like a list"""
+
+    def __init__(self, dtypes: Dict[str, str]):
+        self.size = 0
+        self._arrays = {name: np.zeros(16, dtype) for name, dtype in dtypes.items()}
+
+    def extend(self, **columns):
+        count = len(next(iter(columns.values())))
+        needed = self.size + count
+        for name, array in self._arrays.items():
+            if needed > len(array):
+                grown = np.zeros(max(needed, 2 * len(array)), array.dtype)
+                grown[:self.size] = array[:self.size]
+                array = self._arrays[name] = grown
+            array[self.size:needed] = columns[name]
+        self.size = needed
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self._arrays[name][:self.size]
+
+
+class OrderColumns:
+    """
+    One columnar copy of the order history
+
+    orders: ts (seconds), total, method (code), counted, has_details
+    details: order (row in orders), item (code), quantity, subtotal
+    """
+
+    def __init__(self):
+        self.orders = _Columns({"ts": "int64", "total": "float64", "method": "int16",
+                                "counted": "bool", "has_details": "bool"})
+        self.details = _Columns({"order": "int32", "item": "int32", "quantity": "int32", "subtotal": "float64"})
+        self.order_index: Dict[str, int] = {}
+        self.methods: List[str] = []
+        self.items: List[str] = []
+        self._method_codes: Dict[str, int] = {}
+        self._item_codes: Dict[str, int] = {}
+        # Position in Analytics' event sequence this copy has caught up to,
+        # and the load and queue epoch it came from
+        self.upto = 0
+        self.load_id = 0
+        self.epoch = 0
+        self.loaded_at = 0.0
+
+    def _code(self, codes: Dict[str, int], names: List[str], value: str) -> int:
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(names)
+            names.append(value)
+        return code
+
+    def add_orders(self, rows: List[Dict]):
+        """Append orders not already held (an order can be both archived and live for a moment)"""
+        fresh = []
+        for row in rows:
+            if row["id"] not in self.order_index:
+                self.order_index[row["id"]] = self.orders.size + len(fresh)
+                fresh.append(row)
+        if not fresh:
+            return
+        self.orders.extend(
+            ts=_timestamps(fresh),
+            total=_floats([row.get("total") or "0" for row in fresh]),
+            method=[self._code(self._method_codes, self.methods, row.get("payment_method") or "") for row in fresh],
+            counted=[_counted(row) for row in fresh],
+            has_details=False
+        )
+
+    def add_details(self, rows: List[Dict]):
+        """
+        Append order details. An order's details are always written together,
+        so details of an order that already has some are a copy (archived and
+        live at once, or already read when the write was reported) and skipped.
+        """
+        has_details = self.orders["has_details"]
+        fresh, orders = [], []
+        for row in rows:
+            order = self.order_index.get(row["order_id"])
+            if order is not None and not has_details[order]:
+                fresh.append(row)
+                orders.append(order)
+        if not fresh:
+            return
+        self.details.extend(
+            order=orders,
+            item=[self._code(self._item_codes, self.items, row["menu_item_id"]) for row in fresh],
+            quantity=_floats([row.get("quantity") or "0" for row in fresh]).astype(np.int32),
+            subtotal=_floats([row.get("subtotal") or "0" for row in fresh])
+        )
+        has_details[orders] = True
+
+    def update_order(self, row: Dict):
+        order = self.order_index.get(row["id"])
+        if order is None:
+            return
+        self.orders["total"][order] = _floats([row.get("total") or "0"])[0]
+        self.orders["method"][order] = self._code(self._method_codes, self.methods, row.get("payment_method") or "")
+        self.orders["counted"][order] = _counted(row)
+
+    def load(self):
+        # Details are read before orders: a detail read then has its order
+        # read too, as orders are always written before their details
+        archived_orders, archived_details = [], []
+        for month in archive.archived_months():
+            archived_details += archive._read_segment(archive.get_segment_path("order_details", month))
+            archived_orders += archive._read_segment(archive.get_segment_path("orders", month))
+        details = list(db.iter_rows("order_details.csv"))
+        orders = list(db.iter_rows("orders.csv"))
+        self.add_orders(archived_orders)
+        self.add_details(archived_details)
+        self.add_orders(orders)
+        self.add_details(details)
+        self.loaded_at = time.monotonic()
+
+    def apply(self, events: List):
+        """Apply buffered writes, oldest first, a run of inserts at a time"""
+        i = 0
+        while i < len(events):
+            filename, op, before, after = events[i]
+            if op == "insert":
+                j = i
+                while j < len(events) and events[j][0] == filename and events[j][1] == "insert":
+                    j += 1
+                rows = [event[3] for event in events[i:j]]
+                if filename == "orders.csv":
+                    self.add_orders(rows)
+                else:
+                    self.add_details(rows)
+                i = j
+                continue
+            if op == "update" and filename == "orders.csv":
+                self.update_order(after)
+            # Deleted orders are archived ones, which stay part of the history
+            i += 1
+
+    def order_mask(self, date_from: Optional[str], date_to: Optional[str]) -> np.ndarray:
+        """Counted orders between two dates (inclusive, YYYY-MM-DD)"""
+        mask = self.orders["counted"].copy()
+        ts = self.orders["ts"]
+        mask &= ts != _NAT
+        if date_from:
+            mask &= ts >= np.datetime64(date_from, "s").astype(np.int64)
+        if date_to:
+            end = datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1)
+            mask &= ts < np.datetime64(end, "s").astype(np.int64)
+        return mask
+
+
+class Analytics:
+    """
+    The current OrderColumns plus the writes made since they were read
+
+    Write listeners only queue the row change (they run while the writer
+    holds the table lock, so they never wait for a report). Each report
+    first applies what is queued.
+    """
+
+    def __init__(self, resync: float = ANALYTICS_RESYNC, max_events: int = ANALYTICS_MAX_EVENTS):
+        self.resync = resync
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._events_lock = threading.Lock()
+        self._events: List = []
+        # Sequence number of _events[0]
+        self._events_base = 0
+        # Start positions of the copies being loaded, which need the events since
+        self._loading: Dict[int, int] = {}
+        self._load_ids = 0
+        # Bumped when queued events had to be dropped; copies loaded across it are stale
+        self._epoch = 0
+        self._columns: Optional[OrderColumns] = None
+        self._reloading = False
+        self.reloads = 0
+
+    def on_write(self, filename: str, op: str, before: Optional[Dict], after: Optional[Dict]):
+        with self._events_lock:
+            if self._columns is None and not self._loading:
+                return
+            if op == "write" or len(self._events) >= self.max_events:
+                # Rewritten table, or nobody asked for a report in a long while
+                self._events_base += len(self._events)
+                self._events = []
+                self._epoch += 1
+                return
+            self._events.append((filename, op, before, after))
+
+    def _pending(self, columns: OrderColumns) -> List:
+        """Events a copy has not applied yet; forgets those every copy has"""
+        with self._events_lock:
+            events = self._events[max(columns.upto - self._events_base, 0):]
+            columns.upto = self._events_base + len(self._events)
+            keep_from = min([columns.upto] + list(self._loading.values())) - self._events_base
+            if keep_from > 0:
+                self._events = self._events[keep_from:]
+                self._events_base += keep_from
+        return events
+
+    def _load(self) -> OrderColumns:
+        """Read a fresh copy, without holding _lock; its events are kept until _adopt or _discard"""
+        with self._events_lock:
+            self._load_ids += 1
+            load_id = self._load_ids
+            self._loading[load_id] = self._events_base + len(self._events)
+            epoch = self._epoch
+        columns = OrderColumns()
+        columns.load_id, columns.epoch = load_id, epoch
+        try:
+            columns.load()
+        except Exception:
+            self._discard(columns)
+            raise
+        with self._events_lock:
+            columns.upto = self._loading[load_id]
+        self.reloads += 1
+        return columns
+
+    def _discard(self, columns: OrderColumns):
+        with self._events_lock:
+            self._loading.pop(columns.load_id, None)
+
+    def _adopt(self, columns: OrderColumns):
+        """Catch a loaded copy up and make it current; call with _lock held"""
+        columns.apply(self._pending(columns))
+        self._discard(columns)
+        self._columns = columns
+
+    def _reload_in_background(self):
+        def job():
+            try:
+                columns = self._load()
+                with self._lock:
+                    if columns.epoch == self._epoch:
+                        self._adopt(columns)
+                    else:
+                        self._discard(columns)
+            except Exception as e:
+                print(f"Error reloading analytics: {e}")
+            finally:
+                self._reloading = False
+
+        self._reloading = True
+        threading.Thread(target=job, name="analytics-reload", daemon=True).start()
+
+    def columns(self) -> OrderColumns:
+        """The current copy, caught up with this process's writes; call with _lock held"""
+        columns = self._columns
+        if columns is None or columns.epoch != self._epoch:
+            columns = self._load()
+            while columns.epoch != self._epoch:
+                self._discard(columns)
+                columns = self._load()
+            self._adopt(columns)
+            return columns
+        if time.monotonic() - columns.loaded_at > self.resync and not self._reloading:
+            self._reload_in_background()
+        columns.apply(self._pending(columns))
+        return columns
+
+    def stats(self) -> Dict:
+        columns = self._columns
+        return {
+            "orders": columns.orders.size if columns else 0,
+            "orderDetails": columns.details.size if columns else 0,
+            "queuedWrites": len(self._events),
+            "reloads": self.reloads
+        }
+
+    # Reports. Each takes the date range (inclusive, YYYY-MM-DD, either may be None).
+
+    def heatmap(self, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict:
+        """Orders and revenue by day of week (Monday first) and hour of day"""
+        with self._lock:
+            columns = self.columns()
+            mask = columns.order_mask(date_from, date_to)
+            ts = columns.orders["ts"][mask]
+            slot = ((ts // 86400 + 3) % 7) * 24 + (ts // 3600) % 24
+            orders = np.bincount(slot, minlength=168).reshape(7, 24)
+            revenue = np.bincount(slot, weights=columns.orders["total"][mask], minlength=168).reshape(7, 24)
+        return {"orders": orders.tolist(), "revenue": np.round(revenue, 2).tolist()}
+
+    def basket_sizes(self, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict:
+        """How many orders had 1, 2, ... items (the last bucket is BASKET_SIZE_CAP or more)"""
+        with self._lock:
+            columns = self.columns()
+            mask = columns.order_mask(date_from, date_to)
+            items = np.bincount(columns.details["order"], weights=columns.details["quantity"],
+                                minlength=columns.orders.size)[mask].astype(np.int64)
+            counts = np.bincount(np.clip(items, 0, BASKET_SIZE_CAP), minlength=BASKET_SIZE_CAP + 1)
+        return {
+            "orders": int(mask.sum()),
+            "average": float(items.mean()) if items.size else 0.0,
+            "distribution": [{"items": size, "orders": int(counts[size])} for size in range(1, BASKET_SIZE_CAP + 1)]
+        }
+
+    def average_ticket(self, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict:
+        """Average order total overall, per payment method, day of week and hour"""
+        def averages(keys, totals, size):
+            count = np.bincount(keys, minlength=size)
+            revenue = np.bincount(keys, weights=totals, minlength=size)
+            return count, np.round(np.divide(revenue, count, out=np.zeros(size), where=count > 0), 2)
+
+        with self._lock:
+            columns = self.columns()
+            mask = columns.order_mask(date_from, date_to)
+            totals = columns.orders["total"][mask]
+            ts = columns.orders["ts"][mask]
+            method_counts, method_avg = averages(columns.orders["method"][mask], totals, len(columns.methods))
+            _, weekday_avg = averages((ts // 86400 + 3) % 7, totals, 7)
+            _, hour_avg = averages((ts // 3600) % 24, totals, 24)
+            methods = list(columns.methods)
+        return {
+            "orders": int(totals.size),
+            "revenue": round(float(totals.sum()), 2),
+            "average": round(float(totals.mean()), 2) if totals.size else 0.0,
+            "byMethod": [
+                {"method": method, "orders": int(method_counts[code]), "average": float(method_avg[code])}
+                for code, method in enumerate(methods) if method_counts[code]
+            ],
+            "byWeekday": weekday_avg.tolist(),
+            "byHour": hour_avg.tolist()
+        }
+
+    def category_mix(self, date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[Dict]:
+        """Quantity and revenue per menu category, with its share of the revenue"""
+        categories = {item["id"]: item.get("category") or "" for item in db.read_csv("menu_items.csv")}
+        with self._lock:
+            columns = self.columns()
+            names = sorted(set(categories.values()) | {""})
+            codes = {name: code for code, name in enumerate(names)}
+            item_category = np.array([codes[categories.get(item, "")] for item in columns.items] or [0], dtype=np.int32)
+            keep = columns.order_mask(date_from, date_to)[columns.details["order"]]
+            category = item_category[columns.details["item"][keep]]
+            quantity = np.bincount(category, weights=columns.details["quantity"][keep], minlength=len(names))
+            revenue = np.bincount(category, weights=columns.details["subtotal"][keep], minlength=len(names))
+        total = revenue.sum()
+        mix = [
+            {"category": name or "Khác", "quantity": int(quantity[code]), "revenue": round(float(revenue[code]), 2),
+             "share": round(float(revenue[code] / total), 4) if total else 0.0}
+            for code, name in enumerate(names) if quantity[code]
+        ]
+        mix.sort(key=lambda entry: entry["revenue"], reverse=True)
+        return mix
+
+
+engine = Analytics()
+db.add_listener("orders.csv", engine.on_write)
+db.add_listener("order_details.csv", engine.on_write)
+
+
+async def aheatmap(date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict:
+    return await db.arun(engine.heatmap, date_from, date_to)
+
+
+async def abasket_sizes(date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict:
+    return await db.arun(engine.basket_sizes, date_from, date_to)
+
+
+async def aaverage_ticket(date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict:
+    return await db.arun(engine.average_ticket, date_from, date_to)
+
+
+async def acategory_mix(date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[Dict]:
+    return await db.arun(engine.category_mix, date_from, date_to)
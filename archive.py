@@ -0,0 +1,254 @@
+"""
+Cold-data archival
+Moves completed, paid orders older than CAFE_ARCHIVE_AFTER_DAYS (with their
+order_details) out of the live tables into gzip-compressed monthly segments
+under data/archive/, keeping daily rollups of what was moved
+
+Usage:
+    python archive.py                 # archive with the configured age
+    python archive.py --days 180
+"""
+import argparse
+import csv
+import gzip
+import io
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import database as db
+from database import CSVSchemas
+from constants import OrderStatus, PaymentStatus
+
+# Orders are archived once their order date is this many days old
+ARCHIVE_AFTER_DAYS = int(os.environ.get("CAFE_ARCHIVE_AFTER_DAYS", 90))
+
+ARCHIVE_DIR = os.path.join(db.DATA_DIR, "archive")
+
+_job_lock = threading.Lock()
+_last_run: Dict = {}
+
+
+def get_segment_path(table: str, month: str) -> str:
+    """Get full path to one month's segment of "orders" or "order_details" """
+    return os.path.join(ARCHIVE_DIR, f"{table}-{month}.csv.gz")
+
+
+def _read_segment(path: str) -> List[Dict]:
+    if not os.path.exists(path):
+        return []
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def _write_segment(path: str, rows: List[Dict], fieldnames: List[str]):
+    """Write a whole segment to disk, replacing the old one only once the new one is complete"""
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as gz, \
+                    io.TextIOWrapper(gz, encoding="utf-8", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                writer.writeheader()
+                writer.writerows(rows)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def archived_months() -> List[str]:
+    """Months (YYYY-MM) that have archived orders, oldest first"""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    return sorted(
+        name[len("orders-"):-len(".csv.gz")]
+        for name in os.listdir(ARCHIVE_DIR)
+        if name.startswith("orders-") and name.endswith(".csv.gz")
+    )
+
+
+def _merge_segments(month: str, orders: List[Dict], details: List[Dict]):
+    """
+    Add orders and their details to a month's segments and return everything
+    the segments now hold. An order already archived is replaced rather than
+    duplicated, so running again after an interrupted job is harmless.
+    """
+    ids = {order["id"] for order in orders}
+    all_orders = [o for o in _read_segment(get_segment_path("orders", month)) if o["id"] not in ids] + orders
+    all_details = [d for d in _read_segment(get_segment_path("order_details", month))
+                   if d["order_id"] not in ids] + details
+    _write_segment(get_segment_path("order_details", month), all_details, CSVSchemas.ORDER_DETAILS)
+    _write_segment(get_segment_path("orders", month), all_orders, CSVSchemas.ORDERS)
+    return all_orders, all_details
+
+
+def _rollups(orders: List[Dict], details: List[Dict]):
+    """Daily revenue (per payment method) and item sales of archived rows"""
+    revenue = {}
+    for order in orders:
+        key = (order["date"], order.get("payment_method") or "")
+        count, total = revenue.get(key, (0, 0.0))
+        revenue[key] = (count + 1, total + (db._decode_row("orders.csv", order)["total"] or 0.0))
+    order_dates = {order["id"]: order["date"] for order in orders}
+    sales = {}
+    for detail in details:
+        typed = db._decode_row("order_details.csv", detail)
+        key = (order_dates.get(detail["order_id"], ""), detail["menu_item_id"])
+        quantity, amount = sales.get(key, (0, 0.0))
+        sales[key] = (quantity + (typed["quantity"] or 0), amount + (typed["subtotal"] or 0.0))
+    revenue_rows = [
+        {"date": date, "payment_method": method, "orders": str(count), "revenue": f"{total:.2f}"}
+        for (date, method), (count, total) in sorted(revenue.items())
+    ]
+    sales_rows = [
+        {"date": date, "menu_item_id": item_id, "quantity": str(quantity), "revenue": f"{amount:.2f}"}
+        for (date, item_id), (quantity, amount) in sorted(sales.items())
+    ]
+    return revenue_rows, sales_rows
+
+
+def _archive_month(month: str, orders: List[Dict]) -> int:
+    """Archive one month's orders; returns how many order_details rows went with them"""
+    ids = [order["id"] for order in orders]
+    details_by_order = db.group_by("order_details.csv", "order_id", ids)
+    details = [detail for order_id in ids for detail in details_by_order[order_id]]
+
+    # The slow part (compressing) runs without holding any table
+    all_orders, all_details = _merge_segments(month, orders, details)
+    revenue_rows, sales_rows = _rollups(all_orders, all_details)
+    dates = sorted({order["date"] for order in all_orders})
+
+    # One transaction swaps the month's rollups for the new totals and drops
+    # the archived rows, so the numbers never count an order twice or not at all
+    tx = db.Transaction()
+    tx.delete_many("archived_revenue.csv", "date", dates, CSVSchemas.ARCHIVED_REVENUE)
+    tx.append_many("archived_revenue.csv", revenue_rows, CSVSchemas.ARCHIVED_REVENUE)
+    tx.delete_many("archived_item_sales.csv", "date", dates, CSVSchemas.ARCHIVED_ITEM_SALES)
+    tx.append_many("archived_item_sales.csv", sales_rows, CSVSchemas.ARCHIVED_ITEM_SALES)
+    tx.delete_many("order_details.csv", "order_id", ids, CSVSchemas.ORDER_DETAILS)
+    tx.delete_many("orders.csv", "id", ids, CSVSchemas.ORDERS)
+    tx.commit()
+    return len(details)
+
+
+def run_archive(older_than_days: int = ARCHIVE_AFTER_DAYS, today: Optional[datetime] = None) -> Dict:
+    """
+    Archive completed, paid orders whose date is older than older_than_days
+
+    Args:
+        older_than_days: Minimum age of an archived order, in days
+        today: Date the age is counted from (default: now)
+
+    Returns:
+        {"orders": n, "orderDetails": n, "months": [...], "seconds": s}
+    """
+    if not _job_lock.acquire(blocking=False):
+        raise RuntimeError("An archive job is already running")
+    try:
+        started = time.perf_counter()
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        # Also keeps out a job started by another worker process
+        with db._locked_file(os.path.join(ARCHIVE_DIR, ".lock")):
+            last_day = ((today or datetime.now()) - timedelta(days=older_than_days + 1)).strftime("%Y-%m-%d")
+            orders, _ = db.query(
+                "orders.csv",
+                filters={"status": OrderStatus.COMPLETED, "payment_status": PaymentStatus.PAID},
+                ranges={"date": (None, last_day)}
+            )
+            by_month: Dict[str, List[Dict]] = {}
+            for order in orders:
+                by_month.setdefault(order["date"][:7], []).append(order)
+            details = 0
+            for month in sorted(by_month):
+                details += _archive_month(month, by_month[month])
+        result = {
+            "orders": len(orders),
+            "orderDetails": details,
+            "months": sorted(by_month),
+            "seconds": round(time.perf_counter() - started, 3)
+        }
+        _last_run.clear()
+        _last_run.update(result, finishedAt=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        print(f"Archived {result['orders']} orders ({details} order details) from {len(by_month)} month(s)")
+        return result
+    finally:
+        _job_lock.release()
+
+
+def start_archive(older_than_days: int = ARCHIVE_AFTER_DAYS) -> bool:
+    """Run the archive job on a background thread; False if one is already running"""
+    if _job_lock.locked():
+        return False
+
+    def job():
+        try:
+            run_archive(older_than_days)
+        except Exception as e:
+            print(f"Error archiving orders: {e}")
+
+    threading.Thread(target=job, name="archive", daemon=True).start()
+    return True
+
+
+def stats() -> Dict:
+    return {
+        "running": _job_lock.locked(),
+        "afterDays": ARCHIVE_AFTER_DAYS,
+        "months": archived_months(),
+        "lastRun": dict(_last_run) or None
+    }
+
+
+def read_orders(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                customer_email: Optional[str] = None) -> List[Dict]:
+    """
+    Archived orders between two dates (inclusive, YYYY-MM-DD), oldest first,
+    decoded like typed reads and each with its "details" rows. Only the
+    segments of the months in range are opened.
+    """
+    result = []
+    for month in archived_months():
+        if (date_from and month < date_from[:7]) or (date_to and month > date_to[:7]):
+            continue
+        orders = [
+            order for order in _read_segment(get_segment_path("orders", month))
+            if (not date_from or order["date"] >= date_from)
+            and (not date_to or order["date"] <= date_to)
+            and (not customer_email or order["customer_email"] == customer_email)
+        ]
+        if not orders:
+            continue
+        details_by_order: Dict[str, List[Dict]] = {}
+        for detail in _read_segment(get_segment_path("order_details", month)):
+            details_by_order.setdefault(detail["order_id"], []).append(detail)
+        for order in orders:
+            typed = db._decode_row("orders.csv", order)
+            typed["details"] = db._decode_rows("order_details.csv", details_by_order.get(order["id"], []))
+            result.append(typed)
+    result.sort(key=lambda order: (order["date"], order.get("created_at") or ""))
+    return result
+
+
+async def aread_orders(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                       customer_email: Optional[str] = None) -> List[Dict]:
+    """Async read_orders"""
+    return await db.arun(read_orders, date_from, date_to, customer_email)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive old completed orders")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS,
+                        help=f"minimum order age in days (default: {ARCHIVE_AFTER_DAYS})")
+    args = parser.parse_args(argv)
+    db.migrate_tables()
+    db.recover_transactions()
+    run_archive(args.days)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+"""
+Attendance
+Clock-in and clock-out through an in-memory map of open sessions and the
+(staff_email, date) index of attendance.csv, and each staff member's
+hours, shifts, late and absent counts per ISO week and per month kept in
+attendance_totals.csv in the same transaction as the attendance record,
+so neither a tap nor the payroll report scans attendance.csv
+
+A clock-in past the start of the staff member's shift (the "schedule" of
+staff.csv, else CAFE_SHIFT_SCHEDULE) plus the grace period is recorded as
+late; scheduled days with no record are written as absent by
+mark_absences, which the payroll report runs over its dates first.
+
+Usage:
+    python attendance.py rebuild      # recompute attendance_totals.csv
+    python attendance.py absences --from 2025-11-01 --to 2025-11-30
+"""
+import argparse
+import os
+import threading
+from datetime import date, datetime, time, timedelta
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+import database as db
+from database import CSVSchemas
+from constants import AttendanceStatus
+
+# Payroll periods, as attendance_totals.csv "kind"
+PERIODS = ("week", "month")
+
+# Shift of staff with no schedule in staff.csv, written like that column:
+# weekdays, then start and end time
+DEFAULT_SHIFT = os.environ.get("CAFE_SHIFT_SCHEDULE", "Mon-Fri, 8AM-4PM")
+
+# Minutes after the start of the shift a clock-in still counts as on time
+LATE_GRACE_MINUTES = int(os.environ.get("CAFE_LATE_GRACE_MINUTES", 10))
+
+# Days back from yesterday mark_absences looks at when given no start date
+ABSENCE_LOOKBACK_DAYS = int(os.environ.get("CAFE_ABSENCE_LOOKBACK_DAYS", 31))
+
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+# Held from looking up a staff member's open session until the transaction
+# recording the tap is applied. The thread lock orders this process's
+# writers, the file lock other worker processes.
+_lock = threading.Lock()
+
+
+def _lock_path() -> str:
+    # Not attendance.csv.lock, which db.locked_tables takes while applying
+    return db.get_csv_path("attendance.csv") + ".sessions.lock"
+
+
+def period_key(kind: str, date: str) -> str:
+    """"2025-W47" (ISO week) or "2025-11" (month) of a YYYY-MM-DD date"""
+    if kind == "month":
+        return date[:7]
+    year, week, _ = datetime.strptime(date[:10], "%Y-%m-%d").isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def _parse_time(text: str) -> time:
+    for fmt in ("%I%p", "%I:%M%p", "%H:%M"):
+        try:
+            return datetime.strptime(text.strip().upper(), fmt).time()
+        except ValueError:
+            pass
+    raise ValueError(f"Unknown time {text!r}")
+
+
+def parse_schedule(schedule: str) -> Optional[Tuple[FrozenSet[int], time]]:
+    """
+    Weekdays (0 = Monday) and start time of a schedule like
+    "Mon-Fri, 6AM-2PM" or "Sat, 10:00-18:00"; None if it does not parse
+    """
+    try:
+        days, hours = schedule.split(",", 1)
+        first, _, last = days.strip().partition("-")
+        start = WEEKDAYS.index(first.strip()[:3].title())
+        end = WEEKDAYS.index(last.strip()[:3].title()) if last else start
+        weekdays = frozenset((start + offset) % 7 for offset in range((end - start) % 7 + 1))
+        return weekdays, _parse_time(hours.split("-")[0])
+    except ValueError:
+        return None
+
+
+def shift_of(staff_email: str) -> Optional[Tuple[FrozenSet[int], time]]:
+    """A staff member's shift days and start time, from staff.csv or DEFAULT_SHIFT"""
+    member = db.find_one("staff.csv", "email", staff_email)
+    shift = parse_schedule(member.get("schedule") or "") if member else None
+    return shift or parse_schedule(DEFAULT_SHIFT)
+
+
+def tap_status(staff_email: str, now: datetime) -> str:
+    """LATE for a clock-in past the start of today's shift plus the grace period, else PRESENT"""
+    shift = shift_of(staff_email)
+    if shift is not None and now.weekday() in shift[0]:
+        deadline = datetime.combine(now.date(), shift[1]) + timedelta(minutes=LATE_GRACE_MINUTES)
+        if now > deadline:
+            return AttendanceStatus.LATE
+    return AttendanceStatus.PRESENT
+
+
+def _is_open(record: Dict) -> bool:
+    """Clocked in and not out yet (absent records have neither)"""
+    return not record.get("clockOut") and record.get("status") != AttendanceStatus.ABSENT
+
+
+class OpenSessions:
+    """
+    Attendance records not clocked out yet, as (staff email, date) -> id,
+    fed by the writes to attendance.csv
+
+    Loaded on first use and dropped by a bulk write. Sessions opened by other
+    worker processes are not in the map; lookups that miss it fall back to
+    the (staff_email, date) index.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions: Optional[Dict[Tuple[str, str], str]] = None
+        self._writes = 0
+
+    def get(self, staff_email: str, date: str) -> Optional[str]:
+        with self._lock:
+            if self._sessions is not None:
+                return self._sessions.get((staff_email, date))
+            writes = self._writes
+        # Read without holding our lock: on_write takes it while the writer
+        # holds the table's lock
+        rows, _ = db.query("attendance.csv", filters={"clockOut": ""})
+        sessions = {(row["staff_email"], row["date"]): row["id"] for row in rows if _is_open(row)}
+        with self._lock:
+            # A write made while reading may or may not be in what was read
+            if self._writes == writes:
+                self._sessions = sessions
+        return sessions.get((staff_email, date))
+
+    def on_write(self, filename: str, op: str, before: Optional[Dict], after: Optional[Dict]):
+        with self._lock:
+            self._writes += 1
+            if self._sessions is None:
+                return
+            if op == "write":
+                self._sessions = None
+                return
+            if before is not None and _is_open(before):
+                self._sessions.pop((before.get("staff_email"), before.get("date")), None)
+            if after is not None and _is_open(after):
+                self._sessions[(after.get("staff_email"), after.get("date"))] = after["id"]
+
+
+open_sessions = OpenSessions()
+db.add_listener("attendance.csv", open_sessions.on_write)
+
+
+def open_record(staff_email: str, date: str) -> Optional[Dict]:
+    """A staff member's record of a day that is not clocked out yet, if any"""
+    record_id = open_sessions.get(staff_email, date)
+    if record_id is not None:
+        # Another worker process may have closed it since
+        record = db.find_one("attendance.csv", "id", record_id)
+        if record is not None and _is_open(record):
+            return record
+    rows, _ = db.query("attendance.csv", filters={"staff_email": staff_email, "date": date, "clockOut": ""})
+    rows = [row for row in rows if _is_open(row)]
+    return rows[0] if rows else None
+
+
+# Deltas map attendance_totals.csv id -> [key columns, hours, shifts, late, absent]
+
+def _record_deltas(deltas: Dict, record: Optional[Dict], sign: int):
+    """Add (sign=1) or take away (sign=-1) a record's hours and counts; absences are not shifts"""
+    if record is None:
+        return
+    try:
+        periods = [(kind, period_key(kind, record.get("date") or "")) for kind in PERIODS]
+    except ValueError:
+        return
+    hours = db._decode_row("attendance.csv", record)["hours"] or 0.0
+    status = record.get("status")
+    for kind, period in periods:
+        key = f"{record['staff_email']} {period}"
+        delta = deltas.setdefault(key, [
+            {"id": key, "staff_email": record["staff_email"], "kind": kind, "period": period}, 0.0, 0, 0, 0
+        ])
+        delta[1] += sign * hours
+        delta[2] += sign * (status != AttendanceStatus.ABSENT)
+        delta[3] += sign * (status == AttendanceStatus.LATE)
+        delta[4] += sign * (status == AttendanceStatus.ABSENT)
+
+
+def _format(hours: float, shifts: int, late: int, absent: int) -> Dict:
+    return {"hours": f"{hours:.2f}", "shifts": str(shifts), "late": str(late), "absent": str(absent)}
+
+
+def total_rows(records) -> List[Dict]:
+    """attendance_totals.csv rows of the given attendance records"""
+    deltas: Dict = {}
+    for record in records:
+        _record_deltas(deltas, record, 1)
+    return [{**columns, **_format(*totals)} for _, (columns, *totals) in sorted(deltas.items())]
+
+
+def _add_to_totals(tx: db.Transaction, deltas: Dict):
+    """Queue on tx the attendance_totals.csv rows the deltas move, as absolute values"""
+    for key, (columns, hours, shifts, late, absent) in deltas.items():
+        if not round(hours, 2) and not shifts and not late and not absent:
+            continue
+        current = db.find_one("attendance_totals.csv", "id", key, typed=True)
+        if current is None:
+            tx.append_csv("attendance_totals.csv", {**columns, **_format(hours, shifts, late, absent)},
+                          CSVSchemas.ATTENDANCE_TOTALS)
+        else:
+            tx.update_csv("attendance_totals.csv", "id", key, _format(
+                (current["hours"] or 0.0) + hours,
+                (current["shifts"] or 0) + shifts,
+                (current["late"] or 0) + late,
+                (current["absent"] or 0) + absent
+            ), CSVSchemas.ATTENDANCE_TOTALS)
+
+
+def clock_in(staff_email: str, now: Optional[datetime] = None) -> Tuple[Optional[Dict], Optional[Dict]]:
+    """
+    Open an attendance record for today
+
+    Args:
+        staff_email: Email of the staff member
+        now: Time of the tap (default: now)
+
+    Returns:
+        (new record, None), or (None, open record) if already clocked in today
+    """
+    now = now or datetime.now()
+    date = now.strftime("%Y-%m-%d")
+    with _lock, db._locked_file(_lock_path()):
+        current = open_record(staff_email, date)
+        if current is not None:
+            return None, current
+        record = {
+            "id": db.next_sequence("attendance.csv"),
+            "staff_email": staff_email,
+            "date": date,
+            "clockIn": now.strftime("%H:%M:%S"),
+            "clockOut": "",
+            "hours": "0",
+            "status": tap_status(staff_email, now)
+        }
+        deltas: Dict = {}
+        _record_deltas(deltas, record, 1)
+        tx = db.Transaction()
+        tx.append_csv("attendance.csv", record, CSVSchemas.ATTENDANCE)
+        _add_to_totals(tx, deltas)
+        tx.commit()
+        return record, None
+
+
+def clock_out(staff_email: str, now: Optional[datetime] = None) -> Optional[Dict]:
+    """
+    Close today's open attendance record, with the hours worked
+
+    Args:
+        staff_email: Email of the staff member
+        now: Time of the tap (default: now)
+
+    Returns:
+        The record as closed, or None if not clocked in today
+    """
+    now = now or datetime.now()
+    date = now.strftime("%Y-%m-%d")
+    with _lock, db._locked_file(_lock_path()):
+        before = open_record(staff_email, date)
+        if before is None:
+            return None
+        clock_in_time = datetime.strptime(f"{date} {before['clockIn']}", "%Y-%m-%d %H:%M:%S")
+        updates = {
+            "clockOut": now.strftime("%H:%M:%S"),
+            "hours": str(round((now - clock_in_time).total_seconds() / 3600, 2))
+        }
+        after = {**before, **updates}
+        deltas: Dict = {}
+        _record_deltas(deltas, before, -1)
+        _record_deltas(deltas, after, 1)
+        tx = db.Transaction()
+        tx.update_csv("attendance.csv", "id", before["id"], updates, CSVSchemas.ATTENDANCE)
+        _add_to_totals(tx, deltas)
+        tx.commit()
+        return after
+
+
+def mark_absences(date_from: Optional[str] = None, date_to: Optional[str] = None) -> int:
+    """
+    Write an absent record for each shift day of each staff account with no
+    attendance record, from the staff member's first record on
+
+    Args:
+        date_from: First day (YYYY-MM-DD) to check (default: ABSENCE_LOOKBACK_DAYS before date_to)
+        date_to: Last day (YYYY-MM-DD) to check; never later than yesterday
+
+    Returns:
+        How many absent records were written
+    """
+    yesterday = date.today() - timedelta(days=1)
+    last = min(datetime.strptime(date_to, "%Y-%m-%d").date(), yesterday) if date_to else yesterday
+    first = (datetime.strptime(date_from, "%Y-%m-%d").date() if date_from
+             else last - timedelta(days=ABSENCE_LOOKBACK_DAYS - 1))
+    with _lock, db._locked_file(_lock_path()):
+        records = []
+        for user in db.find_all("users.csv", "role", "staff"):
+            staff_email = user["email"]
+            shift = shift_of(staff_email)
+            earliest, _ = db.query("attendance.csv", filters={"staff_email": staff_email}, sort="date", limit=1)
+            if shift is None or not earliest:
+                continue
+            day = max(first, datetime.strptime(earliest[0]["date"], "%Y-%m-%d").date())
+            while day <= last:
+                day_text = day.strftime("%Y-%m-%d")
+                if day.weekday() in shift[0]:
+                    seen, _ = db.query("attendance.csv", filters={"staff_email": staff_email, "date": day_text},
+                                       limit=1)
+                    if not seen:
+                        records.append({
+                            "id": db.next_sequence("attendance.csv"),
+                            "staff_email": staff_email,
+                            "date": day_text,
+                            "clockIn": "",
+                            "clockOut": "",
+                            "hours": "0",
+                            "status": AttendanceStatus.ABSENT
+                        })
+                day += timedelta(days=1)
+        if records:
+            deltas: Dict = {}
+            for record in records:
+                _record_deltas(deltas, record, 1)
+            tx = db.Transaction()
+            tx.append_many("attendance.csv", records, CSVSchemas.ATTENDANCE)
+            _add_to_totals(tx, deltas)
+            tx.commit()
+    return len(records)
+
+
+async def aclock_in(staff_email: str) -> Tuple[Optional[Dict], Optional[Dict]]:
+    """Async clock_in"""
+    return await db.arun(clock_in, staff_email)
+
+
+async def aclock_out(staff_email: str) -> Optional[Dict]:
+    """Async clock_out"""
+    return await db.arun(clock_out, staff_email)
+
+
+def payroll(kind: str = "week", date_from: Optional[str] = None, date_to: Optional[str] = None,
+            staff_email: Optional[str] = None) -> Dict:
+    """
+    Hours, shifts, late and absent counts per staff member and period, from
+    attendance_totals.csv alone
+
+    Args:
+        kind: "week" or "month"
+        date_from: First day (YYYY-MM-DD) whose period is included
+        date_to: Last day (YYYY-MM-DD) whose period is included
+        staff_email: Only this staff member
+
+    Returns:
+        {"period": kind, "staff": [{"staff_email", "name", "hours", "shifts",
+        "late", "absent", "periods": [...]}]}, periods oldest first
+    """
+    low = period_key(kind, date_from) if date_from else None
+    high = period_key(kind, date_to) if date_to else None
+    filters = {"kind": kind}
+    if staff_email:
+        filters["staff_email"] = staff_email
+    rows, _ = db.query("attendance_totals.csv", filters=filters, ranges={"period": (low, high)},
+                       sort="period", typed=True)
+    names = {member["email"]: member["name"] for member in db.read_csv("staff.csv")}
+    staff: Dict[str, Dict] = {}
+    for row in rows:
+        member = staff.setdefault(row["staff_email"], {
+            "staff_email": row["staff_email"], "name": names.get(row["staff_email"], ""),
+            "hours": 0.0, "shifts": 0, "late": 0, "absent": 0, "periods": []
+        })
+        period = {"period": row["period"], "hours": row["hours"] or 0.0, "shifts": row["shifts"] or 0,
+                  "late": row["late"] or 0, "absent": row["absent"] or 0}
+        member["periods"].append(period)
+        for field in ("hours", "shifts", "late", "absent"):
+            member[field] += period[field]
+    for member in staff.values():
+        member["hours"] = round(member["hours"], 2)
+    return {"period": kind, "staff": [staff[email] for email in sorted(staff)]}
+
+
+async def amark_absences(date_from: Optional[str] = None, date_to: Optional[str] = None) -> int:
+    """Async mark_absences"""
+    return await db.arun(mark_absences, date_from, date_to)
+
+
+async def apayroll(kind: str = "week", date_from: Optional[str] = None, date_to: Optional[str] = None,
+                   staff_email: Optional[str] = None) -> Dict:
+    """Async payroll"""
+    return await db.arun(payroll, kind, date_from, date_to, staff_email)
+
+
+def rebuild() -> int:
+    """Recompute attendance_totals.csv from attendance.csv; returns how many rows it now holds"""
+    with _lock, db._locked_file(_lock_path()):
+        rows = total_rows(db.iter_rows("attendance.csv"))
+        db.write_csv("attendance_totals.csv", rows, CSVSchemas.ATTENDANCE_TOTALS)
+    print(f"Rebuilt attendance totals: {len(rows)} staff periods")
+    return len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Attendance totals maintenance")
+    parser.add_argument("command", choices=["rebuild", "absences"])
+    parser.add_argument("--from", dest="date_from", help="First day to mark absences for (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", help="Last day to mark absences for (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+    db.migrate_tables()
+    db.recover_transactions()
+    if args.command == "absences":
+        print(f"Marked {mark_absences(args.date_from, args.date_to)} absence(s)")
+    else:
+        rebuild()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,16 +2,123 @@
 Authentication and authorization utilities
 Provides decorators and dependencies for role-based access control
 """
+import os
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
 from fastapi import Request, HTTPException, Depends
-from typing import Optional, List
+from typing import Dict, Optional, List, Tuple
 import database as db
 from constants import UserRole
 
+# Seconds a cached user is served for (bounds how long a change made by
+# another worker process goes unseen)
+USER_CACHE_TTL = float(os.environ.get("CAFE_USER_CACHE_TTL", 30))
+
+# Most users kept in the cache, least recently used dropped first
+USER_CACHE_SIZE = int(os.environ.get("CAFE_USER_CACHE_SIZE", 1024))
+
+
+class UserCache:
+    """
+    users.csv rows of signed-in users by email, so resolving the session's
+    user reads no file in the common case
+
+    A write to users.csv (registration, password reset, role change) drops
+    the users it touches through the write listeners; a user read while
+    users.csv was being written is handed out but not kept.
+    """
+
+    def __init__(self, ttl: float = USER_CACHE_TTL, size: int = USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self._lock = threading.Lock()
+        self._users: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._writes = 0
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, email: str) -> Tuple[Optional[Dict], int]:
+        """(copy of the cached user or None on a miss, write count to pass to put)"""
+        with self._lock:
+            cached = self._users.get(email)
+            if cached is not None and time.monotonic() - cached[0] <= self.ttl:
+                self._users.move_to_end(email)
+                self._hits += 1
+                return dict(cached[1]), self._writes
+            self._misses += 1
+            return None, self._writes
+
+    def put(self, email: str, user: Optional[Dict], writes: int):
+        """Keep a user read from users.csv, unless users.csv was written since get"""
+        if user is None:
+            return
+        with self._lock:
+            if self._writes != writes:
+                return
+            self._users[email] = (time.monotonic(), dict(user))
+            self._users.move_to_end(email)
+            while len(self._users) > self.size:
+                self._users.popitem(last=False)
+
+    def load(self, email: str) -> Optional[Dict]:
+        """The user with this email, from the cache or users.csv"""
+        user, writes = self.get(email)
+        if user is None:
+            # Read without holding our lock: on_write takes it while the
+            # writer holds the table's lock
+            user = db.find_one("users.csv", "email", email)
+            self.put(email, user, writes)
+        return user
+
+    async def aload(self, email: str) -> Optional[Dict]:
+        """Async load (a cache hit stays on the event loop)"""
+        user, writes = self.get(email)
+        if user is None:
+            user = await db.afind_one("users.csv", "email", email)
+            self.put(email, user, writes)
+        return user
+
+    def on_write(self, filename: str, op: str, before: Optional[Dict], after: Optional[Dict]):
+        with self._lock:
+            self._writes += 1
+            if op == "write":
+                self._users.clear()
+                return
+            for row in (before, after):
+                if row is not None:
+                    self._users.pop(row.get("email"), None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "ttl": self.ttl,
+                "size": self.size,
+                "cached": len(self._users),
+                "hits": self._hits,
+                "misses": self._misses
+            }
+
+
+users = UserCache()
+db.add_listener("users.csv", users.on_write)
+
+
+def _memoized(request: Request, email: str) -> Optional[dict]:
+    """The user already resolved for this request's session email, if any"""
+    memo = getattr(request.state, "current_user", None)
+    if memo is not None and memo[0] == email:
+        return memo[1]
+    return None
+
 
 def get_current_user(request: Request) -> Optional[dict]:
     """
     Get current authenticated user from session
+
+    Resolved once per request (dependencies and handler share it) and
+    served from the user cache across requests.
     
     Args:
         request: FastAPI request object
@@ -21,7 +128,30 @@ def get_current_user(request: Request) -> Optional[dict]:
     """
     user_email = request.session.get("user_email")
     if user_email:
-        user = db.find_one("users.csv", "email", user_email)
+        user = _memoized(request, user_email)
+        if user is None:
+            user = users.load(user_email)
+            request.state.current_user = (user_email, user)
+        return user
+    return None
+
+
+async def aget_current_user(request: Request) -> Optional[dict]:
+    """
+    Async version of get_current_user for use inside async handlers
+
+    Args:
+        request: FastAPI request object
+
+    Returns:
+        User dict if authenticated, None otherwise
+    """
+    user_email = request.session.get("user_email")
+    if user_email:
+        user = _memoized(request, user_email)
+        if user is None:
+            user = await users.aload(user_email)
+            request.state.current_user = (user_email, user)
         return user
     return None
 
@@ -0,0 +1,399 @@
+"""
+End-to-end load benchmark
+Drives the real FastAPI app in-process with a customer/staff/manager request
+mix and reports latency percentiles and throughput per route
+
+Usage:
+    python generate_data.py --scale medium --out bench_data
+    python benchmark.py --data bench_data --duration 30 --concurrency 16 --json after.json
+    python benchmark.py --compare before.json after.json
+
+The data directory is copied to a temporary directory first, so the write
+requests never touch the generated set. Storage settings are taken from the
+environment as usual (CAFE_STORAGE_MODE, CAFE_STORAGE_BACKEND, ...).
+Requires httpx (pip install httpx).
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Accounts created by generate_data.py (and shipped in data/)
+ACCOUNTS = {
+    "customer": ("customer@demo.com", "customer123"),
+    "staff": ("staff@demo.com", "staff123"),
+    "manager": ("manager@demo.com", "manager123"),
+}
+
+# Share of virtual users per role
+DEFAULT_MIX = {"customer": 60, "staff": 30, "manager": 10}
+
+# Actions per role and their relative weights
+ROLE_ACTIONS = {
+    "customer": [
+        ("menu", 30), ("orders", 20), ("customer_order", 15), ("promotions", 10),
+        ("reservations", 10), ("tables", 15),
+    ],
+    "staff": [
+        ("orders", 25), ("tables", 15), ("staff_order", 15), ("update_status", 10),
+        ("payment", 10), ("inventory", 10), ("attendance", 5), ("shift_report", 5), ("menu", 5),
+    ],
+    "manager": [
+        ("revenue", 20), ("popular_items", 20), ("orders", 20), ("staff", 10),
+        ("customers", 10), ("feedback", 10), ("inventory", 10),
+    ],
+}
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _summary(latencies: List[float], statuses: Dict[int, int], errors: int, elapsed: float) -> Dict:
+    values = sorted(latencies)
+    count = len(values)
+    return {
+        "count": count,
+        "errors": errors,
+        "statuses": {str(code): n for code, n in sorted(statuses.items())},
+        "rps": count / elapsed if elapsed else 0.0,
+        "mean_ms": sum(values) / count * 1000 if count else 0.0,
+        "p50_ms": _percentile(values, 50) * 1000,
+        "p95_ms": _percentile(values, 95) * 1000,
+        "p99_ms": _percentile(values, 99) * 1000,
+        "max_ms": values[-1] * 1000 if values else 0.0,
+    }
+
+
+class Recorder:
+    """Collects latencies and status codes per route"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Dict[int, int]] = {}
+        self.errors: Dict[str, int] = {}
+        self.recording = False
+
+    def add(self, route: str, seconds: float, status: Optional[int]):
+        if not self.recording:
+            return
+        self.latencies.setdefault(route, []).append(seconds)
+        statuses = self.statuses.setdefault(route, {})
+        statuses[status or 0] = statuses.get(status or 0, 0) + 1
+        # 4xx answers are part of the workload (e.g. a shift report with open
+        # orders); only server errors and transport failures count as errors
+        if status is None or status >= 500:
+            self.errors[route] = self.errors.get(route, 0) + 1
+
+    def report(self, elapsed: float) -> Dict:
+        routes = {
+            route: _summary(self.latencies[route], self.statuses[route], self.errors.get(route, 0), elapsed)
+            for route in sorted(self.latencies)
+        }
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        all_statuses: Dict[int, int] = {}
+        for statuses in self.statuses.values():
+            for code, n in statuses.items():
+                all_statuses[code] = all_statuses.get(code, 0) + n
+        return {"routes": routes,
+                "total": _summary(all_latencies, all_statuses, sum(self.errors.values()), elapsed)}
+
+
+class VirtualUser:
+    """One logged-in client issuing a role's request mix"""
+
+    def __init__(self, client, role: str, rng: random.Random, recorder: Recorder, shared: Dict):
+        self.client = client
+        self.role = role
+        self.rng = rng
+        self.recorder = recorder
+        self.shared = shared
+        actions = ROLE_ACTIONS[role]
+        self.actions = [name for name, _ in actions]
+        self.weights = [weight for _, weight in actions]
+
+    async def request(self, route: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except Exception:
+            self.recorder.add(route, time.perf_counter() - started, None)
+            return None
+        self.recorder.add(route, time.perf_counter() - started, response.status_code)
+        return response
+
+    async def login(self):
+        email, password = ACCOUNTS[self.role]
+        response = await self.client.post("/login", data={"email": email, "password": password})
+        if response.status_code != 200:
+            raise RuntimeError(f"Login as {email} failed: {response.status_code} {response.text[:200]}")
+
+    def _cart(self) -> List[Dict]:
+        menu = self.shared["menu"]
+        return [{"id": item["id"], "name": item["name"], "price": item["price"],
+                 "quantity": self.rng.choice([1, 1, 1, 2])}
+                for item in self.rng.sample(menu, min(len(menu), self.rng.randint(1, 4)))]
+
+    def _recent_order(self) -> Optional[str]:
+        orders = self.shared["orders"]
+        return self.rng.choice(orders[-200:]) if orders else None
+
+    async def step(self):
+        action = self.rng.choices(self.actions, self.weights)[0]
+        if action == "menu":
+            await self.request("GET /api/menu-items", "GET", "/api/menu-items")
+        elif action == "orders":
+            await self.request("GET /api/orders", "GET", "/api/orders")
+        elif action == "tables":
+            await self.request("GET /api/tables", "GET", "/api/tables")
+        elif action == "promotions":
+            await self.request("GET /api/promotions", "GET", "/api/promotions")
+        elif action == "reservations":
+            await self.request("GET /api/reservations", "GET", "/api/reservations")
+        elif action == "inventory":
+            await self.request("GET /api/inventory", "GET", "/api/inventory")
+        elif action == "attendance":
+            await self.request("GET /api/attendance", "GET", "/api/attendance")
+        elif action == "revenue":
+            await self.request("GET /api/revenue", "GET", "/api/revenue")
+        elif action == "popular_items":
+            await self.request("GET /api/popular-items", "GET", "/api/popular-items")
+        elif action == "staff":
+            await self.request("GET /api/staff", "GET", "/api/staff")
+        elif action == "customers":
+            await self.request("GET /api/customers", "GET", "/api/customers")
+        elif action == "feedback":
+            await self.request("GET /api/feedback", "GET", "/api/feedback")
+        elif action == "customer_order":
+            response = await self.request("POST /api/customer/create-order", "POST", "/api/customer/create-order",
+                                          json={"items": self._cart()})
+            self._remember_order(response)
+        elif action == "staff_order":
+            items = self._cart()
+            subtotal = sum(item["price"] * item["quantity"] for item in items)
+            table_id = self.rng.choice(self.shared["tables"]) if self.rng.random() < 0.5 else None
+            response = await self.request("POST /api/create-order", "POST", "/api/create-order", json={
+                "items": items, "subtotal": subtotal, "discount": 0, "tableId": table_id
+            })
+            self._remember_order(response)
+        elif action == "update_status":
+            order_id = self._recent_order()
+            if order_id:
+                await self.request("POST /api/update-order-status", "POST", "/api/update-order-status",
+                                   json={"orderId": order_id, "status": "in_preparation"})
+        elif action == "payment":
+            order_id = self._recent_order()
+            if order_id:
+                await self.request("POST /api/process-payment", "POST", "/api/process-payment",
+                                   json={"orderId": order_id, "paymentMethod": "cash", "amount": 10})
+        elif action == "shift_report":
+            await self.request("POST /api/shift-report", "POST", "/api/shift-report",
+                               json={"actualCash": 100, "notes": "", "equipmentStatus": {}})
+
+    def _remember_order(self, response):
+        if response is not None and response.status_code == 200:
+            order_id = response.json().get("orderId")
+            if order_id:
+                self.shared["orders"].append(order_id)
+
+    async def run(self, deadline: float, budget: Dict):
+        while time.perf_counter() < deadline:
+            if budget["left"] is not None:
+                if budget["left"] <= 0:
+                    return
+                budget["left"] -= 1
+            await self.step()
+
+
+async def _run(app, args, mix: Dict[str, int]) -> Dict:
+    import httpx
+
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    transport = httpx.ASGITransport(app=app)
+
+    def make_client():
+        return httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None)
+
+    async with make_client() as probe:
+        menu = (await probe.get("/api/menu-items")).json()["items"]
+        tables = [table["id"] for table in (await probe.get("/api/tables")).json()["tables"]]
+    shared = {"menu": [item for item in menu if item.get("status", "available") == "available"] or menu,
+              "tables": tables, "orders": []}
+
+    roles = list(mix)
+    clients = []
+    users = []
+    for i in range(args.concurrency):
+        role = rng.choices(roles, [mix[r] for r in roles])[0]
+        client = make_client()
+        clients.append(client)
+        user = VirtualUser(client, role, random.Random(args.seed * 1000 + i), recorder, shared)
+        await user.login()
+        users.append(user)
+
+    try:
+        if args.warmup > 0:
+            await asyncio.gather(*(user.run(time.perf_counter() + args.warmup, {"left": None}) for user in users))
+
+        recorder.recording = True
+        budget = {"left": args.requests}
+        started = time.perf_counter()
+        deadline = started + (args.duration if args.requests is None else float("inf"))
+        await asyncio.gather(*(user.run(deadline, budget) for user in users))
+        elapsed = time.perf_counter() - started
+        recorder.recording = False
+    finally:
+        for client in clients:
+            await client.aclose()
+
+    result = recorder.report(elapsed)
+    result["elapsed_s"] = elapsed
+    result["users"] = {role: sum(1 for user in users if user.role == role) for role in roles}
+    return result
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def _count_rows(data_dir: str) -> Dict[str, int]:
+    counts = {}
+    for filename in sorted(os.listdir(data_dir)):
+        if filename.endswith(".csv"):
+            with open(os.path.join(data_dir, filename), 'rb') as f:
+                counts[filename] = max(0, sum(1 for _ in f) - 1)
+    return counts
+
+
+def _parse_mix(text: str) -> Dict[str, int]:
+    mix = {}
+    for part in text.split(","):
+        role, _, weight = part.partition("=")
+        role = role.strip()
+        if role not in ROLE_ACTIONS:
+            raise argparse.ArgumentTypeError(f"unknown role {role!r}")
+        mix[role] = int(weight)
+    return mix
+
+
+def print_report(result: Dict):
+    print(f"{'route':40} {'count':>7} {'err':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    rows = list(result["routes"].items()) + [("TOTAL", result["total"])]
+    for route, s in rows:
+        print(f"{route:40} {s['count']:7d} {s['errors']:5d} {s['rps']:8.1f} "
+              f"{s['p50_ms']:9.2f} {s['p95_ms']:9.2f} {s['p99_ms']:9.2f} {s['max_ms']:9.2f}")
+
+
+def compare(old_path: str, new_path: str):
+    """Print the per-route change between two --json result files"""
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+
+    def delta(a: float, b: float) -> str:
+        return f" {(b - a) / a * 100:+7.1f}%" if a else "      n/a"
+
+    print(f"{old_path} ({old['meta'].get('commit', '?')}) -> {new_path} ({new['meta'].get('commit', '?')})")
+    print(f"{'route':40} {'p50 ms':>19} {'p95 ms':>19} {'p99 ms':>19} {'rps':>18}")
+    routes = sorted(set(old["routes"]) | set(new["routes"])) + ["TOTAL"]
+    for route in routes:
+        a = old["total"] if route == "TOTAL" else old["routes"].get(route)
+        b = new["total"] if route == "TOTAL" else new["routes"].get(route)
+        if a is None or b is None:
+            print(f"{route:40} only in {'new' if a is None else 'old'}")
+            continue
+        print(f"{route:40} " + " ".join(
+            f"{b[key]:10.2f}{delta(a[key], b[key])}" for key in ("p50_ms", "p95_ms", "p99_ms")
+        ) + f" {b['rps']:8.1f}{delta(a['rps'], b['rps'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the cafe app in-process")
+    parser.add_argument("--data", default="data", help="data directory to benchmark against (default: data)")
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds (default: 20)")
+    parser.add_argument("--requests", type=int, help="stop after this many measured requests instead")
+    parser.add_argument("--warmup", type=float, default=2, help="unmeasured warm-up seconds (default: 2)")
+    parser.add_argument("--concurrency", type=int, default=8, help="virtual users (default: 8)")
+    parser.add_argument("--mix", type=_parse_mix, default=DEFAULT_MIX,
+                        help="role mix, e.g. customer=60,staff=30,manager=10")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--in-place", action="store_true", help="run against --data directly instead of a copy")
+    parser.add_argument("--verbose", action="store_true", help="show the app's own output")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two --json files and exit")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    source = os.path.abspath(args.data)
+    if not os.path.isdir(source):
+        print(f"Data directory {source} does not exist (see generate_data.py)")
+        sys.exit(1)
+    work_dir = None
+    data_dir = source
+    if not args.in_place:
+        work_dir = tempfile.mkdtemp(prefix="cafe-bench-")
+        data_dir = os.path.join(work_dir, "data")
+        shutil.copytree(source, data_dir)
+
+    # database.py reads its settings at import time
+    os.environ["CAFE_DATA_DIR"] = data_dir
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    try:
+        import main as app_module
+
+        rows = _count_rows(data_dir)
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            result = asyncio.run(_run(app_module.app, args, args.mix))
+    finally:
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    result["meta"] = {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "data": source,
+        "rows": rows,
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "requests": args.requests,
+        "warmup_s": args.warmup,
+        "mix": args.mix,
+        "seed": args.seed,
+        "env": {key: value for key, value in os.environ.items() if key.startswith("CAFE_") and key != "CAFE_DATA_DIR"},
+    }
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -80,6 +80,23 @@ class OrderPrefix:
     IMPORT = "IMP-"
     EXPORT = "EXP-"
     TRANSACTION = "TXN-"
+    SHIFT_REPORT = "SHR-"
+
+
+class CustomerStatus:
+    """Customer status constants"""
+    ACTIVE = "active"
+    INACTIVE = "inactive"
+
+
+class CustomerSegment:
+    """Customer RFM segments (see segments.py)"""
+    CHAMPIONS = "champions"
+    LOYAL = "loyal"
+    NEW = "new"
+    POTENTIAL = "potential"
+    AT_RISK = "at_risk"
+    HIBERNATING = "hibernating"
 
 
 class AttendanceStatus:
@@ -89,6 +106,12 @@ class AttendanceStatus:
     LATE = "late"
 
 
+class Pagination:
+    """Page sizes of the list endpoints (used when a limit or cursor is given)"""
+    DEFAULT_LIMIT = 50
+    MAX_LIMIT = 500
+
+
 # Session keys
 class SessionKey:
     """Session key constants"""
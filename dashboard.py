@@ -0,0 +1,205 @@
+"""
+Manager dashboard snapshot
+Builds the sections of the manager page (revenue, menu, staff, customers,
+feedback, inventory, promotions, popular items) in one go, each table
+read once and shared by the sections that need it, and caches every
+section until a write to one of its tables or for CAFE_DASHBOARD_TTL
+seconds (which takes in the writes of other worker processes)
+
+Each section holds what its own endpoint returns (e.g. "menu" is the body
+of /api/menu-items), so the page renders either the same way.
+"""
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import database as db
+import rollups
+
+# Seconds a cached section is served for
+DASHBOARD_TTL = float(os.environ.get("CAFE_DASHBOARD_TTL", 10))
+
+# Popular items shown on the dashboard (as /api/popular-items by default)
+POPULAR_ITEMS = 5
+
+# Tables each section is built from
+SECTIONS = {
+    "revenue": ("revenue.csv", "revenue_hourly.csv", "revenue_by_method.csv"),
+    "menu": ("menu_items.csv",),
+    "staff": ("staff.csv",),
+    "customers": ("customers.csv", "customer_segments.csv"),
+    "feedback": ("feedback.csv",),
+    "inventory": ("inventory.csv",),
+    "promotions": ("promotions.csv",),
+    "popularItems": ("item_sales.csv", "menu_items.csv"),
+}
+
+
+def feedback_entry(fb: Dict) -> Dict:
+    """A feedback row as the manager page shows it"""
+    entry = {
+        "id": fb["id"],
+        "customer": fb.get("customer_name") or fb.get("customer_email", "Unknown"),
+        "date": fb["date"],
+        "foodRating": fb["foodRating"],
+        "serviceRating": fb["serviceRating"],
+        "comment": fb["comment"],
+        "status": fb["status"]
+    }
+    if fb.get("response"):
+        entry["response"] = fb["response"]
+    return entry
+
+
+def inventory_report(items: List[Dict]) -> Dict:
+    """Inventory items with the ones below their minimum stock (UC-17)"""
+    alerts = []
+    for item in items:
+        # Rows with a missing/invalid number were already reported when loaded
+        if item["quantity"] is None or item["minStock"] is None:
+            continue
+        if item["quantity"] < item["minStock"]:
+            alerts.append({
+                "id": item["id"],
+                "name": item["name"],
+                "quantity": item["quantity"],
+                "minStock": item["minStock"],
+                "shortage": item["minStock"] - item["quantity"]
+            })
+    return {"items": items, "alerts": alerts}
+
+
+def describe_items(top: List[Tuple[str, int, float]], menu: Dict[str, Dict]) -> List[Dict]:
+    """Best sellers [(item id, quantity, revenue)] with their menu item's details"""
+    items = []
+    for item_id, sold, revenue in top:
+        menu_item = menu.get(item_id) or {}
+        items.append({
+            "id": item_id,
+            "name": menu_item.get("name", "Unknown"),
+            "category": menu_item.get("category", ""),
+            "totalSold": sold,
+            "revenue": revenue,
+            "image": menu_item.get("image", "")
+        })
+    return items
+
+
+def _customers(customers: List[Dict], rfm: List[Dict]) -> Dict:
+    by_email = {row["email"]: row for row in rfm}
+    for customer in customers:
+        row = by_email.get(customer["email"])
+        customer["rfm"] = {k: v for k, v in row.items() if k != "email"} if row else None
+    return {"customers": customers}
+
+
+def promotions_report(promotions: List[Dict]) -> Dict:
+    """Promotions, a missing discount shown as 0"""
+    for promo in promotions:
+        if promo["discount"] is None:
+            promo["discount"] = 0
+    return {"promotions": promotions}
+
+
+def build(sections: List[str]) -> Dict[str, Dict]:
+    """Build the given sections from fresh reads, every table read at most once"""
+    tables: Dict[str, List[Dict]] = {}
+
+    def read(filename: str) -> List[Dict]:
+        if filename not in tables:
+            tables[filename] = db.read_csv(filename, typed=True)
+        return tables[filename]
+
+    builders = {
+        "revenue": rollups.summary,
+        "menu": lambda: {"items": read("menu_items.csv")},
+        "staff": lambda: {"staff": read("staff.csv")},
+        "customers": lambda: _customers(read("customers.csv"), read("customer_segments.csv")),
+        "feedback": lambda: {"feedback": [feedback_entry(fb) for fb in read("feedback.csv")]},
+        "inventory": lambda: inventory_report(read("inventory.csv")),
+        "promotions": lambda: promotions_report(read("promotions.csv")),
+        "popularItems": lambda: {
+            "items": describe_items(rollups.top_items("all", POPULAR_ITEMS),
+                                    {item["id"]: item for item in read("menu_items.csv")}),
+            "window": "all"
+        },
+    }
+    return {name: builders[name]() for name in sections}
+
+
+class Dashboard:
+    """
+    Cached dashboard sections
+
+    A write to a table drops the sections built from it (through the write
+    listeners); a section built while one of its tables was being written is
+    handed out but not kept.
+    """
+
+    def __init__(self, ttl: float = DASHBOARD_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Tuple[float, Dict]] = {}
+        self._writes = {name: 0 for name in SECTIONS}
+        self._hits = 0
+        self._misses = 0
+
+    def snapshot(self, sections: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """
+        Dashboard sections, from the cache where still fresh
+
+        Args:
+            sections: Names from SECTIONS (default: all of them)
+
+        Returns:
+            {section: body of the section's endpoint}
+        """
+        sections = list(sections or SECTIONS)
+        now = time.monotonic()
+        result = {}
+        with self._lock:
+            for name in sections:
+                cached = self._cache.get(name)
+                if cached is not None and now - cached[0] <= self.ttl:
+                    result[name] = cached[1]
+            missing = [name for name in sections if name not in result]
+            writes = {name: self._writes[name] for name in missing}
+            self._hits += len(result)
+            self._misses += len(missing)
+        if missing:
+            # Read without holding our lock: the listeners below take it while
+            # the writer holds the table's lock
+            built = build(missing)
+            with self._lock:
+                for name, body in built.items():
+                    if self._writes[name] == writes[name]:
+                        self._cache[name] = (now, body)
+            result.update(built)
+        return {name: result[name] for name in sections}
+
+    def on_write(self, filename: str, op: str, before: Optional[Dict], after: Optional[Dict]):
+        with self._lock:
+            for name, tables in SECTIONS.items():
+                if filename in tables:
+                    self._writes[name] += 1
+                    self._cache.pop(name, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "ttl": self.ttl,
+                "cached": sorted(self._cache),
+                "hits": self._hits,
+                "misses": self._misses
+            }
+
+
+engine = Dashboard()
+for _filename in sorted({filename for tables in SECTIONS.values() for filename in tables}):
+    db.add_listener(_filename, engine.on_write)
+
+
+async def asnapshot(sections: Optional[List[str]] = None) -> Dict[str, Dict]:
+    """Async Dashboard.snapshot"""
+    return await db.arun(engine.snapshot, sections)
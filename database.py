@@ -1,13 +1,73 @@
 """
 Database module using CSV files for data storage
 """
+import asyncio
+import base64
 import csv
+import heapq
+import itertools
+import json
 import os
-from typing import List, Dict, Optional
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime
 
-# Data directory
-DATA_DIR = "data"
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Data directory (CAFE_DATA_DIR points the app at another data set, e.g. one
+# written by generate_data.py)
+DATA_DIR = os.environ.get("CAFE_DATA_DIR", "data")
+
+# Memory budget for the in-process table cache, in bytes (0 disables caching)
+CACHE_MAX_BYTES = int(os.environ.get("CAFE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Storage engine behind read_csv/write_csv/...: "csv" (default) or "sqlite"
+STORAGE_BACKEND = os.environ.get("CAFE_STORAGE_BACKEND", "csv")
+SQLITE_PATH = os.environ.get("CAFE_SQLITE_PATH", os.path.join(DATA_DIR, "cafe.db"))
+
+# How row changes reach disk with the CSV backend:
+#   "rewrite" - update/delete rewrite the whole CSV file (default)
+#   "log"     - inserts, updates and deletes are appended to <file>.log and
+#               folded back into the CSV file by a background compaction
+STORAGE_MODE = os.environ.get("CAFE_STORAGE_MODE", "rewrite")
+
+# Compact a table's log once it reaches this many bytes...
+LOG_COMPACT_BYTES = int(os.environ.get("CAFE_LOG_COMPACT_BYTES", 1024 * 1024))
+# ...or holds more records than this fraction of the base file's rows
+LOG_COMPACT_RATIO = float(os.environ.get("CAFE_LOG_COMPACT_RATIO", 0.5))
+# The ratio rule is ignored below this many records so tiny tables are not
+# compacted after every other change
+_LOG_COMPACT_MIN_RECORDS = 100
+
+# Worker threads that run storage calls for the async API (aread_csv, ...)
+IO_POOL_SIZE = int(os.environ.get("CAFE_IO_POOL_SIZE", 8))
+
+# Changed-row keys remembered per table for delta sync (changes_since)
+CHANGE_FEED_SIZE = int(os.environ.get("CAFE_CHANGE_FEED_SIZE", 10000))
+
+# Store the tables in TABLE_PARTITIONS as one file per "month" or "day" (empty:
+# one file per table). Applies when such a table is first used; a table
+# already partitioned on disk keeps its layout whatever this says.
+PARTITION_BY = os.environ.get("CAFE_PARTITION_BY", "")
+
+# Write-ahead journals of multi-table transactions, one file per process
+JOURNAL_DIR = os.path.join(DATA_DIR, "_journal")
+# A journal is emptied once it reaches this many bytes and nothing is in flight
+JOURNAL_CHECKPOINT_BYTES = int(os.environ.get("CAFE_JOURNAL_CHECKPOINT_BYTES", 1024 * 1024))
+# Journaled transactions whose writes failed, set aside with their error
+QUARANTINE_PATH = os.path.join(JOURNAL_DIR, "quarantine.jsonl")
 
 # Ensure data directory exists
 os.makedirs(DATA_DIR, exist_ok=True)
@@ -16,82 +76,2444 @@ def get_csv_path(filename: str) -> str:
     """Get full path to CSV file"""
     return os.path.join(DATA_DIR, filename)
 
-def read_csv(filename: str) -> List[Dict]:
-    """Read data from CSV file"""
+def get_log_path(filename: str) -> str:
+    """Get full path to the append-only change log of a CSV file"""
+    return get_csv_path(filename) + ".log"
+
+def get_seq_path(filename: str) -> str:
+    """Get full path to the id high-water mark of a CSV file"""
+    return get_csv_path(filename) + ".seq"
+
+def get_partition_dir(filename: str) -> str:
+    """Get full path to the directory holding a partitioned table's files"""
+    return get_csv_path(os.path.splitext(filename)[0])
+
+def get_manifest_path(filename: str) -> str:
+    """Get full path to the partition list of a partitioned table"""
+    return os.path.join(get_partition_dir(filename), "manifest.json")
+
+
+class _CacheEntry:
+    """Resolved rows of one table plus the file signatures they were read from"""
+    __slots__ = ("signature", "fieldnames", "rows", "nbytes", "indexes",
+                 "base_rows", "log_records", "log_version", "filename", "typed")
+
+    def __init__(self, signature: Tuple, fieldnames: List[str], rows: List[Dict]):
+        self.signature = signature
+        self.fieldnames = fieldnames
+        self.rows = rows
+        self.nbytes = sum(_estimate_row_bytes(row) for row in rows)
+        self.indexes: Dict[str, HashIndex] = {}
+        self.base_rows = len(rows)
+        self.log_records = 0
+        self.log_version = 0
+        self.filename = None
+        # Decoded copies of rows keyed by id(row), for tables with TABLE_TYPES
+        self.typed: Optional[Dict[int, Dict]] = None
+
+
+class TableCache:
+    """
+    In-process cache of parsed CSV tables
+
+    An entry is reused only while the file's (mtime, size, inode) signature is
+    unchanged, so edits made by another process or by hand are picked up on the
+    next read. Entries are evicted least-recently-used first once the estimated
+    memory use goes over max_bytes.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.current_bytes = 0
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, filename: str, signature: Tuple) -> Optional[_CacheEntry]:
+        """Return the cached entry if it still matches the file signature"""
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None and entry.signature == signature:
+                self._entries.move_to_end(filename)
+                self.hits += 1
+                return entry
+            if entry is not None:
+                self._drop(filename)
+            self.misses += 1
+            return None
+
+    def peek(self, filename: str) -> Optional[_CacheEntry]:
+        """Return the cached entry without validating it or touching counters"""
+        with self._lock:
+            return self._entries.get(filename)
+
+    def put(self, filename: str, entry: _CacheEntry):
+        """Store an entry and evict least-recently-used tables over budget"""
+        with self._lock:
+            if filename in self._entries:
+                self._drop(filename)
+            self._entries[filename] = entry
+            self.current_bytes += entry.nbytes
+            self._evict()
+
+    def resize(self, filename: str, entry: _CacheEntry, delta_bytes: int):
+        """Account for rows or indexes added to or removed from a cached entry in place"""
+        with self._lock:
+            if self._entries.get(filename) is not entry:
+                return
+            entry.nbytes += delta_bytes
+            self.current_bytes += delta_bytes
+            self._entries.move_to_end(filename)
+            self._evict()
+
+    def invalidate(self, filename: Optional[str] = None):
+        """Forget one table, or every table when filename is None"""
+        with self._lock:
+            if filename is None:
+                self._entries.clear()
+                self.current_bytes = 0
+            elif filename in self._entries:
+                self._drop(filename)
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and memory use"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "tables": list(self._entries.keys())
+            }
+
+    def _drop(self, filename: str):
+        entry = self._entries.pop(filename)
+        self.current_bytes -= entry.nbytes
+
+    def _evict(self):
+        while self._entries and self.current_bytes > self.max_bytes:
+            _, entry = self._entries.popitem(last=False)
+            self.current_bytes -= entry.nbytes
+            self.evictions += 1
+
+
+class HashIndex:
+    """
+    Hash index from one column's value to the rows holding it, or from a
+    tuple of several columns' values for a composite index (field given as
+    a tuple of column names)
+
+    Rows are held by identity, so the index stays valid while cached rows are
+    updated in place; callers remove a row before changing its indexed value
+    and add it back afterwards.
+    """
+
+    def __init__(self, field, unique: bool = False):
+        self.field = field
+        self.fields = field if isinstance(field, tuple) else (field,)
+        self.unique = unique
+        self._map: Dict = {}
+
+    def key(self, row: Dict):
+        if isinstance(self.field, tuple):
+            return tuple(row.get(f) for f in self.field)
+        return row.get(self.field)
+
+    def build(self, rows: List[Dict], filename: str = ""):
+        self._map = {}
+        duplicates = 0
+        for row in rows:
+            bucket = self._map.setdefault(self.key(row), [])
+            if bucket and self.unique:
+                duplicates += 1
+            bucket.append(row)
+        if duplicates:
+            print(f"Warning: {duplicates} duplicate value(s) for unique index {filename}:{self.field}")
+
+    def add(self, row: Dict):
+        self._map.setdefault(self.key(row), []).append(row)
+
+    def remove(self, row: Dict):
+        value = self.key(row)
+        bucket = [r for r in self._map.get(value, []) if r is not row]
+        if bucket:
+            self._map[value] = bucket
+        else:
+            self._map.pop(value, None)
+
+    def get(self, value: str) -> List[Dict]:
+        return self._map.get(value, [])
+
+    def groups(self) -> List[Tuple[str, List[Dict]]]:
+        """(value, rows) pairs; a snapshot, so writers may add keys meanwhile"""
+        return list(self._map.items())
+
+
+# Rough per-row memory cost of one index, used for the cache budget
+_INDEX_BYTES_PER_ROW = 100
+
+
+def _estimate_row_bytes(row: Dict) -> int:
+    """Rough memory footprint of one parsed row (header keys are shared)"""
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row.values())
+
+
+def _file_signature(filepath: str) -> Optional[Tuple]:
+    """(mtime, size, inode) of a file, or None if it does not exist"""
+    try:
+        st = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _table_signature(filename: str) -> Tuple:
+    """Signatures of a table's CSV file and of its change log"""
+    return (_file_signature(get_csv_path(filename)), _file_signature(get_log_path(filename)))
+
+
+def _schema_table(filename: str) -> str:
+    """Table whose TABLE_TYPES and TABLE_INDEXES apply to filename (a partition's parent)"""
+    head, sep, _ = filename.partition("/")
+    return head + ".csv" if sep else filename
+
+
+def _normalize_row(row: Dict, fieldnames: List[str]) -> Dict:
+    """Shape a row the way csv.DictReader would read it back after writing"""
+    return {field: "" if row.get(field) is None else str(row.get(field)) for field in fieldnames}
+
+
+def _check_fields(row: Dict, fieldnames: List[str]):
+    """Reject unknown columns the same way csv.DictWriter does"""
+    wrong_fields = row.keys() - fieldnames
+    if wrong_fields:
+        raise ValueError("dict contains fields not in fieldnames: "
+                         + ", ".join([repr(x) for x in wrong_fields]))
+
+
+def _decode_row(filename: str, row: Dict, label=None) -> Dict:
+    """
+    Copy of a row with the TABLE_TYPES columns converted. Blank values decode
+    to None; so do invalid ones, which are reported here rather than left for
+    every caller to trip over.
+    """
+    typed = dict(row)
+    bad = []
+    for field, kind in TABLE_TYPES.get(_schema_table(filename), {}).items():
+        value = row.get(field)
+        if value is None or value == "":
+            typed[field] = None
+            continue
+        try:
+            typed[field] = kind(value)
+        except (TypeError, ValueError):
+            typed[field] = None
+            bad.append(f"{field}={value!r}")
+    if bad:
+        label = row.get("id") or label or "?"
+        print(f"Warning: {filename} row {label} has invalid {', '.join(bad)}")
+    return typed
+
+def _decode_rows(filename: str, rows: List[Dict]) -> List[Dict]:
+    """Decode rows that are not cached (e.g. from the SQLite backend)"""
+    if _schema_table(filename) not in TABLE_TYPES:
+        return rows
+    return [_decode_row(filename, row, line) for line, row in enumerate(rows, 2)]
+
+def _decode_table(filename: str, entry: "_CacheEntry"):
+    """Decode every row of a freshly loaded table once, for typed reads"""
+    entry.filename = filename
+    if _schema_table(filename) not in TABLE_TYPES:
+        return
+    entry.typed = {id(row): _decode_row(filename, row, line) for line, row in enumerate(entry.rows, 2)}
+    entry.nbytes += sum(_estimate_row_bytes(row) for row in entry.typed.values())
+
+def _typed_row(entry: "_CacheEntry", row: Dict) -> Dict:
+    """Copy of the decoded form of a cached row"""
+    if entry.typed is None:
+        return dict(row)
+    typed = entry.typed.get(id(row))
+    # A writer may be mid-way through replacing the row; decode it directly
+    return dict(typed) if typed is not None else _decode_row(entry.filename, row)
+
+
+_cache = TableCache(CACHE_MAX_BYTES)
+
+# One lock per table serializes read-modify-write sequences
+_table_locks: Dict[str, threading.RLock] = {}
+_table_locks_guard = threading.Lock()
+
+def _table_lock(filename: str) -> threading.RLock:
+    with _table_locks_guard:
+        lock = _table_locks.get(filename)
+        if lock is None:
+            lock = _table_locks[filename] = threading.RLock()
+        return lock
+
+
+# Applying changes to resolved rows. Shared by live writes and log replay so
+# both produce exactly the same table.
+
+def _apply_insert(entry: _CacheEntry, row: Dict):
+    if entry.typed is not None:
+        entry.typed[id(row)] = _decode_row(entry.filename, row)
+    entry.rows.append(row)
+    for index in entry.indexes.values():
+        index.add(row)
+
+def _apply_update(entry: _CacheEntry, target: Dict, new_values: Dict):
+    changed = [index for index in entry.indexes.values()
+               if any(f in new_values and target.get(f) != new_values[f] for f in index.fields)]
+    for index in changed:
+        index.remove(target)
+    target.update(new_values)
+    for index in changed:
+        index.add(target)
+    if entry.typed is not None:
+        entry.typed[id(target)] = _decode_row(entry.filename, target)
+
+def _apply_delete(entry: _CacheEntry, doomed: List[Dict]):
+    doomed_ids = {id(row) for row in doomed}
+    for index in entry.indexes.values():
+        for row in doomed:
+            index.remove(row)
+    # Swap the list rather than editing it so concurrent readers never see it shrink mid-copy
+    entry.rows = [row for row in entry.rows if id(row) not in doomed_ids]
+    if entry.typed is not None:
+        for row_id in doomed_ids:
+            entry.typed.pop(row_id, None)
+
+def _lookup(entry: _CacheEntry, key_field: str, key_value: str) -> List[Dict]:
+    """Rows matching a key during log replay, indexing the key column on first use"""
+    index = entry.indexes.get(key_field)
+    if index is None:
+        index = entry.indexes[key_field] = HashIndex(key_field)
+        index.build(entry.rows)
+    return index.get(key_value)
+
+
+def _read_log(log_path: str) -> Tuple[Optional[Dict], List[Dict]]:
+    """Header and change records of a log file; a torn last line is skipped"""
+    header, records = None, []
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print(f"Warning: skipping unreadable record {line_no} in {log_path}")
+                continue
+            if header is None:
+                header = record
+            else:
+                records.append(record)
+    return header, records
+
+def _file_crc(filepath: str) -> int:
+    crc = 0
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+def _log_matches_base(filename: str, header: Optional[Dict]) -> bool:
+    """
+    A log only applies to the base file it was started against. The header
+    stores that file's CRC, so a log left behind by an interrupted compaction
+    (base already replaced) is recognised as stale instead of replayed twice.
+    """
+    return header is not None and header.get("base_crc") == _file_crc(get_csv_path(filename))
+
+def _recover_log(filename: str):
+    """Finish a compaction that stopped between replacing the base and the log"""
+    log_path = get_log_path(filename)
+    pending = log_path + ".compact"
+    if os.path.exists(pending):
+        header, _ = _read_log(pending)
+        if _log_matches_base(filename, header):
+            os.replace(pending, log_path)
+            return
+        os.remove(pending)
+    if os.path.exists(log_path):
+        header, _ = _read_log(log_path)
+        if not _log_matches_base(filename, header):
+            print(f"Warning: discarding stale change log {log_path}")
+            os.remove(log_path)
+
+
+def _load_entry(filename: str) -> Optional[_CacheEntry]:
+    """Return the cached rows of a table, parsing it only when it has changed"""
     filepath = get_csv_path(filename)
-    if not os.path.exists(filepath):
-        return []
-    
-    data = []
+    log_path = get_log_path(filename)
+    signature = _table_signature(filename)
+    if signature[0] is None:
+        _cache.invalidate(filename)
+        return None
+
+    entry = _cache.get(filename, signature)
+    if entry is not None:
+        return entry
+
+    if signature[1] is not None or os.path.exists(log_path + ".compact"):
+        with _table_lock(filename):
+            _recover_log(filename)
+        signature = _table_signature(filename)
+
+    with open(filepath, 'r', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        rows = list(reader)
+        fieldnames = list(reader.fieldnames or [])
+
+    entry = _CacheEntry(signature, fieldnames, rows)
+    if signature[1] is not None:
+        _, records = _read_log(log_path)
+        for record in records:
+            _replay(entry, record)
+        entry.log_records = len(records)
+        entry.log_version = max((record.get("v", 0) for record in records), default=0)
+        entry.nbytes = (sum(_estimate_row_bytes(row) for row in entry.rows)
+                        + len(entry.rows) * len(entry.indexes) * _INDEX_BYTES_PER_ROW)
+    _decode_table(filename, entry)
+
+    # Only trust the parse if nothing rewrote the files while we were reading them
+    if _table_signature(filename) == signature:
+        _cache.put(filename, entry)
+    return entry
+
+def _replay(entry: _CacheEntry, record: Dict):
+    """Apply one logged change to resolved rows"""
+    op = record.get("op")
+    if op == "insert":
+        _apply_insert(entry, record["row"])
+    elif op == "update":
+        matches = _lookup(entry, record["key"], record["value"])
+        if matches:
+            _apply_update(entry, matches[0], record["updates"])
+    elif op == "delete":
+        _apply_delete(entry, list(_lookup(entry, record["key"], record["value"])))
+
+def _read_entry(filename: str) -> Optional[_CacheEntry]:
+    """_load_entry, reporting read errors the way read_csv always has"""
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            data = list(reader)
+        return _load_entry(filename)
     except Exception as e:
         print(f"Error reading {filename}: {e}")
-        return []
-    
-    return data
+        return None
 
-def write_csv(filename: str, data: List[Dict], fieldnames: List[str]):
-    """Write data to CSV file"""
-    filepath = get_csv_path(filename)
-    
+def _get_index(filename: str, entry: _CacheEntry, field: str) -> Optional["HashIndex"]:
+    """Return the index on field, building it on first use if it is declared"""
+    index = entry.indexes.get(field)
+    if index is not None:
+        return index
+
+    declared = TABLE_INDEXES.get(_schema_table(filename), {})
+    if field not in declared:
+        return None
+
+    with _table_lock(filename):
+        index = entry.indexes.get(field)
+        if index is None:
+            index = HashIndex(field, unique=declared[field])
+            index.build(entry.rows, filename)
+            entry.indexes[field] = index
+            _cache.resize(filename, entry, len(entry.rows) * _INDEX_BYTES_PER_ROW)
+    return index
+
+def _query_rows(filename: str, entry: _CacheEntry, filters: Optional[Dict], ranges: Optional[Dict]) -> List[Dict]:
+    """
+    Cached rows matching query filters/ranges. Candidates come from the
+    smallest index bucket among the equality filters (a range with equal
+    bounds counts as one), so only those rows are scanned.
+    """
+    lookups = dict(filters or {})
+    for field, (low, high) in (ranges or {}).items():
+        if low is not None and low == high and field not in lookups:
+            lookups[field] = low
+    candidates = entry.rows
+    for field, value in lookups.items():
+        index = _get_index(filename, entry, field)
+        if index is None:
+            continue
+        if isinstance(value, (list, tuple, set)):
+            rows = [row for v in dict.fromkeys(value) for row in index.get(v)]
+        else:
+            rows = index.get(value)
+        if len(rows) < len(candidates):
+            candidates = rows
+    # A composite index applies when each of its columns has one value
+    for fields in TABLE_INDEXES.get(_schema_table(filename), {}):
+        if isinstance(fields, tuple) and all(
+                field in lookups and not isinstance(lookups[field], (list, tuple, set)) for field in fields):
+            rows = _get_index(filename, entry, fields).get(tuple(lookups[field] for field in fields))
+            if len(rows) < len(candidates):
+                candidates = rows
+    matcher = _query_predicate(filters, ranges)
+    return [row for row in candidates if matcher(row)]
+
+def _matching_rows(filename: str, entry: _CacheEntry, key_field: str, key_value: str) -> List[Dict]:
+    """Rows whose key_field equals key_value, via an index when one is declared"""
+    index = _get_index(filename, entry, key_field)
+    if index is not None:
+        return index.get(key_value)
+    return [row for row in entry.rows if row.get(key_field) == key_value]
+
+
+# Filtered, sorted and paginated reads (query). Filters and ranges compare the
+# stored strings; sorting decodes the sort column per TABLE_TYPES.
+
+def _query_predicate(filters: Optional[Dict], ranges: Optional[Dict]):
+    """
+    Row test for query: filters maps field -> value (or a list of accepted
+    values), ranges maps field -> (low, high) with either bound optional.
+    Blank values never fall inside a range.
+    """
+    checks = []
+    for field, value in (filters or {}).items():
+        if isinstance(value, (list, tuple, set)):
+            checks.append(lambda row, f=field, accepted=set(value): row.get(f) in accepted)
+        else:
+            checks.append(lambda row, f=field, v=value: row.get(f) == v)
+    for field, (low, high) in (ranges or {}).items():
+        checks.append(lambda row, f=field, lo=low, hi=high: bool(row.get(f))
+                      and (lo is None or row[f] >= lo) and (hi is None or row[f] <= hi))
+    return lambda row: all(check(row) for check in checks)
+
+def _sort_key(filename: str, field: str):
+    """
+    Key function for sorting rows on field: (has value, value, id), so blank
+    or invalid values sort first and ids break ties
+    """
+    kind = TABLE_TYPES.get(_schema_table(filename), {}).get(field)
+
+    def key(row: Dict) -> Tuple:
+        value = row.get(field)
+        if not value:
+            return (0, "", row.get("id") or "")
+        if kind is not None:
+            try:
+                value = kind(value)
+            except (TypeError, ValueError):
+                return (0, "", row.get("id") or "")
+        return (1, value, row.get("id") or "")
+    return key
+
+def _encode_cursor(position: Dict) -> str:
+    """Opaque, URL-safe form of a page position"""
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii")
+
+def _read_cursor(cursor: Optional[str], sort: Optional[str], descending: bool) -> Dict:
+    """
+    Decode a cursor returned by query. Sorted queries resume after the last
+    sort key ({"after": key}); unsorted ones from an offset ({"offset": n}).
+    """
+    if not cursor:
+        return {} if sort else {"offset": 0}
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except ValueError:
+        position = None
+    if sort:
+        valid = (isinstance(position, dict) and position.get("sort") == sort
+                 and position.get("desc") == descending
+                 and isinstance(position.get("after"), list) and len(position["after"]) == 3)
+    else:
+        valid = (isinstance(position, dict) and isinstance(position.get("offset"), int)
+                 and position["offset"] >= 0)
+    if not valid:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return position
+
+def _offset_page(rows: List[Dict], position: Dict, limit: Optional[int]) -> Tuple[List[Dict], Optional[str]]:
+    """Page of rows already starting at position's offset (plus one spare row, if any)"""
+    if limit is None or len(rows) <= limit:
+        return rows[:limit] if limit is not None else rows, None
+    return rows[:limit], _encode_cursor({"offset": position["offset"] + limit})
+
+def _paginate(filename: str, rows: List[Dict], sort: Optional[str], descending: bool,
+              limit: Optional[int], cursor: Optional[str]) -> Tuple[List[Dict], Optional[str]]:
+    """
+    One page of the matching rows and the cursor of the next page (None on the
+    last page). Sorted pages pick the next limit rows with a heap rather than
+    sorting every match.
+    """
+    position = _read_cursor(cursor, sort, descending)
+    if not sort:
+        start = position["offset"]
+        return _offset_page(rows[start:start + limit + 1] if limit is not None else rows[start:],
+                            position, limit)
+
+    sort_key = _sort_key(filename, sort)
+    keyed = ((sort_key(row), row) for row in rows)
+    if "after" in position:
+        after = tuple(position["after"])
+        if descending:
+            keyed = (item for item in keyed if item[0] < after)
+        else:
+            keyed = (item for item in keyed if item[0] > after)
     try:
-        with open(filepath, 'w', encoding='utf-8', newline='') as f:
+        if limit is None:
+            ordered = sorted(keyed, key=itemgetter(0), reverse=descending)
+        else:
+            pick = heapq.nlargest if descending else heapq.nsmallest
+            ordered = pick(limit + 1, keyed, key=itemgetter(0))
+    except TypeError:
+        # A tampered cursor holding a value of the wrong type
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+    page = [row for _, row in ordered[:limit]] if limit is not None else [row for _, row in ordered]
+    if limit is None or len(ordered) <= limit:
+        return page, None
+    last_key = ordered[limit - 1][0]
+    return page, _encode_cursor({"sort": sort, "desc": descending, "after": list(last_key)})
+
+def _max_numeric_id(rows: List[Dict]) -> int:
+    """Largest all-digit id among rows (0 if none), where id sequences start"""
+    return max((int(row["id"]) for row in rows if (row.get("id") or "").isdigit()), default=0)
+
+def _lock(f):
+    """Take an exclusive lock on an open file, waiting for other processes to let go of it"""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+def _unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+@contextmanager
+def _locked_file(path: str):
+    """Open path for reading and writing under an exclusive lock shared with other processes"""
+    with open(path, "a+", encoding="utf-8") as f:
+        _lock(f)
+        try:
+            yield f
+        finally:
+            _unlock(f)
+
+# Headers by file path: (file signature, header), also set by _write_rows
+_headers: Dict[str, Tuple[Tuple, Optional[List[str]]]] = {}
+
+def _file_header(filename: str) -> Optional[List[str]]:
+    """Column names on the first line of a table's CSV file (None if it has none)"""
+    path = get_csv_path(filename)
+    signature = _file_signature(path)
+    if signature is None:
+        return None
+    cached = _headers.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    try:
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            header = next(csv.reader(f), None)
+    except FileNotFoundError:
+        return None
+    _headers[path] = (signature, header)
+    return header
+
+def _write_rows(filepath: str, rows: List[Dict], fieldnames: List[str]):
+    """Write a complete CSV file, replacing the old one only once the new one is whole"""
+    tmp_path = filepath + ".tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
             writer = csv.DictWriter(f, fieldnames=fieldnames)
             writer.writeheader()
-            writer.writerows(data)
+            writer.writerows(rows)
+        signature = _file_signature(tmp_path)
+        os.replace(tmp_path, filepath)
+        _headers[filepath] = (signature, list(fieldnames))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _rewrite_table(filename: str, entry: _CacheEntry, rows: List[Dict], fieldnames: List[str]):
+    """Write resolved rows as the new base file and retire any change log"""
+    try:
+        _write_rows(get_csv_path(filename), rows, fieldnames)
     except Exception as e:
+        _cache.invalidate(filename)
         print(f"Error writing {filename}: {e}")
         raise
+    # The base now holds every change, and its new CRC already marks the log stale
+    if os.path.exists(get_log_path(filename)):
+        os.remove(get_log_path(filename))
+    entry.base_rows = len(rows)
+    entry.log_records = 0
 
-def append_csv(filename: str, row: Dict, fieldnames: List[str]):
-    """Append a row to CSV file"""
-    filepath = get_csv_path(filename)
-    file_exists = os.path.exists(filepath)
-    
+def _append_log(filename: str, entry: _CacheEntry, records: List[Dict]) -> bool:
+    """
+    Append change records to a table's log
+
+    Returns True when entry was current beforehand and can simply have the
+    records applied; False means another writer got in and the caller should
+    drop the cached entry instead.
+    """
+    log_path = get_log_path(filename)
+    before = _table_signature(filename)
+    with open(log_path, 'a', encoding='utf-8') as f:
+        start = f.tell()
+        if before[1] is None:
+            f.write(json.dumps({"base_crc": _file_crc(get_csv_path(filename))}) + "\n")
+        for record in records:
+            entry.log_version += 1
+            record["v"] = entry.log_version
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        written = f.tell() - start
+
+    after = _table_signature(filename)
+    before_size = before[1][1] if before[1] else 0
+    if entry.signature != before or after[1] is None or after[1][1] != before_size + written:
+        return False
+    entry.signature = after
+    entry.log_records += len(records)
+    return True
+
+def _log_write(filename: str, entry: _CacheEntry, records: List[Dict], apply, delta_bytes: int = 0):
+    """Log records, then apply them to the cached entry (or drop it if stale)"""
     try:
-        with open(filepath, 'a', encoding='utf-8', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(row)
+        current = _append_log(filename, entry, records)
     except Exception as e:
-        print(f"Error appending to {filename}: {e}")
+        _cache.invalidate(filename)
+        print(f"Error appending to {get_log_path(filename)}: {e}")
         raise
+    if not current:
+        _cache.invalidate(filename)
+        return
+    apply()
+    _cache.resize(filename, entry, delta_bytes)
+    _maybe_compact(filename, entry)
+
+
+# Partitioned tables
+#
+# A table listed in TABLE_PARTITIONS can live in one CSV file per month or
+# day (data/orders/2025-11.csv, ...) next to a manifest listing them. Every
+# partition is an ordinary table to the code above, cached, indexed and
+# logged on its own; the CSV backend routes rows to partitions by date and
+# leaves out the partitions a date predicate rules out.
+
+# Partition of rows whose date can't be read; it is never pruned
+_UNDATED = "undated"
+_DATE_VALUE = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+# Date embedded in an id made by ids.new_id or generate_data.py
+_DATE_IN_ID = re.compile(r"(\d{4})(\d{2})(\d{2})\d{6}")
+
+def _partition_file(filename: str, key: str) -> str:
+    """Table name of one partition, e.g. orders/2025-11.csv"""
+    return f"{os.path.splitext(filename)[0]}/{key}.csv"
+
+def _partition_key(filename: str, by: str, value) -> str:
+    """Partition a row belongs in, from its partition column value"""
+    kind = TABLE_PARTITIONS[filename][1]
+    text = "" if value is None else str(value)
+    match = _DATE_VALUE.match(text) if kind == "date" else _DATE_IN_ID.search(text)
+    if match is None:
+        return _UNDATED
+    year, month, day = match.groups()
+    return f"{year}-{month}" if by == "month" else f"{year}-{month}-{day}"
+
+def _partition_order(key: str) -> Tuple:
+    # Oldest first; undated rows are the legacy ones, so they lead
+    return (key != _UNDATED, key)
+
+
+# Manifests by table: (file signature, manifest)
+_manifests: Dict[str, Tuple[Tuple, Dict]] = {}
+
+def _read_manifest(filename: str) -> Optional[Dict]:
+    path = get_manifest_path(filename)
+    signature = _file_signature(path)
+    if signature is None:
+        return None
+    cached = _manifests.get(filename)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    _manifests[filename] = (signature, manifest)
+    return manifest
+
+def _write_manifest(filename: str, manifest: Dict):
+    path = get_manifest_path(filename)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+    _manifests[filename] = (_file_signature(path), manifest)
+
+def _partitions(filename: str) -> Optional[Dict]:
+    """
+    Manifest of a partitioned table ({"column", "by", "partitions"}, oldest
+    partition first), or None for a table kept in a single file
+    """
+    if filename not in TABLE_PARTITIONS:
+        return None
+    manifest = _read_manifest(filename)
+    if manifest is None and PARTITION_BY:
+        manifest = _partition_table(filename)
+    return manifest
+
+def _partition_table(filename: str) -> Dict:
+    """Split a single-file table into partitions, or start an empty partitioned one"""
+    if PARTITION_BY not in ("month", "day"):
+        raise ValueError(f"Unknown partition period: {PARTITION_BY}")
+    os.makedirs(get_partition_dir(filename), exist_ok=True)
+    with _table_lock(filename), _locked_file(get_manifest_path(filename) + ".lock"):
+        manifest = _read_manifest(filename)
+        if manifest is not None:
+            # Another thread or process got there first
+            return manifest
+        column = TABLE_PARTITIONS[filename][0]
+        entry = _read_entry(filename)
+        groups: Dict[str, List[Dict]] = {}
+        if entry is not None:
+            for row in entry.rows:
+                groups.setdefault(_partition_key(filename, PARTITION_BY, row.get(column)), []).append(row)
+            for key, rows in groups.items():
+                _write_rows(get_csv_path(_partition_file(filename, key)), rows, entry.fieldnames)
+        manifest = {"column": column, "by": PARTITION_BY, "partitions": sorted(groups, key=_partition_order)}
+        _write_manifest(filename, manifest)
+        # The partitions hold every row now
+        for path in (get_csv_path(filename), get_log_path(filename)):
+            if os.path.exists(path):
+                os.remove(path)
+        _cache.invalidate(filename)
+    print(f"Partitioned {filename} by {PARTITION_BY} into {len(groups)} file(s)")
+    return manifest
+
+def _add_partitions(filename: str, keys) -> Dict:
+    """List new partitions in the manifest (before any row is written to them)"""
+    with _locked_file(get_manifest_path(filename) + ".lock"):
+        manifest = dict(_read_manifest(filename))
+        manifest["partitions"] = sorted(set(manifest["partitions"]) | set(keys), key=_partition_order)
+        _write_manifest(filename, manifest)
+    return manifest
+
+def _pruned_partitions(filename: str, manifest: Dict, filters: Optional[Dict] = None,
+                       ranges: Optional[Dict] = None) -> List[str]:
+    """Partitions, oldest first, that can hold rows matching the filters/ranges on the partition column"""
+    column, by = manifest["column"], manifest["by"]
+    keys = manifest["partitions"]
+    value = (filters or {}).get(column)
+    if value is not None:
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        wanted = {_partition_key(filename, by, v) for v in values}
+        keys = [key for key in keys if key in wanted or key == _UNDATED]
+    low, high = (ranges or {}).get(column, (None, None))
+    if TABLE_PARTITIONS[filename][1] == "date" and (low is not None or high is not None):
+        keys = [key for key in keys if key == _UNDATED or (
+            (low is None or key >= str(low)[:len(key)]) and (high is None or key <= str(high)[:len(key)]))]
+    return keys
+
+
+class StorageBackend:
+    """
+    Interface every storage engine implements
+
+    The module-level read_csv/write_csv/... functions forward to the active
+    backend, so main.py keeps addressing tables by their CSV filename whatever
+    engine actually stores them.
+    """
+
+    def read_csv(self, filename: str, typed: bool = False) -> List[Dict]:
+        raise NotImplementedError
+
+    def write_csv(self, filename: str, data: List[Dict], fieldnames: List[str]):
+        raise NotImplementedError
+
+    def append_csv(self, filename: str, row: Dict, fieldnames: List[str]):
+        raise NotImplementedError
+
+    def append_many(self, filename: str, rows: List[Dict], fieldnames: List[str]):
+        for row in rows:
+            self.append_csv(filename, row, fieldnames)
+
+    def update_csv(self, filename: str, key_field: str, key_value: str, updates: Dict, fieldnames: List[str]):
+        raise NotImplementedError
+
+    def delete_csv(self, filename: str, key_field: str, key_value: str, fieldnames: List[str]):
+        raise NotImplementedError
+
+    def delete_many(self, filename: str, key_field: str, key_values: List[str], fieldnames: List[str]):
+        for key_value in dict.fromkeys(key_values):
+            self.delete_csv(filename, key_field, key_value, fieldnames)
+
+    def find_one(self, filename: str, key_field: str, key_value: str, typed: bool = False) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def check_write(self, filename: str, op: str, fieldnames: List[str], rows: Optional[List[Dict]] = None):
+        """Raise ValueError if an insert/update/delete with fieldnames would not fit the stored table"""
+
+    def find_many(self, filename: str, filter_func=None, typed: bool = False) -> List[Dict]:
+        data = self.read_csv(filename, typed)
+        if filter_func:
+            data = [row for row in data if filter_func(row)]
+        return data
+
+    def find_all(self, filename: str, key_field: str, key_value: str, typed: bool = False) -> List[Dict]:
+        return [row for row in self.read_csv(filename, typed) if row.get(key_field) == key_value]
+
+    def next_sequence(self, filename: str) -> str:
+        # Not persistent: engines override this with a stored high-water mark
+        return str(_max_numeric_id(self.read_csv(filename)) + 1)
+
+    def iter_rows(self, filename: str, typed: bool = False):
+        yield from self.read_csv(filename, typed)
+
+    def sync(self, filename: str):
+        """Force a table's files to disk (used before a journal is emptied)"""
+        for path in (get_csv_path(filename), get_log_path(filename)):
+            if os.path.exists(path):
+                with open(path, "a") as f:
+                    os.fsync(f.fileno())
+
+    def group_by(self, filename: str, key_field: str, keys: Optional[List[str]] = None,
+                 typed: bool = False) -> Dict[str, List[Dict]]:
+        groups = {key: [] for key in keys} if keys is not None else {}
+        for row in self.read_csv(filename, typed):
+            key = row.get(key_field)
+            if keys is None:
+                groups.setdefault(key, []).append(row)
+            elif key in groups:
+                groups[key].append(row)
+        return groups
+
+    def query(self, filename: str, filters: Optional[Dict] = None, ranges: Optional[Dict] = None,
+              sort: Optional[str] = None, descending: bool = False, limit: Optional[int] = None,
+              cursor: Optional[str] = None, typed: bool = False) -> Tuple[List[Dict], Optional[str]]:
+        matcher = _query_predicate(filters, ranges)
+        rows = [row for row in self.read_csv(filename) if matcher(row)]
+        page, next_cursor = _paginate(filename, rows, sort, descending, limit, cursor)
+        return (_decode_rows(filename, page) if typed else page), next_cursor
+
+
+class CSVBackend(StorageBackend):
+    """CSV files in DATA_DIR, with the table cache, indexes and change log above"""
+
+    def read_csv(self, filename: str, typed: bool = False) -> List[Dict]:
+        """Read data from CSV file"""
+        manifest = _partitions(filename)
+        if manifest is not None:
+            return [row for key in manifest["partitions"]
+                    for row in self.read_csv(_partition_file(filename, key), typed)]
+        entry = _read_entry(filename)
+        if entry is None:
+            return []
+        # Callers are free to mutate what they get back, so hand out copies
+        if typed:
+            return [_typed_row(entry, row) for row in entry.rows]
+        return [dict(row) for row in entry.rows]
+
+    def write_csv(self, filename: str, data: List[Dict], fieldnames: List[str]):
+        """Write data to CSV file"""
+        manifest = _partitions(filename)
+        if manifest is not None:
+            self._write_partitions(filename, manifest, data, fieldnames)
+            return
+        with _table_lock(filename):
+            rows = [_normalize_row(row, fieldnames) for row in data]
+            entry = _CacheEntry(None, list(fieldnames), rows)
+            _rewrite_table(filename, entry, data, fieldnames)
+            _decode_table(filename, entry)
+            entry.signature = _table_signature(filename)
+            _cache.put(filename, entry)
+
+    def check_write(self, filename: str, op: str, fieldnames: List[str], rows: Optional[List[Dict]] = None):
+        """
+        Raise ValueError if writing with fieldnames would not fit the file:
+        an insert would put values under the wrong columns of a different
+        header, and an update or delete rewrite cannot keep columns missing
+        from fieldnames. Partitioned tables check the partitions inserts go to.
+        """
+        manifest = _partitions(filename)
+        if manifest is None:
+            files = [filename]
+        elif op == "insert":
+            keys = {_partition_key(filename, manifest["by"], row.get(manifest["column"])) for row in rows or []}
+            files = [_partition_file(filename, key) for key in sorted(keys) if key in manifest["partitions"]]
+        else:
+            files = []
+        for name in files:
+            header = _file_header(name)
+            if header is None:
+                continue
+            if (header != list(fieldnames)) if op == "insert" else not set(header) <= set(fieldnames):
+                raise ValueError(f"{name} has columns {header}, which {op} with {list(fieldnames)} does not fit")
+
+    def append_csv(self, filename: str, row: Dict, fieldnames: List[str]):
+        """Append a row to CSV file"""
+        self.append_many(filename, [row], fieldnames)
+
+    def append_many(self, filename: str, rows: List[Dict], fieldnames: List[str]):
+        """Append several rows to CSV file with a single open and write"""
+        if not rows:
+            return
+        manifest = _partitions(filename)
+        if manifest is not None:
+            self._append_partitions(filename, manifest, rows, fieldnames)
+            return
+        filepath = get_csv_path(filename)
+
+        with _table_lock(filename):
+            if STORAGE_MODE == "log":
+                entry = _read_entry(filename)
+                if entry is not None and entry.fieldnames == list(fieldnames):
+                    try:
+                        for row in rows:
+                            _check_fields(row, fieldnames)
+                    except ValueError as e:
+                        print(f"Error appending to {filename}: {e}")
+                        raise
+                    new_rows = [_normalize_row(row, fieldnames) for row in rows]
+
+                    def apply():
+                        for new_row in new_rows:
+                            _apply_insert(entry, new_row)
+
+                    _log_write(filename, entry, [{"op": "insert", "row": new_row} for new_row in new_rows],
+                               apply, sum(_estimate_row_bytes(new_row) for new_row in new_rows))
+                    return
+            elif os.path.exists(get_log_path(filename)):
+                # Appending to the base would orphan the log, so fold it in first
+                compact_log(filename)
+
+            before = _table_signature(filename)
+            file_exists = before[0] is not None
+
+            try:
+                # Check every row first so a bad one cannot leave half a batch behind
+                for row in rows:
+                    _check_fields(row, fieldnames)
+                with open(filepath, 'a', encoding='utf-8', newline='') as f:
+                    start = f.tell()
+                    writer = csv.DictWriter(f, fieldnames=fieldnames)
+                    if not file_exists:
+                        writer.writeheader()
+                    writer.writerows(rows)
+                    written = f.tell() - start
+            except Exception as e:
+                _cache.invalidate(filename)
+                print(f"Error appending to {filename}: {e}")
+                raise
+
+            # Extend the cached table in place when we know it was current before
+            # the append and no other writer slipped in alongside us
+            entry = _cache.peek(filename)
+            after = _table_signature(filename)
+            if (entry is None or not file_exists or entry.signature != before
+                    or entry.fieldnames != list(fieldnames)
+                    or after[0] is None or after[0][1] != before[0][1] + written):
+                _cache.invalidate(filename)
+                return
+
+            new_rows = [_normalize_row(row, fieldnames) for row in rows]
+            for new_row in new_rows:
+                _apply_insert(entry, new_row)
+            entry.base_rows += len(new_rows)
+            entry.signature = after
+            _cache.resize(filename, entry, sum(_estimate_row_bytes(new_row) for new_row in new_rows))
+
+    def update_csv(self, filename: str, key_field: str, key_value: str, updates: Dict, fieldnames: List[str]):
+        """Update a row in CSV file"""
+        manifest = _partitions(filename)
+        if manifest is not None:
+            self._update_partitions(filename, manifest, key_field, key_value, updates, fieldnames)
+            return
+        with _table_lock(filename):
+            entry = _read_entry(filename)
+            if entry is None or entry.fieldnames != list(fieldnames):
+                # The header is being changed (or the file is new): rewrite from scratch
+                data = self.read_csv(filename)
+                for i, row in enumerate(data):
+                    if row.get(key_field) == key_value:
+                        data[i].update(updates)
+                        break
+                self.write_csv(filename, data, fieldnames)
+                return
+
+            matches = _matching_rows(filename, entry, key_field, key_value)
+            if not matches:
+                return
+            target = matches[0]
+
+            if STORAGE_MODE == "log":
+                try:
+                    _check_fields(updates, fieldnames)
+                except ValueError as e:
+                    print(f"Error writing {filename}: {e}")
+                    raise
+                new_values = {field: "" if value is None else str(value) for field, value in updates.items()}
+                record = {"op": "update", "key": key_field, "value": key_value, "updates": new_values}
+                _log_write(filename, entry, [record], lambda: _apply_update(entry, target, new_values))
+                return
+
+            updated = dict(target)
+            updated.update(updates)
+            _rewrite_table(filename, entry, [updated if row is target else row for row in entry.rows], fieldnames)
+            _apply_update(entry, target, _normalize_row(updated, fieldnames))
+            entry.signature = _table_signature(filename)
+
+    def delete_csv(self, filename: str, key_field: str, key_value: str, fieldnames: List[str]):
+        """Delete a row from CSV file"""
+        self.delete_many(filename, key_field, [key_value], fieldnames)
+
+    def delete_many(self, filename: str, key_field: str, key_values: List[str], fieldnames: List[str]):
+        """Delete every row whose key is one of key_values, with a single rewrite or log write"""
+        manifest = _partitions(filename)
+        if manifest is not None:
+            # Partition by partition, so appends to the current one carry on meanwhile
+            for key in _pruned_partitions(filename, manifest, {key_field: list(key_values)}):
+                self.delete_many(_partition_file(filename, key), key_field, key_values, fieldnames)
+            return
+        wanted = set(key_values)
+        with _table_lock(filename):
+            entry = _read_entry(filename)
+            if entry is None or entry.fieldnames != list(fieldnames):
+                data = self.read_csv(filename)
+                data = [row for row in data if row.get(key_field) not in wanted]
+                self.write_csv(filename, data, fieldnames)
+                return
+
+            index = _get_index(filename, entry, key_field)
+            if index is not None:
+                doomed = [row for value in wanted for row in index.get(value)]
+            else:
+                doomed = [row for row in entry.rows if row.get(key_field) in wanted]
+            if not doomed:
+                return
+            freed = -sum(_estimate_row_bytes(row) for row in doomed)
+
+            if STORAGE_MODE == "log":
+                records = [{"op": "delete", "key": key_field, "value": value}
+                           for value in dict.fromkeys(row[key_field] for row in doomed)]
+                _log_write(filename, entry, records, lambda: _apply_delete(entry, doomed), freed)
+                return
+
+            doomed_ids = {id(row) for row in doomed}
+            _rewrite_table(filename, entry, [row for row in entry.rows if id(row) not in doomed_ids], fieldnames)
+            _apply_delete(entry, doomed)
+            entry.signature = _table_signature(filename)
+            _cache.resize(filename, entry, freed)
+
+    def next_sequence(self, filename: str) -> str:
+        """
+        Next numeric id of a table, from the high-water mark kept in
+        <file>.seq under a file lock, so concurrent requests and other
+        processes never get the same id and deleted ids are not reused. The
+        mark starts above the largest id stored, and is re-seeded that way if
+        the .seq file is lost or torn (ids handed out but never written are
+        safe to hand out again).
+        """
+        with _table_lock(filename), _locked_file(get_seq_path(filename)) as f:
+            f.seek(0)
+            text = f.read().strip()
+            if text.isdigit():
+                last = int(text)
+            else:
+                last = _max_numeric_id(self.read_csv(filename))
+            last += 1
+            f.seek(0)
+            f.truncate()
+            f.write(str(last))
+            f.flush()
+            os.fsync(f.fileno())
+        return str(last)
+
+    def find_one(self, filename: str, key_field: str, key_value: str, typed: bool = False) -> Optional[Dict]:
+        """Find one record by key"""
+        manifest = _partitions(filename)
+        if manifest is not None:
+            # Newest first: recent rows are the ones looked up most
+            for key in reversed(_pruned_partitions(filename, manifest, {key_field: key_value})):
+                row = self.find_one(_partition_file(filename, key), key_field, key_value, typed)
+                if row is not None:
+                    return row
+            return None
+        entry = _read_entry(filename)
+        if entry is None:
+            return None
+        matches = _matching_rows(filename, entry, key_field, key_value)
+        if not matches:
+            return None
+        return _typed_row(entry, matches[0]) if typed else dict(matches[0])
+
+    def find_many(self, filename: str, filter_func=None, typed: bool = False) -> List[Dict]:
+        """Find multiple records with optional filter (filter_func must not modify rows)"""
+        manifest = _partitions(filename)
+        if manifest is not None:
+            return [row for key in manifest["partitions"]
+                    for row in self.find_many(_partition_file(filename, key), filter_func, typed)]
+        if typed:
+            # Decoded rows are already private copies, so filter those directly
+            rows = self.read_csv(filename, typed=True)
+            return [row for row in rows if filter_func(row)] if filter_func else rows
+        entry = _read_entry(filename)
+        if entry is None:
+            return []
+        if filter_func:
+            return [dict(row) for row in entry.rows if filter_func(row)]
+        return [dict(row) for row in entry.rows]
+
+    def find_all(self, filename: str, key_field: str, key_value: str, typed: bool = False) -> List[Dict]:
+        """Find every record with a key value"""
+        manifest = _partitions(filename)
+        if manifest is not None:
+            return [row for key in _pruned_partitions(filename, manifest, {key_field: key_value})
+                    for row in self.find_all(_partition_file(filename, key), key_field, key_value, typed)]
+        entry = _read_entry(filename)
+        if entry is None:
+            return []
+        copy = (lambda row: _typed_row(entry, row)) if typed else dict
+        return [copy(row) for row in _matching_rows(filename, entry, key_field, key_value)]
+
+    def group_by(self, filename: str, key_field: str, keys: Optional[List[str]] = None,
+                 typed: bool = False) -> Dict[str, List[Dict]]:
+        """Records grouped by a column (only the given keys, if any), via its index when declared"""
+        manifest = _partitions(filename)
+        if manifest is not None:
+            return self._group_partitions(filename, manifest, key_field, keys, typed)
+        entry = _read_entry(filename)
+        if entry is None:
+            return {key: [] for key in keys} if keys is not None else {}
+        copy = (lambda row: _typed_row(entry, row)) if typed else dict
+        index = _get_index(filename, entry, key_field)
+        if index is None:
+            return super().group_by(filename, key_field, keys, typed)
+        if keys is not None:
+            return {key: [copy(row) for row in index.get(key)] for key in keys}
+        return {key: [copy(row) for row in rows] for key, rows in index.groups()}
+
+    def query(self, filename: str, filters: Optional[Dict] = None, ranges: Optional[Dict] = None,
+              sort: Optional[str] = None, descending: bool = False, limit: Optional[int] = None,
+              cursor: Optional[str] = None, typed: bool = False) -> Tuple[List[Dict], Optional[str]]:
+        """One page of matching records, found through the indexes; only the page is copied"""
+        manifest = _partitions(filename)
+        if manifest is not None:
+            return self._query_partitions(filename, manifest, filters, ranges, sort, descending,
+                                          limit, cursor, typed)
+        entry = _read_entry(filename)
+        if entry is None:
+            _read_cursor(cursor, sort, descending)
+            return [], None
+        page, next_cursor = _paginate(filename, _query_rows(filename, entry, filters, ranges),
+                                      sort, descending, limit, cursor)
+        copy = (lambda row: _typed_row(entry, row)) if typed else dict
+        return [copy(row) for row in page], next_cursor
+
+    def iter_rows(self, filename: str, typed: bool = False):
+        manifest = _partitions(filename)
+        if manifest is None:
+            yield from self.read_csv(filename, typed)
+            return
+        # One partition in memory at a time
+        for key in manifest["partitions"]:
+            yield from self.read_csv(_partition_file(filename, key), typed)
+
+    def sync(self, filename: str):
+        manifest = _partitions(filename)
+        if manifest is None:
+            super().sync(filename)
+            return
+        for key in manifest["partitions"]:
+            super().sync(_partition_file(filename, key))
+
+    # Partitioned tables: each operation is passed on to the partitions that
+    # can hold the rows involved
+
+    def _write_partitions(self, filename: str, manifest: Dict, data: List[Dict], fieldnames: List[str]):
+        column = manifest["column"]
+        groups: Dict[str, List[Dict]] = {}
+        for row in data:
+            groups.setdefault(_partition_key(filename, manifest["by"], row.get(column)), []).append(row)
+        with _table_lock(filename):
+            manifest = _add_partitions(filename, groups)
+            # Partitions left without rows are kept, empty
+            for key in manifest["partitions"]:
+                self.write_csv(_partition_file(filename, key), groups.get(key, []), fieldnames)
+
+    def _append_partitions(self, filename: str, manifest: Dict, rows: List[Dict], fieldnames: List[str]):
+        try:
+            # Check every row first so a bad one cannot leave half a batch behind
+            for row in rows:
+                _check_fields(row, fieldnames)
+        except ValueError as e:
+            print(f"Error appending to {filename}: {e}")
+            raise
+        column = manifest["column"]
+        groups: Dict[str, List[Dict]] = {}
+        for row in rows:
+            groups.setdefault(_partition_key(filename, manifest["by"], row.get(column)), []).append(row)
+        with _table_lock(filename):
+            if not groups.keys() <= set(manifest["partitions"]):
+                _add_partitions(filename, groups)
+            for key, part_rows in groups.items():
+                self.append_many(_partition_file(filename, key), part_rows, fieldnames)
+
+    def _update_partitions(self, filename: str, manifest: Dict, key_field: str, key_value: str,
+                           updates: Dict, fieldnames: List[str]):
+        column = manifest["column"]
+        with _table_lock(filename):
+            for key in reversed(_pruned_partitions(filename, manifest, {key_field: key_value})):
+                part = _partition_file(filename, key)
+                target = self.find_one(part, key_field, key_value)
+                if target is None:
+                    continue
+                if column not in updates or _partition_key(filename, manifest["by"], updates[column]) == key:
+                    self.update_csv(part, key_field, key_value, updates, fieldnames)
+                    return
+                # The new date belongs in another partition: move the row there
+                _check_fields(updates, fieldnames)
+                rows = self.read_csv(part)
+                rows.pop(next(i for i, row in enumerate(rows) if row.get(key_field) == key_value))
+                self.write_csv(part, rows, fieldnames)
+                target.update(updates)
+                self.append_many(filename, [target], fieldnames)
+                return
+
+    def _group_partitions(self, filename: str, manifest: Dict, key_field: str,
+                          keys: Optional[List[str]], typed: bool) -> Dict[str, List[Dict]]:
+        groups = {key: [] for key in keys} if keys is not None else {}
+        for part_key in manifest["partitions"]:
+            part_keys = keys
+            if keys is not None and key_field == manifest["column"]:
+                # Only the keys that can be stored in this partition
+                part_keys = [key for key in keys if part_key == _UNDATED
+                             or _partition_key(filename, manifest["by"], key) == part_key]
+                if not part_keys:
+                    continue
+            for key, rows in self.group_by(_partition_file(filename, part_key), key_field, part_keys, typed).items():
+                groups.setdefault(key, []).extend(rows)
+        return groups
+
+    def _query_partitions(self, filename: str, manifest: Dict, filters: Optional[Dict], ranges: Optional[Dict],
+                          sort: Optional[str], descending: bool, limit: Optional[int], cursor: Optional[str],
+                          typed: bool) -> Tuple[List[Dict], Optional[str]]:
+        position = _read_cursor(cursor, sort, descending)
+        # Unsorted pages follow partition order, so stop reading partitions
+        # once this page (and one row past it) has matched
+        enough = position["offset"] + limit + 1 if sort is None and limit is not None else None
+        matched = []
+        entries = {}
+        for key in _pruned_partitions(filename, manifest, filters, ranges):
+            part = _partition_file(filename, key)
+            entry = _read_entry(part)
+            if entry is None:
+                continue
+            rows = _query_rows(part, entry, filters, ranges)
+            matched.extend(rows)
+            if typed:
+                entries.update((id(row), entry) for row in rows)
+            if enough is not None and len(matched) >= enough:
+                break
+        page, next_cursor = _paginate(filename, matched, sort, descending, limit, cursor)
+        copy = (lambda row: _typed_row(entries[id(row)], row)) if typed else dict
+        return [copy(row) for row in page], next_cursor
+
+
+# Active storage backend, created on first use from STORAGE_BACKEND
+_backend: Optional[StorageBackend] = None
+
+def _create_backend() -> StorageBackend:
+    if STORAGE_BACKEND == "csv":
+        return CSVBackend()
+    if STORAGE_BACKEND == "sqlite":
+        from sqlite_backend import SQLiteBackend
+        return SQLiteBackend(SQLITE_PATH)
+    raise ValueError(f"Unknown storage backend: {STORAGE_BACKEND}")
+
+def get_backend() -> StorageBackend:
+    """Return the active storage backend"""
+    global _backend
+    if _backend is None:
+        _backend = _create_backend()
+    return _backend
+
+def set_backend(backend: StorageBackend):
+    """Swap the active storage backend (used by tools and tests)"""
+    global _backend
+    _backend = backend
+
+
+# Write listeners, called as listener(filename, op, before, after) after each
+# successful write through the functions below: op is "insert" (before is
+# None), "update", "delete" (after is None) or "write" for a whole-table
+# rewrite (both None). Rows are in stored (string) form. Listeners run in the
+# writing thread while the table lock is held, so they must be quick.
+_listeners: Dict[str, List] = {}
+_listeners_guard = threading.Lock()
+
+def add_listener(filename: str, listener):
+    """Call listener after every write to filename"""
+    with _listeners_guard:
+        _listeners[filename] = _listeners.get(filename, []) + [listener]
+
+def remove_listener(filename: str, listener):
+    with _listeners_guard:
+        remaining = [func for func in _listeners.get(filename, []) if func is not listener]
+        if remaining:
+            _listeners[filename] = remaining
+        else:
+            _listeners.pop(filename, None)
+
+def _notify(filename: str, op: str, changes: List[Tuple[Optional[Dict], Optional[Dict]]]):
+    for listener in _listeners.get(filename, []):
+        for before, after in changes:
+            try:
+                listener(filename, op, before, after)
+            except Exception as e:
+                print(f"Error in write listener for {filename}: {e}")
+
+
+class ChangeFeed:
+    """
+    Change sequence of one table, for delta sync
+
+    Every write bumps the sequence and remembers the key of each row it
+    touched; only the latest CHANGE_FEED_SIZE keys are kept. The sequence
+    starts from the clock (in microseconds), so a cursor handed out before a
+    restart, or older than the kept history, is recognised as stale and the
+    caller falls back to a full read.
+    """
+
+    def __init__(self, key_field: str = "id", max_changes: int = CHANGE_FEED_SIZE):
+        self.key_field = key_field
+        self.max_changes = max_changes
+        self.seq = time.time_ns() // 1000
+        # Oldest cursor that can still be answered with a delta
+        self.floor = self.seq
+        # key -> sequence of its latest change, oldest first
+        self._changes: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, filename: str, op: str, before: Optional[Dict], after: Optional[Dict]):
+        with self._lock:
+            self.seq += 1
+            if op == "write":
+                # No way to tell which rows a rewrite changed
+                self._changes.clear()
+                self.floor = self.seq
+                return
+            for row in (before, after):
+                if row is not None:
+                    key = row.get(self.key_field)
+                    self._changes.pop(key, None)
+                    self._changes[key] = self.seq
+            while len(self._changes) > self.max_changes:
+                _, self.floor = self._changes.popitem(last=False)
+
+    def since(self, seq: int) -> Tuple[Optional[List[str]], int]:
+        """(keys changed after seq, oldest change first, current sequence); keys is None for a stale seq"""
+        with self._lock:
+            if seq < self.floor or seq > self.seq:
+                return None, self.seq
+            keys = []
+            for key, changed in reversed(self._changes.items()):
+                if changed <= seq:
+                    break
+                keys.append(key)
+            keys.reverse()
+            return keys, self.seq
+
+
+_change_feeds: Dict[str, ChangeFeed] = {}
+
+def changes_since(filename: str, seq: int) -> Tuple[Optional[List[str]], int]:
+    """
+    Keys of the rows of filename inserted, updated or deleted after seq, and
+    the sequence to pass next time. Keys is None when seq is too old (or from
+    another run) and the caller has to read the table in full. The feed
+    starts with the first call, and sees writes made by this process only.
+    """
+    feed = _change_feeds.get(filename)
+    if feed is None:
+        with _listeners_guard:
+            feed = _change_feeds.get(filename)
+            if feed is None:
+                feed = _change_feeds[filename] = ChangeFeed()
+                _listeners[filename] = _listeners.get(filename, []) + [feed.record]
+    return feed.since(seq)
+
+
+def read_csv(filename: str, typed: bool = False) -> List[Dict]:
+    """Read data from CSV file (typed=True decodes columns per TABLE_TYPES)"""
+    return get_backend().read_csv(filename, typed)
+
+def write_csv(filename: str, data: List[Dict], fieldnames: List[str]):
+    """Write data to CSV file"""
+    if not _listeners.get(filename):
+        get_backend().write_csv(filename, data, fieldnames)
+        return
+    with _table_lock(filename):
+        get_backend().write_csv(filename, data, fieldnames)
+        _notify(filename, "write", [(None, None)])
+
+def append_csv(filename: str, row: Dict, fieldnames: List[str]):
+    """Append a row to CSV file"""
+    if not _listeners.get(filename):
+        get_backend().append_csv(filename, row, fieldnames)
+        return
+    append_many(filename, [row], fieldnames)
+
+def append_many(filename: str, rows: List[Dict], fieldnames: List[str]):
+    """Append several rows to CSV file in one write"""
+    if not _listeners.get(filename):
+        get_backend().append_many(filename, rows, fieldnames)
+        return
+    with _table_lock(filename):
+        get_backend().append_many(filename, rows, fieldnames)
+        _notify(filename, "insert", [(None, _normalize_row(row, fieldnames)) for row in rows])
 
 def update_csv(filename: str, key_field: str, key_value: str, updates: Dict, fieldnames: List[str]):
     """Update a row in CSV file"""
-    data = read_csv(filename)
-    
-    for i, row in enumerate(data):
-        if row.get(key_field) == key_value:
-            data[i].update(updates)
-            break
-    
-    write_csv(filename, data, fieldnames)
+    if not _listeners.get(filename):
+        get_backend().update_csv(filename, key_field, key_value, updates, fieldnames)
+        return
+    with _table_lock(filename):
+        before = get_backend().find_one(filename, key_field, key_value)
+        get_backend().update_csv(filename, key_field, key_value, updates, fieldnames)
+        if before is not None:
+            after = dict(before)
+            after.update(_normalize_row(updates, list(updates)))
+            _notify(filename, "update", [(before, after)])
 
 def delete_csv(filename: str, key_field: str, key_value: str, fieldnames: List[str]):
     """Delete a row from CSV file"""
-    data = read_csv(filename)
-    data = [row for row in data if row.get(key_field) != key_value]
-    write_csv(filename, data, fieldnames)
+    if not _listeners.get(filename):
+        get_backend().delete_csv(filename, key_field, key_value, fieldnames)
+        return
+    with _table_lock(filename):
+        doomed = get_backend().find_all(filename, key_field, key_value)
+        get_backend().delete_csv(filename, key_field, key_value, fieldnames)
+        _notify(filename, "delete", [(row, None) for row in doomed])
+
+def delete_many(filename: str, key_field: str, key_values: List[str], fieldnames: List[str]):
+    """Delete every row whose key is one of key_values (one file rewrite rather than one per key)"""
+    if not key_values:
+        return
+    if not _listeners.get(filename):
+        get_backend().delete_many(filename, key_field, key_values, fieldnames)
+        return
+    with _table_lock(filename):
+        doomed, _ = get_backend().query(filename, filters={key_field: list(key_values)})
+        get_backend().delete_many(filename, key_field, key_values, fieldnames)
+        _notify(filename, "delete", [(row, None) for row in doomed])
 
-def find_one(filename: str, key_field: str, key_value: str) -> Optional[Dict]:
+def find_one(filename: str, key_field: str, key_value: str, typed: bool = False) -> Optional[Dict]:
     """Find one record by key"""
-    data = read_csv(filename)
-    for row in data:
-        if row.get(key_field) == key_value:
-            return row
-    return None
+    return get_backend().find_one(filename, key_field, key_value, typed)
+
+def next_sequence(filename: str) -> str:
+    """Next numeric id for a new row of filename (unique, never reused)"""
+    return get_backend().next_sequence(filename)
+
+def iter_rows(filename: str, typed: bool = False):
+    """
+    Every record, one partition at a time for partitioned tables, so a
+    full-history scan need not hold the whole table at once
+    """
+    return get_backend().iter_rows(filename, typed)
+
+def find_many(filename: str, filter_func=None, typed: bool = False) -> List[Dict]:
+    """Find multiple records with optional filter (filter_func must not modify rows)"""
+    return get_backend().find_many(filename, filter_func, typed)
+
+def find_all(filename: str, key_field: str, key_value: str, typed: bool = False) -> List[Dict]:
+    """Find every record with a key value (uses the key's index when declared)"""
+    return get_backend().find_all(filename, key_field, key_value, typed)
+
+def group_by(filename: str, key_field: str, keys: Optional[List[str]] = None,
+             typed: bool = False) -> Dict[str, List[Dict]]:
+    """Records grouped by key_field, restricted to keys if given (for joins)"""
+    return get_backend().group_by(filename, key_field, keys, typed)
+
+def query(filename: str, filters: Optional[Dict] = None, ranges: Optional[Dict] = None,
+          sort: Optional[str] = None, descending: bool = False, limit: Optional[int] = None,
+          cursor: Optional[str] = None, typed: bool = False) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Filtered, sorted page of a table: (rows, next_cursor)
+
+    filters maps field -> value or list of values, ranges maps field ->
+    (low, high) with None for an open end. Rows are ordered by sort (decoded
+    per TABLE_TYPES, ties broken by id) or, without one, kept in storage order
+    for scans and index order when an index narrowed them. Pass next_cursor
+    back with the same filters and sort to get the following page; it is None
+    on the last page. Raises ValueError for a cursor that does not fit.
+    """
+    return get_backend().query(filename, filters, ranges, sort, descending, limit, cursor, typed)
+
+
+def _migrate_file(filename: str, fieldnames: List[str]) -> bool:
+    """Rewrite one CSV file under fieldnames if its header lacks some of them; True if it did"""
+    filepath = get_csv_path(filename)
+    if not os.path.exists(filepath):
+        return False
+    with _table_lock(filename):
+        with open(filepath, 'r', encoding='utf-8', newline='') as f:
+            header = next(csv.reader(f), None)
+        # Leave alone a file already current, or one with columns we don't know
+        if not header or header == list(fieldnames) or not set(header) < set(fieldnames):
+            return False
+        entry = _read_entry(filename)
+        rows = []
+        for row in (entry.rows if entry is not None else []):
+            row = dict(row)
+            extra = row.pop(None, None)
+            # A row appended with every current column under the old header:
+            # csv.DictReader put its values in the wrong columns
+            if extra and len(header) + len(extra) == len(fieldnames):
+                row = dict(zip(fieldnames, [row[field] for field in header] + extra))
+            rows.append(row)
+        get_backend().write_csv(filename, rows, fieldnames)
+    print(f"Migrated {filename}: added {', '.join(f for f in fieldnames if f not in header)}")
+    return True
+
+def migrate_tables() -> int:
+    """
+    Bring CSV tables written under an older schema up to TABLE_SCHEMAS:
+    missing columns are added (blank), and rows appended with the new columns
+    before the header had them are put back in the right columns. Call at
+    startup, before recover_transactions; returns how many files it rewrote.
+    """
+    if not isinstance(get_backend(), CSVBackend):
+        return 0
+    migrated = 0
+    for table, fieldnames in TABLE_SCHEMAS.items():
+        manifest = _read_manifest(table) if table in TABLE_PARTITIONS else None
+        files = [_partition_file(table, key) for key in manifest["partitions"]] if manifest else [table]
+        for filename in files:
+            if _migrate_file(filename, fieldnames):
+                migrated += 1
+    return migrated
+
+
+# Transactions
+#
+# A Transaction groups writes to several tables (an order, its details and
+# its table's status) so that they land together or not at all. commit()
+# appends the whole group to this process's journal and syncs it to disk,
+# applies the writes through the functions above (listeners fire as usual)
+# and marks the group done. A group that reached the journal is committed:
+# if the process dies while applying it, recover_transactions() finishes it
+# on the next start. One that did not reach the journal touched no table.
+# Before the first write, every op is checked against its table's stored
+# header, and the rows the updates and deletes will change are journaled as
+# before-images. If a write still fails (an I/O error, say), the writes
+# already made are undone in reverse order from those images, and the
+# group is moved to QUARANTINE_PATH with its error, both at commit and at
+# recovery, since it would fail the same way on every replay.
+#
+# An add op (Transaction.add_csv) moves totals by an amount rather than
+# setting them, so that callers need not read and lock the row first. It is
+# turned into the insert or update it comes to under the table locks, and
+# journaled in that form with the before-images, so a replay never adds
+# the amount twice.
+
+def _try_lock(f) -> bool:
+    """Take an exclusive lock on an open file without waiting; it is held until the file is closed"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+class Journal:
+    """
+    Write-ahead journal of one process, with group commit
+
+    Commits arriving together share one write and one fsync: whichever finds
+    no flush in progress writes every record queued so far, and the rest
+    wait for it. Records are then applied one at a time in journal order, so
+    replaying the journal reproduces what happened. The process keeps its
+    journal file locked while it runs, which is how recovery tells a live
+    journal from one left behind by a crash.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        if not _try_lock(self._file):
+            self._file.close()
+            raise RuntimeError(f"Journal {path} is locked by another process")
+        self._cond = threading.Condition()
+        # Serializes writes to the file: record batches and done marks
+        self._io_lock = threading.Lock()
+        self._txids = itertools.count(1)
+        self._pending: List[str] = []
+        # Tickets number the records: queued so far, flushed, and applied
+        self._queued = 0
+        self._flushed = 0
+        self._applied = 0
+        self._flushing = False
+        self._failed: Dict[int, Exception] = {}
+        # Set when a record that could not be applied could not be
+        # quarantined either: it stays in the journal for recovery, so the
+        # journal is never emptied again
+        self._stuck = False
+        self._touched = set()
+        self.commits = 0
+        self.quarantined = 0
+        self.flushes = 0
+        self.checkpoints = 0
+
+    def commit(self, ops: List[Dict], apply):
+        """
+        Journal ops durably, then call apply(log_before) in journal order and
+        mark them done. apply hands log_before the ops' before-images (and
+        the ops its add ops resolved to, if any) ahead of its first write.
+        """
+        txid = next(self._txids)
+        line = json.dumps({"tx": txid, "ops": ops}, ensure_ascii=False) + "\n"
+        with self._cond:
+            self._pending.append(line)
+            self._queued += 1
+            ticket = self._queued
+            self._touched.update(op["file"] for op in ops)
+            while self._flushed < ticket:
+                if self._flushing:
+                    self._cond.wait()
+                else:
+                    self._flush_pending()
+            error = self._failed.pop(ticket, None)
+            while self._applied < ticket - 1:
+                self._cond.wait()
+        try:
+            if error is not None:
+                raise error
+            try:
+                apply(lambda images, resolved=None: self._log_before(txid, images, resolved))
+            except Exception as e:
+                print(f"Error applying transaction {txid}: {e}")
+                try:
+                    _quarantine(self.path, txid, ops, e)
+                except Exception as q:
+                    self._stuck = True
+                    print(f"Error quarantining transaction {txid}, it will be retried on restart: {q}")
+                else:
+                    with self._io_lock:
+                        self._file.write(json.dumps({"quarantined": txid}) + "\n")
+                        self._file.flush()
+                    self.quarantined += 1
+                raise
+            with self._io_lock:
+                self._file.write(json.dumps({"done": txid}) + "\n")
+                self._file.flush()
+            self.commits += 1
+        finally:
+            with self._cond:
+                self._applied = ticket
+                self._maybe_checkpoint()
+                self._cond.notify_all()
+
+    def _log_before(self, txid: int, images: List, resolved: Optional[List[Dict]] = None):
+        # Written, not synced, like the table writes it comes before: a
+        # process that dies still leaves it for recovery to undo with
+        if not any(images) and resolved is None:
+            return
+        record = {"before": txid, "images": images}
+        if resolved is not None:
+            record["ops"] = resolved
+        with self._io_lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def _flush_pending(self):
+        # Called with _cond held; it is released during the write and fsync
+        # so that other commits can queue up for the next flush meanwhile
+        batch, self._pending = self._pending, []
+        first = self._flushed + 1
+        self._flushing = True
+        self._cond.release()
+        error = None
+        try:
+            with self._io_lock:
+                start = self._file.tell()
+                try:
+                    self._file.write("".join(batch))
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                except Exception as e:
+                    error = e
+                    # Don't leave part of the batch behind to be replayed
+                    self._file.truncate(start)
+        except Exception as e:
+            error = error or e
+        finally:
+            self._cond.acquire()
+        self._flushing = False
+        self._flushed += len(batch)
+        self.flushes += 1
+        if error is not None:
+            print(f"Error writing journal {self.path}: {error}")
+            for ticket in range(first, first + len(batch)):
+                self._failed[ticket] = error
+        self._cond.notify_all()
+
+    def _maybe_checkpoint(self):
+        # Called with _cond held. Empty the journal once every record in it
+        # has been applied and the tables it touched are safely on disk.
+        if self._stuck or self._applied < self._queued:
+            return
+        with self._io_lock:
+            if self._file.tell() < JOURNAL_CHECKPOINT_BYTES:
+                return
+            try:
+                for filename in sorted(self._touched):
+                    get_backend().sync(filename)
+                self._file.truncate(0)
+            except Exception as e:
+                print(f"Error checkpointing journal {self.path}: {e}")
+                return
+        self._touched.clear()
+        self.checkpoints += 1
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "commits": self.commits,
+                "flushes": self.flushes,
+                "checkpoints": self.checkpoints,
+                "in_flight": self._queued - self._applied,
+                "quarantined": self.quarantined,
+                "stuck": self._stuck
+            }
+
+    def close(self):
+        self._file.close()
+
+
+_journal: Optional[Journal] = None
+_journal_guard = threading.Lock()
+
+def _get_journal() -> Journal:
+    global _journal
+    if _journal is None:
+        with _journal_guard:
+            if _journal is None:
+                os.makedirs(JOURNAL_DIR, exist_ok=True)
+                path = os.path.join(JOURNAL_DIR, f"{os.getpid()}-{time.time_ns()}.wal")
+                _journal = Journal(path)
+    return _journal
+
+def _reset_journal_after_fork():
+    # A forked child gets a journal of its own; closing its copy of the
+    # parent's file leaves the parent's lock in place
+    global _journal
+    if _journal is not None:
+        _journal.close()
+    _journal = None
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_journal_after_fork)
+
+
+class Transaction:
+    """
+    Writes to one or more tables that are applied together
+
+    Collect them with the methods below, named after the module functions
+    (add_csv has none: it only exists as part of a transaction), then call
+    commit() (or use the transaction() context manager). Nothing reaches a
+    table before commit.
+    """
+
+    def __init__(self):
+        self.ops: List[Dict] = []
+
+    def append_csv(self, filename: str, row: Dict, fieldnames: List[str]):
+        self.append_many(filename, [row], fieldnames)
+
+    def append_many(self, filename: str, rows: List[Dict], fieldnames: List[str]):
+        for row in rows:
+            _check_fields(row, fieldnames)
+        self.ops.append({"op": "insert", "file": filename, "fieldnames": list(fieldnames),
+                         "rows": [_normalize_row(row, fieldnames) for row in rows]})
+
+    def update_csv(self, filename: str, key_field: str, key_value: str, updates: Dict, fieldnames: List[str]):
+        _check_fields(updates, fieldnames)
+        self.ops.append({"op": "update", "file": filename, "fieldnames": list(fieldnames),
+                         "key": key_field, "value": key_value, "updates": _normalize_row(updates, list(updates))})
+
+    def add_csv(self, filename: str, key_field: str, key_value: str, amounts: Dict, row: Dict,
+                fieldnames: List[str]):
+        """
+        Add amounts ({field: int or float}) to the numeric fields of the row
+        with key_value, or insert row with the amounts as those fields if
+        there is none yet. Ints are stored as such, floats with 2 decimals.
+        """
+        _check_fields(row, fieldnames)
+        _check_fields(amounts, fieldnames)
+        self.ops.append({"op": "add", "file": filename, "fieldnames": list(fieldnames),
+                         "key": key_field, "value": key_value, "amounts": dict(amounts),
+                         "row": _normalize_row(row, fieldnames)})
+
+    def delete_csv(self, filename: str, key_field: str, key_value: str, fieldnames: List[str]):
+        self.delete_many(filename, key_field, [key_value], fieldnames)
+
+    def delete_many(self, filename: str, key_field: str, key_values: List[str], fieldnames: List[str]):
+        self.ops.append({"op": "delete", "file": filename, "fieldnames": list(fieldnames),
+                         "key": key_field, "values": list(key_values)})
 
-def find_many(filename: str, filter_func=None) -> List[Dict]:
-    """Find multiple records with optional filter"""
-    data = read_csv(filename)
-    if filter_func:
-        data = [row for row in data if filter_func(row)]
-    return data
+    def commit(self):
+        """Journal and apply the collected writes; raises if they could not be journaled"""
+        if not self.ops:
+            return
+        ops, self.ops = self.ops, []
+        _get_journal().commit(ops, lambda log_before: _apply_ops(ops, log_before=log_before))
+
+
+@contextmanager
+def transaction():
+    """with transaction() as tx: ... commits tx if the block finishes without raising"""
+    tx = Transaction()
+    yield tx
+    tx.commit()
+
+# Lock files of locked_tables by path, kept open. A table's thread lock is
+# always taken before its lock file, so one thread at a time uses each.
+_table_lock_files: Dict[str, object] = {}
+_table_lock_files_guard = threading.Lock()
+# Lock files the current thread holds, so that it can nest locked_tables
+_held_lock_files = threading.local()
+
+def _table_lock_file(path: str):
+    with _table_lock_files_guard:
+        f = _table_lock_files.get(path)
+        if f is None:
+            f = _table_lock_files[path] = open(path, "a+", encoding="utf-8")
+        return f
+
+def _close_table_lock_files_after_fork():
+    # The child's copies share the parent's locks; it opens its own
+    for f in _table_lock_files.values():
+        f.close()
+    _table_lock_files.clear()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_close_table_lock_files_after_fork)
+
+@contextmanager
+def locked_tables(filenames):
+    """
+    Hold the locks of several tables, against this process's other threads
+    and, through a <table>.lock file next to each table, other processes.
+    They are taken in name order so that writers with overlapping tables
+    cannot deadlock; a thread already holding some may take them again.
+    Don't commit a transaction while holding them: it may have to wait for
+    an earlier one that needs them.
+    """
+    files = sorted(set(filenames))
+    held = getattr(_held_lock_files, "paths", None)
+    if held is None:
+        held = _held_lock_files.paths = set()
+    with ExitStack() as stack:
+        for filename in files:
+            stack.enter_context(_table_lock(filename))
+        for filename in files:
+            path = get_csv_path(filename) + ".lock"
+            if path in held:
+                continue
+            f = _table_lock_file(path)
+            _lock(f)
+            held.add(path)
+            stack.callback(held.discard, path)
+            stack.callback(_unlock, f)
+        yield
+
+
+class RollbackError(Exception):
+    """A transaction failed and the writes it had made could not all be undone"""
+
+
+def _check_ops(ops: List[Dict]):
+    """Raise ValueError for an op that does not fit its table, before anything is written"""
+    for op in ops:
+        if op["op"] in ("update", "delete") and op["key"] not in op["fieldnames"]:
+            raise ValueError(f"{op['file']}: key {op['key']!r} is not among the written columns")
+        get_backend().check_write(op["file"], op["op"], op["fieldnames"], op.get("rows"))
+
+def _format_amount(value) -> str:
+    return f"{value:.2f}" if isinstance(value, float) else str(value)
+
+def _resolve_adds(ops: List[Dict]) -> List[Dict]:
+    """ops with each add turned into the update or insert it comes to against the stored rows"""
+    resolved = []
+    for op in ops:
+        if op["op"] != "add":
+            resolved.append(op)
+            continue
+        filename, fieldnames = op["file"], op["fieldnames"]
+        current = find_one(filename, op["key"], op["value"], typed=True)
+        if current is None:
+            # Two adds to a new row within one transaction: the second updates
+            # the row the first inserts
+            current = next((_decode_row(filename, row) for earlier in resolved
+                            if earlier["op"] == "insert" and earlier["file"] == filename
+                            for row in earlier["rows"] if row[op["key"]] == op["value"]), None)
+        if current is None:
+            row = {**op["row"], **{field: _format_amount(amount) for field, amount in op["amounts"].items()}}
+            resolved.append({"op": "insert", "file": filename, "fieldnames": fieldnames, "rows": [row]})
+        else:
+            updates = {field: _format_amount((current.get(field) or 0) + amount)
+                       for field, amount in op["amounts"].items()}
+            resolved.append({"op": "update", "file": filename, "fieldnames": fieldnames,
+                             "key": op["key"], "value": op["value"], "updates": updates})
+    return resolved
+
+def _before_images(ops: List[Dict]) -> List:
+    """
+    Per op, what undoing it needs besides the op itself: the old values of
+    the fields an update sets, the rows a delete removes (None for inserts)
+    """
+    images = []
+    for op in ops:
+        if op["op"] == "update":
+            row = find_one(op["file"], op["key"], op["value"])
+            images.append([{field: row.get(field) or "" for field in op["updates"]}] if row else [])
+        elif op["op"] == "delete":
+            groups = group_by(op["file"], op["key"], op["values"])
+            images.append([row for value in op["values"] for row in groups.get(value, [])])
+        else:
+            images.append(None)
+    return images
+
+def _remove_rows(filename: str, rows: List[Dict], fieldnames: List[str]):
+    """Take rows an insert added back out of a table (by id where rows have one)"""
+    if "id" in fieldnames and all(row.get("id") for row in rows):
+        delete_many(filename, "id", [row["id"] for row in rows], fieldnames)
+        return
+    doomed = Counter(tuple(row[field] for field in fieldnames) for row in rows)
+    stored = read_csv(filename)
+    kept = []
+    for row in stored:
+        values = tuple(row.get(field, "") for field in fieldnames)
+        if doomed[values]:
+            doomed[values] -= 1
+        else:
+            kept.append(row)
+    if len(kept) < len(stored):
+        write_csv(filename, kept, fieldnames)
+
+def _undo_ops(ops: List[Dict], images: List):
+    """Undo ops in reverse order; each undo is harmless if its op was never applied"""
+    for op, image in reversed(list(zip(ops, images))):
+        filename, fieldnames = op["file"], op["fieldnames"]
+        if op["op"] == "insert":
+            _remove_rows(filename, op["rows"], fieldnames)
+        elif op["op"] == "update":
+            value = op["updates"].get(op["key"], op["value"])
+            for before in image or []:
+                update_csv(filename, op["key"], value, before, fieldnames)
+        elif op["op"] == "delete":
+            rows = _missing_rows(filename, [_normalize_row(row, fieldnames) for row in image or []], fieldnames)
+            if rows:
+                append_many(filename, rows, fieldnames)
+
+def _apply_ops(ops: List[Dict], replay: bool = False, log_before=None, images: Optional[List] = None):
+    """
+    Apply journaled writes, all or none: if one fails, the ones made are
+    undone and the error re-raised (as RollbackError if undoing failed too)
+
+    Args:
+        ops: Journaled operations
+        replay: Skip inserts whose rows are already stored (recovery)
+        log_before: Called with the before-images, and the resolved ops if
+            there were add ops, ahead of the first write
+        images: Before-images journaled when the ops were first applied
+            (with ops as resolved then); the ops are then undone in full on
+            failure, since the crashed process may have made any of them
+    """
+    # Table locks keep other writers, in this process or another, from
+    # slipping in between the operations (or between reading the totals of
+    # an add op and setting them)
+    adds = any(op["op"] == "add" for op in ops)
+    with locked_tables([op["file"] for op in ops]):
+        journaled = images is not None
+        # Ops written so far; -1 until the checks pass and writing starts
+        applied = -1
+        try:
+            if adds:
+                ops = _resolve_adds(ops)
+            _check_ops(ops)
+            if images is None:
+                images = _before_images(ops)
+            if log_before is not None:
+                log_before(images, ops if adds else None)
+            applied = 0
+            for op in ops:
+                filename, fieldnames = op["file"], op["fieldnames"]
+                if op["op"] == "insert":
+                    rows = _missing_rows(filename, op["rows"], fieldnames) if replay else op["rows"]
+                    if rows:
+                        append_many(filename, rows, fieldnames)
+                elif op["op"] == "update":
+                    update_csv(filename, op["key"], op["value"], op["updates"], fieldnames)
+                elif op["op"] == "delete":
+                    delete_many(filename, op["key"], op["values"], fieldnames)
+                applied += 1
+        except Exception as e:
+            # The failing op may have been partly applied
+            undo = len(ops) if journaled else applied + 1
+            if not undo:
+                raise
+            try:
+                _undo_ops(ops[:undo], images[:undo])
+            except Exception as u:
+                print(f"Error undoing a failed transaction: {u}")
+                raise RollbackError(f"{e} (undo failed: {u})") from e
+            print(f"Undid the writes of a failed transaction: {e}")
+            raise
+
+def _missing_rows(filename: str, rows: List[Dict], fieldnames: List[str]) -> List[Dict]:
+    """The rows not yet in a table (counting duplicates), so replaying an insert is harmless"""
+    stored = Counter(tuple(row.get(field, "") for field in fieldnames) for row in read_csv(filename))
+    missing = []
+    for row in rows:
+        values = tuple(row[field] for field in fieldnames)
+        if stored[values]:
+            stored[values] -= 1
+        else:
+            missing.append(row)
+    return missing
+
+def _unfinished_transactions(f) -> List[Tuple[int, List[Dict], Optional[List]]]:
+    """
+    (txid, operations, before-images or None) of the journaled transactions
+    not marked done or quarantined, in journal order; operations as their
+    add ops were resolved when the transaction was first applied
+    """
+    open_ops = OrderedDict()
+    images = {}
+    for line in f:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # A record cut short by a crash was never acknowledged
+            continue
+        if "done" in record:
+            open_ops.pop(record["done"], None)
+        elif "quarantined" in record:
+            open_ops.pop(record["quarantined"], None)
+        elif "before" in record:
+            images[record["before"]] = record["images"]
+            if "ops" in record and record["before"] in open_ops:
+                open_ops[record["before"]] = record["ops"]
+        elif "tx" in record:
+            open_ops[record["tx"]] = record["ops"]
+    return [(txid, ops, images.get(txid)) for txid, ops in open_ops.items()]
+
+def _quarantine(journal_path: str, txid: int, ops: List[Dict], error: Exception):
+    """Set a transaction that cannot be applied aside in QUARANTINE_PATH, synced to disk"""
+    record = {
+        "journal": os.path.basename(journal_path),
+        "tx": txid,
+        "error": f"{type(error).__name__}: {error}",
+        # Whether the writes it had made were undone
+        "rolledBack": not isinstance(error, RollbackError),
+        "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "ops": ops
+    }
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    with _locked_file(QUARANTINE_PATH) as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def recover_transactions() -> int:
+    """
+    Finish the transactions that crashed processes journaled but did not
+    finish applying. Call at startup; returns how many were replayed.
+
+    A transaction that fails to replay is undone from its journaled
+    before-images, logged and moved to QUARANTINE_PATH, so one bad record
+    cannot keep the app from starting.
+    """
+    if not os.path.isdir(JOURNAL_DIR):
+        return 0
+    replayed = 0
+    quarantined = 0
+    for name in sorted(os.listdir(JOURNAL_DIR)):
+        path = os.path.join(JOURNAL_DIR, name)
+        if not name.endswith(".wal") or (_journal is not None and path == _journal.path):
+            continue
+        with open(path, "r+", encoding="utf-8") as f:
+            if not _try_lock(f):
+                # Its process is still running
+                continue
+            f.seek(0)
+            keep = False
+            for txid, ops, images in _unfinished_transactions(f):
+                try:
+                    # Without journaled images the crashed process made no write
+                    _apply_ops(ops, replay=True, images=images)
+                    replayed += 1
+                except Exception as e:
+                    print(f"Error replaying transaction {txid} of {path}: {e}")
+                    try:
+                        _quarantine(path, txid, ops, e)
+                        quarantined += 1
+                    except Exception as q:
+                        # Leave the journal for the next start rather than lose the record
+                        print(f"Error quarantining transaction {txid} of {path}: {q}")
+                        keep = True
+        if keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    if replayed:
+        print(f"Recovered {replayed} unfinished transaction(s) from {JOURNAL_DIR}")
+    if quarantined:
+        print(f"Quarantined {quarantined} transaction(s) that could not be replayed in {QUARANTINE_PATH}")
+    return replayed
+
+def get_journal_stats() -> Dict:
+    """Commit, fsync and checkpoint counters of this process's transaction journal"""
+    return _journal.stats() if _journal is not None else {}
+
+
+class IOPool:
+    """
+    Bounded thread pool that keeps blocking storage calls off the event loop
+
+    Tracks how many calls are waiting for a worker and how long they waited,
+    which is what to watch when sizing CAFE_IO_POOL_SIZE.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db-io")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def run(self, func, *args):
+        """Run func(*args) on a worker thread and await its result"""
+        submitted = time.perf_counter()
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+        def task():
+            wait = time.perf_counter() - submitted
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, task)
+
+    def stats(self) -> Dict:
+        """Current queue depth, busy workers and wait times (seconds)"""
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "queued": self.queued,
+                "running": self.running,
+                "max_queued": self.max_queued,
+                "completed": self.completed,
+                "avg_wait": self.total_wait / self.completed if self.completed else 0.0,
+                "max_wait": self.max_wait
+            }
+
+
+_io_pool = IOPool(IO_POOL_SIZE)
+
+# Async variants of the storage API for use inside async handlers
+
+async def aread_csv(filename: str, typed: bool = False) -> List[Dict]:
+    """Async read_csv"""
+    return await _io_pool.run(read_csv, filename, typed)
+
+async def awrite_csv(filename: str, data: List[Dict], fieldnames: List[str]):
+    """Async write_csv"""
+    await _io_pool.run(write_csv, filename, data, fieldnames)
+
+async def aappend_csv(filename: str, row: Dict, fieldnames: List[str]):
+    """Async append_csv"""
+    await _io_pool.run(append_csv, filename, row, fieldnames)
+
+async def aappend_many(filename: str, rows: List[Dict], fieldnames: List[str]):
+    """Async append_many"""
+    await _io_pool.run(append_many, filename, rows, fieldnames)
+
+async def aupdate_csv(filename: str, key_field: str, key_value: str, updates: Dict, fieldnames: List[str]):
+    """Async update_csv"""
+    await _io_pool.run(update_csv, filename, key_field, key_value, updates, fieldnames)
+
+async def adelete_csv(filename: str, key_field: str, key_value: str, fieldnames: List[str]):
+    """Async delete_csv"""
+    await _io_pool.run(delete_csv, filename, key_field, key_value, fieldnames)
+
+async def adelete_many(filename: str, key_field: str, key_values: List[str], fieldnames: List[str]):
+    """Async delete_many"""
+    await _io_pool.run(delete_many, filename, key_field, key_values, fieldnames)
+
+async def acommit(tx: Transaction):
+    """Async Transaction.commit"""
+    await _io_pool.run(tx.commit)
+
+async def anext_sequence(filename: str) -> str:
+    """Async next_sequence"""
+    return await _io_pool.run(next_sequence, filename)
+
+async def afind_one(filename: str, key_field: str, key_value: str, typed: bool = False) -> Optional[Dict]:
+    """Async find_one"""
+    return await _io_pool.run(find_one, filename, key_field, key_value, typed)
+
+async def afind_many(filename: str, filter_func=None, typed: bool = False) -> List[Dict]:
+    """Async find_many"""
+    return await _io_pool.run(find_many, filename, filter_func, typed)
+
+async def afind_all(filename: str, key_field: str, key_value: str, typed: bool = False) -> List[Dict]:
+    """Async find_all"""
+    return await _io_pool.run(find_all, filename, key_field, key_value, typed)
+
+async def agroup_by(filename: str, key_field: str, keys: Optional[List[str]] = None,
+                    typed: bool = False) -> Dict[str, List[Dict]]:
+    """Async group_by"""
+    return await _io_pool.run(group_by, filename, key_field, keys, typed)
+
+async def aquery(filename: str, filters: Optional[Dict] = None, ranges: Optional[Dict] = None,
+                 sort: Optional[str] = None, descending: bool = False, limit: Optional[int] = None,
+                 cursor: Optional[str] = None, typed: bool = False) -> Tuple[List[Dict], Optional[str]]:
+    """Async query"""
+    return await _io_pool.run(query, filename, filters, ranges, sort, descending, limit, cursor, typed)
+
+async def arun(func, *args):
+    """Run another blocking call (a report, a job step) on the same I/O pool"""
+    return await _io_pool.run(func, *args)
+
+def get_io_pool_stats() -> Dict:
+    """Queue depth and wait-time metrics of the async I/O pool"""
+    return _io_pool.stats()
+
+def get_cache_stats() -> Dict:
+    """Hit/miss counters and memory use of the table cache"""
+    return _cache.stats()
+
+def clear_cache(filename: Optional[str] = None):
+    """Drop one table (or all tables) from the table cache"""
+    _cache.invalidate(filename)
+    manifest = _read_manifest(filename) if filename in TABLE_PARTITIONS else None
+    for key in (manifest or {}).get("partitions", []):
+        _cache.invalidate(_partition_file(filename, key))
+
+
+# Log compaction
+
+_compacting = set()
+_compacting_guard = threading.Lock()
+
+def _maybe_compact(filename: str, entry: _CacheEntry):
+    """Start a background compaction once a table's log passes its thresholds"""
+    log_bytes = entry.signature[1][1] if entry.signature[1] else 0
+    too_many = (entry.log_records >= _LOG_COMPACT_MIN_RECORDS
+                and entry.log_records > LOG_COMPACT_RATIO * entry.base_rows)
+    if log_bytes < LOG_COMPACT_BYTES and not too_many:
+        return
+
+    with _compacting_guard:
+        if filename in _compacting:
+            return
+        _compacting.add(filename)
+
+    def run():
+        try:
+            compact_log(filename)
+        except Exception as e:
+            print(f"Error compacting {filename}: {e}")
+        finally:
+            with _compacting_guard:
+                _compacting.discard(filename)
+
+    threading.Thread(target=run, name=f"compact-{filename}", daemon=True).start()
+
+def compact_log(filename: str) -> bool:
+    """
+    Fold a table's change log into its base CSV file
+
+    The new base file is written from a snapshot without holding the table
+    lock, so writers keep appending to the log meanwhile. Only the final swap
+    is done under the lock, carrying over any records logged since the
+    snapshot. Returns False if there was nothing to compact or the base file
+    was rewritten by someone else in the meantime.
+    """
+    filepath = get_csv_path(filename)
+    log_path = get_log_path(filename)
+    tmp_path = filepath + ".compact"
+
+    with _table_lock(filename):
+        entry = _load_entry(filename)
+        if entry is None or entry.signature[1] is None:
+            return False
+        snapshot = [dict(row) for row in entry.rows]
+        fieldnames = list(entry.fieldnames)
+        base_signature, log_signature = entry.signature
+
+    try:
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(snapshot)
+        new_crc = _file_crc(tmp_path)
+
+        with _table_lock(filename):
+            current = _table_signature(filename)
+            if current[0] != base_signature or current[1] is None or current[1][1] < log_signature[1]:
+                return False
+
+            with open(log_path, 'rb') as f:
+                f.seek(log_signature[1])
+                tail = f.read()
+            # Written before the base is replaced: if we stop in between,
+            # _recover_log sees this log matches the new base and finishes the swap
+            with open(log_path + ".compact", 'wb') as f:
+                f.write(json.dumps({"base_crc": new_crc}).encode('utf-8') + b"\n")
+                f.write(tail)
+
+            os.replace(tmp_path, filepath)
+            if tail:
+                os.replace(log_path + ".compact", log_path)
+            else:
+                os.remove(log_path + ".compact")
+                os.remove(log_path)
+
+            entry = _cache.peek(filename)
+            if entry is not None and entry.signature == current:
+                entry.signature = _table_signature(filename)
+                entry.base_rows = len(snapshot)
+                entry.log_records = tail.count(b"\n")
+            else:
+                _cache.invalidate(filename)
+        return True
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
 class CSVSchemas:
@@ -138,14 +2560,152 @@ class CSVSchemas:
     # Customers
     CUSTOMERS = ["id", "name", "email", "phone", "totalOrders", "totalSpent", "status"]
     
-    # Revenue
+    # Customer RFM segments (batch job, see segments.py)
+    CUSTOMER_SEGMENTS = [
+        "email", "lastOrder", "recencyDays", "frequency", "monetary",
+        "recencyScore", "frequencyScore", "monetaryScore", "segment", "computed_at"
+    ]
+    
+    # Revenue (daily, hourly and per payment method rollups, see rollups.py)
     REVENUE = ["date", "revenue", "orders"]
+    REVENUE_HOURLY = ["id", "date", "hour", "revenue", "orders"]
+    REVENUE_BY_METHOD = ["id", "date", "payment_method", "revenue", "orders"]
+    
+    # Item sales per day (rollup, see rollups.py)
+    ITEM_SALES = ["id", "date", "menu_item_id", "quantity", "revenue"]
+    
+    # Orders per status and payment status (rollup, see rollups.py)
+    ORDER_STATUS_COUNTS = ["id", "status", "payment_status", "orders"]
+    
+    # Shift reports (cash reconciliation at shift close)
+    SHIFT_REPORTS = [
+        "id", "staff_email", "date", "expectedCash", "actualCash", "difference",
+        "ordersCompleted", "totalRevenue", "notes", "equipmentStatus", "created_at"
+    ]
     
     # Attendance
     ATTENDANCE = ["id", "staff_email", "date", "clockIn", "clockOut", "hours", "status"]
     
+    # Attendance per staff member and week / month (rollup, see attendance.py)
+    ATTENDANCE_TOTALS = ["id", "staff_email", "kind", "period", "hours", "shifts", "late", "absent"]
+    
     # Reservations
     RESERVATIONS = [
         "id", "customer_email", "date", "time", "guests", "notes",
         "status", "table_id", "created_at"
     ]
+    
+    # Rollups of archived orders (see archive.py), per day
+    ARCHIVED_ITEM_SALES = ["date", "menu_item_id", "quantity", "revenue"]
+    ARCHIVED_REVENUE = ["date", "payment_method", "orders", "revenue"]
+    
+    # Column types used by typed reads (read_csv(..., typed=True)).
+    # Columns not listed stay strings.
+    MENU_ITEMS_TYPES = {"price": float}
+    ORDERS_TYPES = {"total": float}
+    ORDER_DETAILS_TYPES = {"quantity": int, "price": float, "subtotal": float}
+    TABLES_TYPES = {"number": int, "capacity": int}
+    INVENTORY_TYPES = {"quantity": float, "minStock": float}
+    PROMOTIONS_TYPES = {"discount": float, "maxDiscount": float, "minOrder": float}
+    FEEDBACK_TYPES = {"foodRating": int, "serviceRating": int}
+    CUSTOMERS_TYPES = {"totalOrders": int, "totalSpent": float}
+    CUSTOMER_SEGMENTS_TYPES = {
+        "recencyDays": int, "frequency": int, "monetary": float,
+        "recencyScore": int, "frequencyScore": int, "monetaryScore": int
+    }
+    REVENUE_TYPES = {"revenue": float, "orders": int}
+    REVENUE_HOURLY_TYPES = {"hour": int, "revenue": float, "orders": int}
+    REVENUE_BY_METHOD_TYPES = {"revenue": float, "orders": int}
+    ITEM_SALES_TYPES = {"quantity": int, "revenue": float}
+    ORDER_STATUS_COUNTS_TYPES = {"orders": int}
+    SHIFT_REPORTS_TYPES = {
+        "expectedCash": float, "actualCash": float, "difference": float,
+        "ordersCompleted": int, "totalRevenue": float
+    }
+    ATTENDANCE_TYPES = {"hours": float}
+    ATTENDANCE_TOTALS_TYPES = {"hours": float, "shifts": int, "late": int, "absent": int}
+    RESERVATIONS_TYPES = {"guests": int}
+    ARCHIVED_ITEM_SALES_TYPES = {"quantity": int, "revenue": float}
+    ARCHIVED_REVENUE_TYPES = {"orders": int, "revenue": float}
+
+
+# CSV file backing each schema
+TABLE_SCHEMAS = {
+    "users.csv": CSVSchemas.USERS,
+    "menu_items.csv": CSVSchemas.MENU_ITEMS,
+    "orders.csv": CSVSchemas.ORDERS,
+    "order_details.csv": CSVSchemas.ORDER_DETAILS,
+    "tables.csv": CSVSchemas.TABLES,
+    "inventory.csv": CSVSchemas.INVENTORY,
+    "promotions.csv": CSVSchemas.PROMOTIONS,
+    "feedback.csv": CSVSchemas.FEEDBACK,
+    "staff.csv": CSVSchemas.STAFF,
+    "customers.csv": CSVSchemas.CUSTOMERS,
+    "customer_segments.csv": CSVSchemas.CUSTOMER_SEGMENTS,
+    "revenue.csv": CSVSchemas.REVENUE,
+    "revenue_hourly.csv": CSVSchemas.REVENUE_HOURLY,
+    "revenue_by_method.csv": CSVSchemas.REVENUE_BY_METHOD,
+    "item_sales.csv": CSVSchemas.ITEM_SALES,
+    "order_status_counts.csv": CSVSchemas.ORDER_STATUS_COUNTS,
+    "shift_reports.csv": CSVSchemas.SHIFT_REPORTS,
+    "attendance.csv": CSVSchemas.ATTENDANCE,
+    "attendance_totals.csv": CSVSchemas.ATTENDANCE_TOTALS,
+    "reservations.csv": CSVSchemas.RESERVATIONS,
+    "archived_item_sales.csv": CSVSchemas.ARCHIVED_ITEM_SALES,
+    "archived_revenue.csv": CSVSchemas.ARCHIVED_REVENUE,
+}
+
+# Column types per table, for typed reads
+TABLE_TYPES = {
+    "menu_items.csv": CSVSchemas.MENU_ITEMS_TYPES,
+    "orders.csv": CSVSchemas.ORDERS_TYPES,
+    "order_details.csv": CSVSchemas.ORDER_DETAILS_TYPES,
+    "tables.csv": CSVSchemas.TABLES_TYPES,
+    "inventory.csv": CSVSchemas.INVENTORY_TYPES,
+    "promotions.csv": CSVSchemas.PROMOTIONS_TYPES,
+    "feedback.csv": CSVSchemas.FEEDBACK_TYPES,
+    "customers.csv": CSVSchemas.CUSTOMERS_TYPES,
+    "customer_segments.csv": CSVSchemas.CUSTOMER_SEGMENTS_TYPES,
+    "revenue.csv": CSVSchemas.REVENUE_TYPES,
+    "revenue_hourly.csv": CSVSchemas.REVENUE_HOURLY_TYPES,
+    "revenue_by_method.csv": CSVSchemas.REVENUE_BY_METHOD_TYPES,
+    "item_sales.csv": CSVSchemas.ITEM_SALES_TYPES,
+    "order_status_counts.csv": CSVSchemas.ORDER_STATUS_COUNTS_TYPES,
+    "shift_reports.csv": CSVSchemas.SHIFT_REPORTS_TYPES,
+    "attendance.csv": CSVSchemas.ATTENDANCE_TYPES,
+    "attendance_totals.csv": CSVSchemas.ATTENDANCE_TOTALS_TYPES,
+    "reservations.csv": CSVSchemas.RESERVATIONS_TYPES,
+    "archived_item_sales.csv": CSVSchemas.ARCHIVED_ITEM_SALES_TYPES,
+    "archived_revenue.csv": CSVSchemas.ARCHIVED_REVENUE_TYPES,
+}
+
+# Declared hash indexes per table, as {field: unique}. Every table keyed by
+# "id" gets a unique index on it; users are also looked up by email and phone
+# (phone is blank for many self-registered customers, so it is not unique),
+# customers and their segments by email.
+# Orders are listed per customer, status and day (the staff screens) and
+# joined to their details by order_id. A tuple of columns declares a
+# composite index, used by queries with a single value for each of them:
+# attendance is looked up per staff member and day on every clock tap.
+TABLE_INDEXES = {
+    filename: {"id": True}
+    for filename, fieldnames in TABLE_SCHEMAS.items()
+    if "id" in fieldnames
+}
+TABLE_INDEXES["users.csv"].update({"email": True, "phone": False})
+TABLE_INDEXES["orders.csv"].update({"customer_email": False, "status": False, "date": False})
+TABLE_INDEXES["order_details.csv"] = {"order_id": False}
+TABLE_INDEXES["revenue.csv"] = {"date": True}
+TABLE_INDEXES["shift_reports.csv"].update({"staff_email": False, "date": False})
+TABLE_INDEXES["customers.csv"].update({"email": True, "phone": False})
+TABLE_INDEXES["customer_segments.csv"] = {"email": True, "segment": False}
+TABLE_INDEXES["attendance.csv"].update({"staff_email": False, ("staff_email", "date"): False})
+TABLE_INDEXES["attendance_totals.csv"].update({"kind": False})
+
+# Tables that can be split by date (see PARTITION_BY), as filename ->
+# (column, kind): "date" columns hold YYYY-MM-DD..., while "id" columns hold
+# ids with the creation time embedded (details follow their order's id).
+TABLE_PARTITIONS = {
+    "orders.csv": ("date", "date"),
+    "order_details.csv": ("order_id", "id"),
+}
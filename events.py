@@ -0,0 +1,158 @@
+"""
+Live order and table events
+Fans storage writes out to Server-Sent Events clients (GET /api/events)
+"""
+import asyncio
+import json
+import os
+from typing import Dict, Optional
+
+import database as db
+from constants import UserRole
+
+# Events buffered per client; a client that falls this far behind is dropped
+EVENT_QUEUE_SIZE = int(os.environ.get("CAFE_EVENT_QUEUE_SIZE", 100))
+
+# Seconds between keep-alive comments on an idle stream
+EVENT_HEARTBEAT = float(os.environ.get("CAFE_EVENT_HEARTBEAT", 15))
+
+
+class Subscriber:
+    """One connected client: who it is and its bounded event queue"""
+    __slots__ = ("role", "email", "queue")
+
+    def __init__(self, role: str, email: str, max_events: int):
+        self.role = role
+        self.email = email
+        self.queue: asyncio.Queue = asyncio.Queue(max_events)
+
+    def can_see(self, event: Dict) -> bool:
+        """Staff and managers see everything; customers only their own orders"""
+        if self.role in (UserRole.STAFF, UserRole.MANAGER) or event["type"] == "resync":
+            return True
+        return event["type"] == "order" and event["data"].get("customer_email") == self.email
+
+
+class EventHub:
+    """
+    In-process fan-out of events to subscribers
+
+    Publishers never wait: each subscriber has a bounded queue, and one that
+    is full is dropped (its stream ends and the browser reconnects and
+    resyncs) rather than holding up the writer. Subscribers live on the event
+    loop; publish() may be called from any thread, such as the storage
+    writes running on the I/O pool.
+    """
+
+    def __init__(self, max_events: int):
+        self.max_events = max_events
+        self._subscribers = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, role: str, email: str) -> Subscriber:
+        self._loop = asyncio.get_running_loop()
+        subscriber = Subscriber(role, email, self.max_events)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    @property
+    def active(self) -> bool:
+        return bool(self._subscribers)
+
+    def publish(self, event_type: str, data: Dict):
+        """Queue an event for every subscriber allowed to see it"""
+        loop = self._loop
+        if not self._subscribers or loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._deliver, {"type": event_type, "data": data})
+
+    def _deliver(self, event: Dict):
+        self.published += 1
+        for subscriber in list(self._subscribers):
+            if not subscriber.can_see(event):
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self._drop(subscriber)
+
+    def _drop(self, subscriber: Subscriber):
+        """Disconnect a client that stopped keeping up"""
+        self._subscribers.discard(subscriber)
+        self.dropped += 1
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        # None tells the client's stream to end
+        subscriber.queue.put_nowait(None)
+
+    def stats(self) -> Dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "dropped": self.dropped
+        }
+
+
+hub = EventHub(EVENT_QUEUE_SIZE)
+
+
+# Storage write listeners turning row changes into events. An update event
+# lists the columns it changed (e.g. status, payment_status, table_id).
+
+def _on_order_write(filename: str, op: str, before: Optional[Dict], after: Optional[Dict]):
+    if not hub.active:
+        return
+    if op == "write":
+        hub.publish("resync", {"table": "orders"})
+        return
+    order = db._decode_row(filename, after if after is not None else before)
+    changed = []
+    if op == "update":
+        changed = [field for field in after if before.get(field) != after[field]]
+    hub.publish("order", {**order, "op": op, "changed": changed})
+
+
+def _on_table_write(filename: str, op: str, before: Optional[Dict], after: Optional[Dict]):
+    if not hub.active:
+        return
+    if op == "write":
+        hub.publish("resync", {"table": "tables"})
+        return
+    table = db._decode_row(filename, after if after is not None else before)
+    hub.publish("table", {**table, "op": op})
+
+
+db.add_listener("orders.csv", _on_order_write)
+db.add_listener("tables.csv", _on_table_write)
+
+
+def format_event(event: Dict) -> str:
+    """An event in text/event-stream framing"""
+    return f"event: {event['type']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+
+async def stream(request, subscriber: Subscriber):
+    """
+    Body of an SSE response: events for one subscriber until it disconnects
+    or is dropped, with a keep-alive comment while idle
+    """
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), EVENT_HEARTBEAT)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": ping\n\n"
+                continue
+            if event is None:
+                break
+            yield format_event(event)
+    finally:
+        hub.unsubscribe(subscriber)
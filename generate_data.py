@@ -0,0 +1,426 @@
+"""
+Synthetic data generator
+Writes a complete, consistent set of data/*.csv files at a chosen scale so
+the app can be exercised (and benchmarked) with realistic volumes
+
+Usage:
+    python generate_data.py --scale medium --out bench_data
+    python generate_data.py --order-details 250000 --days 90 --out bench_data
+    CAFE_DATA_DIR=bench_data uvicorn main:app
+"""
+import argparse
+import csv
+import itertools
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import attendance
+from database import CSVSchemas
+from constants import (
+    UserRole, TableStatus, OrderStatus, PaymentStatus, PaymentMethod,
+    ReservationStatus, FeedbackStatus, MenuItemStatus, PromotionStatus,
+    StaffStatus, AttendanceStatus, OrderPrefix
+)
+
+# Number of order_details rows for each named scale
+SCALES = {
+    "small": 10_000,
+    "medium": 1_000_000,
+    "large": 10_000_000,
+}
+
+# Demo accounts, kept identical to the shipped data so logins keep working
+DEMO_USERS = [
+    ("Demo Customer", "customer@demo.com", "customer123", "0901234567", UserRole.CUSTOMER),
+    ("Demo Staff", "staff@demo.com", "staff123", "0901234568", UserRole.STAFF),
+    ("Demo Manager", "manager@demo.com", "manager123", "0901234569", UserRole.MANAGER),
+]
+
+MENU = [
+    ("Espresso", "Hot Coffee", 3.50), ("Cappuccino", "Hot Coffee", 4.50),
+    ("Latte", "Hot Coffee", 4.75), ("Americano", "Hot Coffee", 3.75),
+    ("Flat White", "Hot Coffee", 4.50), ("Mocha", "Hot Coffee", 5.00),
+    ("Macchiato", "Hot Coffee", 4.00), ("Cà Phê Sữa Nóng", "Hot Coffee", 3.25),
+    ("Iced Coffee", "Cold Coffee", 4.25), ("Cold Brew", "Cold Coffee", 4.50),
+    ("Iced Latte", "Cold Coffee", 4.95), ("Cà Phê Sữa Đá", "Cold Coffee", 3.50),
+    ("Bạc Xỉu", "Cold Coffee", 3.75), ("Iced Mocha", "Cold Coffee", 5.25),
+    ("Green Tea", "Tea", 3.00), ("Peach Tea", "Tea", 3.75),
+    ("Matcha Latte", "Tea", 4.75), ("Chai Latte", "Tea", 4.50),
+    ("Croissant", "Pastries", 3.25), ("Blueberry Muffin", "Pastries", 3.50),
+    ("Chocolate Cake", "Pastries", 4.25), ("Cheesecake", "Pastries", 4.75),
+    ("Bánh Mì", "Sandwiches", 5.50), ("Club Sandwich", "Sandwiches", 6.75),
+]
+
+INVENTORY = [
+    ("Coffee Beans (Arabica)", "kg", 20, "Premium Beans Co."),
+    ("Coffee Beans (Robusta)", "kg", 15, "Premium Beans Co."),
+    ("Milk", "liters", 30, "Local Dairy Farm"),
+    ("Condensed Milk", "cans", 40, "Local Dairy Farm"),
+    ("Sugar", "kg", 10, "Sweet Supply Inc."),
+    ("Matcha Powder", "kg", 2, "Tea House Ltd."),
+    ("Tea Leaves", "kg", 5, "Tea House Ltd."),
+    ("Peach Syrup", "bottles", 6, "Sweet Supply Inc."),
+    ("Chocolate Sauce", "bottles", 6, "Sweet Supply Inc."),
+    ("Paper Cups (12oz)", "pieces", 200, "Packaging Pro"),
+    ("Plastic Cups (16oz)", "pieces", 200, "Packaging Pro"),
+    ("Straws", "pieces", 300, "Packaging Pro"),
+    ("Croissants", "pieces", 20, "Baker's Delight"),
+    ("Muffins", "pieces", 20, "Baker's Delight"),
+    ("Baguettes", "pieces", 30, "Baker's Delight"),
+]
+
+FIRST_NAMES = ["An", "Bình", "Chi", "Dũng", "Giang", "Hà", "Hải", "Hương", "Khoa", "Lan",
+               "Linh", "Minh", "Nam", "Ngọc", "Phúc", "Quân", "Tâm", "Thảo", "Trang", "Vy",
+               "John", "Jane", "Mike", "Emily", "Sarah", "David", "Anna", "Tom", "Lisa", "Mark"]
+LAST_NAMES = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Huỳnh", "Võ", "Đặng", "Bùi", "Đỗ",
+              "Smith", "Johnson", "Chen", "Rodriguez", "Brown"]
+COMMENTS = ["Excellent coffee and very friendly staff!", "Cà phê ngon, sẽ quay lại",
+            "A bit slow during lunch time", "Great atmosphere to work", "Bánh hơi khô",
+            "Best cold brew in town", "Nhân viên thân thiện", "Prices are fair", ""]
+
+# Relative order volume per hour of day (the cafe is open 7:00-21:59)
+HOUR_WEIGHTS = {7: 6, 8: 10, 9: 8, 10: 5, 11: 6, 12: 9, 13: 8, 14: 5,
+                15: 5, 16: 7, 17: 6, 18: 5, 19: 5, 20: 4, 21: 2}
+# Relative order volume per weekday (Monday = 0)
+WEEKDAY_WEIGHTS = [1.0, 0.95, 1.0, 1.05, 1.15, 1.35, 1.3]
+# Items per order and their weights (mean is about 2.3)
+ITEMS_PER_ORDER = ([1, 2, 3, 4, 5, 6], [34, 30, 18, 10, 5, 3])
+
+
+def _zipf_weights(n: int, s: float = 0.9) -> List[float]:
+    """
+    Cumulative popularity weights where the first entries are picked far
+    more often (cumulative so random.choices does not re-add them every call)
+    """
+    return list(itertools.accumulate(1 / (rank ** s) for rank in range(1, n + 1)))
+
+
+def _person(rng: random.Random) -> str:
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def _phone(n: int) -> str:
+    return f"09{n:08d}"
+
+
+def _money(value: float) -> str:
+    return f"{value:.2f}"
+
+
+def _writer(out_dir: str, filename: str, fieldnames: List[str]):
+    f = open(os.path.join(out_dir, filename), 'w', encoding='utf-8', newline='')
+    writer = csv.writer(f)
+    writer.writerow(fieldnames)
+    return f, writer
+
+
+def _write_table(out_dir: str, filename: str, fieldnames: List[str], rows: List[Dict]) -> int:
+    with open(os.path.join(out_dir, filename), 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    return len(rows)
+
+
+def generate(out_dir: str, order_details: int, days: int = 365, customers: int = None,
+             staff: int = 12, tables: int = 20, end_date: datetime = None, seed: int = 42) -> Dict[str, int]:
+    """
+    Write a full data set into out_dir
+
+    Args:
+        out_dir: Directory to write the CSV files to (created if missing)
+        order_details: Number of order_details rows to generate
+        days: Number of days of order history, ending on end_date
+        customers: Registered customers (default: scales with order volume)
+        staff: Number of staff members
+        tables: Number of tables
+        end_date: Last day of history (default: today)
+        seed: Random seed, so the same arguments give the same files
+
+    Returns:
+        Dict of filename -> number of rows written
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    end_date = (end_date or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    start_date = end_date - timedelta(days=days - 1)
+    if customers is None:
+        customers = max(50, order_details // 40)
+    counts = {}
+
+    # Users: demo accounts, staff accounts and registered customers
+    users = []
+    for name, email, password, phone, role in DEMO_USERS:
+        users.append({"id": str(len(users) + 1), "name": name, "email": email,
+                      "password": password, "phone": phone, "role": role})
+    staff_rows = []
+    for i in range(1, staff + 1):
+        name = _person(rng)
+        email = f"staff{i}@coffee.com"
+        staff_rows.append({
+            "id": str(i), "name": name, "role": rng.choice(["Barista", "Cashier", "Server"]),
+            "email": email, "phone": _phone(10_000_000 + i), "status": StaffStatus.ACTIVE,
+            "schedule": rng.choice(["Mon-Fri, 6AM-2PM", "Tue-Sat, 10AM-6PM", "Wed-Sun, 2PM-10PM"])
+        })
+        users.append({"id": str(len(users) + 1), "name": name, "email": email,
+                      "password": "staff123", "phone": _phone(10_000_000 + i), "role": UserRole.STAFF})
+    customer_users = [users[0]]
+    for i in range(1, customers + 1):
+        user = {"id": str(len(users) + 1), "name": _person(rng), "email": f"customer{i}@example.com",
+                "password": "customer123", "phone": _phone(20_000_000 + i), "role": UserRole.CUSTOMER}
+        users.append(user)
+        customer_users.append(user)
+    counts["users.csv"] = _write_table(out_dir, "users.csv", CSVSchemas.USERS, users)
+    counts["staff.csv"] = _write_table(out_dir, "staff.csv", CSVSchemas.STAFF, staff_rows)
+
+    menu_rows = [{
+        "id": str(i), "name": name, "category": category, "price": _money(price),
+        "image": "", "description": "", "status": MenuItemStatus.AVAILABLE
+    } for i, (name, category, price) in enumerate(MENU, 1)]
+    counts["menu_items.csv"] = _write_table(out_dir, "menu_items.csv", CSVSchemas.MENU_ITEMS, menu_rows)
+
+    table_rows = [{
+        "id": str(i), "number": str(i), "capacity": str(rng.choice([2, 2, 4, 4, 6, 8])),
+        "status": TableStatus.AVAILABLE
+    } for i in range(1, tables + 1)]
+    counts["tables.csv"] = _write_table(out_dir, "tables.csv", CSVSchemas.TABLES, table_rows)
+
+    inventory_rows = [{
+        "id": str(i), "name": name, "quantity": str(rng.randint(min_stock // 2, min_stock * 4)),
+        "unit": unit, "minStock": str(min_stock), "supplier": supplier
+    } for i, (name, unit, min_stock, supplier) in enumerate(INVENTORY, 1)]
+    counts["inventory.csv"] = _write_table(out_dir, "inventory.csv", CSVSchemas.INVENTORY, inventory_rows)
+
+    promotion_rows = []
+    month = start_date.replace(day=1)
+    while month <= end_date:
+        next_month = (month + timedelta(days=32)).replace(day=1)
+        promotion_rows.append({
+            "id": str(len(promotion_rows) + 1), "code": f"SALE{month:%Y%m}", "name": f"Khuyến mãi {month:%m/%Y}",
+            "description": "Giảm giá đồ uống", "discount": str(rng.choice([10, 15, 20])), "type": "percentage",
+            "maxDiscount": "50000", "minOrder": "100000", "startDate": f"{month:%Y-%m-%d}",
+            "endDate": f"{next_month - timedelta(days=1):%Y-%m-%d}",
+            "status": PromotionStatus.ACTIVE if next_month > end_date else PromotionStatus.EXPIRED
+        })
+        month = next_month
+    counts["promotions.csv"] = _write_table(out_dir, "promotions.csv", CSVSchemas.PROMOTIONS, promotion_rows)
+
+    # Orders and their details are streamed, so even the large scale stays in constant memory
+    item_weights = _zipf_weights(len(menu_rows))
+    customer_weights = _zipf_weights(len(customer_users), 0.6)
+    hours = list(HOUR_WEIGHTS)
+    hour_weights = list(HOUR_WEIGHTS.values())
+    rows_per_order = sum(n * w for n, w in zip(*ITEMS_PER_ORDER)) / sum(ITEMS_PER_ORDER[1])
+    day_weights = [WEEKDAY_WEIGHTS[(start_date + timedelta(days=d)).weekday()] for d in range(days)]
+    weight_left = sum(day_weights)
+
+    customer_stats: Dict[str, List[float]] = {}
+    revenue: Dict[str, List[float]] = {}
+    revenue_hourly: Dict[str, List[float]] = {}
+    revenue_by_method: Dict[str, List[float]] = {}
+    item_sales: Dict[str, List[float]] = {}
+    status_counts: Dict[str, int] = {}
+    feedback_rows = []
+    orders_f, orders_w = _writer(out_dir, "orders.csv", CSVSchemas.ORDERS)
+    details_f, details_w = _writer(out_dir, "order_details.csv", CSVSchemas.ORDER_DETAILS)
+    written_orders = written_details = 0
+    seq = 0
+    try:
+        for d in range(days):
+            day = start_date + timedelta(days=d)
+            is_today = d == days - 1
+            # Each day gets its share of what is left, so the history always reaches end_date
+            orders_left = (order_details - written_details) / rows_per_order
+            if is_today:
+                # The last day takes whatever is left (with headroom for randomness)
+                n_orders = math.ceil(orders_left * 1.5)
+            else:
+                n_orders = round(orders_left * day_weights[d] / weight_left * rng.uniform(0.85, 1.15))
+            weight_left -= day_weights[d]
+            stamps = sorted(
+                day.replace(hour=h, minute=rng.randrange(60), second=rng.randrange(60))
+                for h in rng.choices(hours, hour_weights, k=n_orders)
+            )
+
+            i = 0
+            while written_details < order_details and (i < n_orders or is_today):
+                # Should the last day still fall short, the extra orders come at closing time
+                created = stamps[i] if i < n_orders else day.replace(hour=21, minute=59, second=59)
+                i += 1
+                seq += 1
+                order_id = f"{OrderPrefix.ORDER}{created:%Y%m%d%H%M%S}-{seq}"
+
+                n_items = min(rng.choices(*ITEMS_PER_ORDER)[0], order_details - written_details)
+                total = 0.0
+                for item in rng.choices(menu_rows, cum_weights=item_weights, k=n_items):
+                    quantity = 1 if rng.random() < 0.85 else 2
+                    price = float(item["price"])
+                    subtotal = price * quantity
+                    total += subtotal
+                    details_w.writerow([order_id, item["id"], quantity, item["price"], _money(subtotal)])
+                    sales = item_sales.setdefault(f"{created:%Y-%m-%d} {item['id']}", [0, 0.0])
+                    sales[0] += quantity
+                    sales[1] += subtotal
+                written_details += n_items
+
+                customer = rng.choices(customer_users, cum_weights=customer_weights)[0] if rng.random() < 0.55 else None
+                if is_today and rng.random() < 0.3:
+                    status, payment_status, method = rng.choice(
+                        [OrderStatus.PENDING, OrderStatus.IN_PREPARATION, OrderStatus.WAITING_PAYMENT]
+                    ), PaymentStatus.PENDING, ""
+                else:
+                    status, payment_status = OrderStatus.COMPLETED, PaymentStatus.PAID
+                    method = rng.choices([PaymentMethod.CASH, PaymentMethod.CARD, PaymentMethod.E_WALLET],
+                                         [50, 30, 20])[0]
+                table_id = str(rng.randint(1, tables)) if rng.random() < 0.6 else ""
+                orders_w.writerow([
+                    order_id, customer["email"] if customer else "", customer["name"] if customer else "",
+                    f"{created:%Y-%m-%d}", _money(total), status, method, payment_status,
+                    table_id, f"{created:%Y-%m-%d %H:%M:%S}"
+                ])
+                written_orders += 1
+                status_key = f"{status} {payment_status}"
+                status_counts[status_key] = status_counts.get(status_key, 0) + 1
+
+                if payment_status == PaymentStatus.PAID:
+                    # Same keys as rollups.py
+                    for rollup, key in ((revenue, f"{created:%Y-%m-%d}"),
+                                        (revenue_hourly, f"{created:%Y-%m-%d %H}"),
+                                        (revenue_by_method, f"{created:%Y-%m-%d} {method}")):
+                        day_revenue = rollup.setdefault(key, [0.0, 0])
+                        day_revenue[0] += total
+                        day_revenue[1] += 1
+                    # Customer totals count paid orders only, like rollups.py
+                    if customer:
+                        stats = customer_stats.setdefault(customer["email"], [0, 0.0])
+                        stats[0] += 1
+                        stats[1] += total
+                if customer and rng.random() < 0.04:
+                    responded = rng.random() < 0.5
+                    feedback_rows.append({
+                        "id": str(len(feedback_rows) + 1), "customer_email": customer["email"],
+                        "customer_name": customer["name"], "date": f"{created:%Y-%m-%d}",
+                        "foodRating": str(rng.choices([1, 2, 3, 4, 5], [2, 3, 10, 35, 50])[0]),
+                        "serviceRating": str(rng.choices([1, 2, 3, 4, 5], [2, 3, 10, 35, 50])[0]),
+                        "comment": rng.choice(COMMENTS),
+                        "status": FeedbackStatus.RESPONDED if responded else FeedbackStatus.PENDING,
+                        "response": "Cảm ơn bạn đã góp ý!" if responded else ""
+                    })
+    finally:
+        orders_f.close()
+        details_f.close()
+    counts["orders.csv"] = written_orders
+    counts["order_details.csv"] = written_details
+    counts["feedback.csv"] = _write_table(out_dir, "feedback.csv", CSVSchemas.FEEDBACK, feedback_rows)
+
+    counts["revenue.csv"] = _write_table(out_dir, "revenue.csv", CSVSchemas.REVENUE, [
+        {"date": date, "revenue": _money(value), "orders": str(n)}
+        for date, (value, n) in sorted(revenue.items())
+    ])
+    counts["revenue_hourly.csv"] = _write_table(out_dir, "revenue_hourly.csv", CSVSchemas.REVENUE_HOURLY, [
+        {"id": key, "date": key[:10], "hour": key[11:], "revenue": _money(value), "orders": str(n)}
+        for key, (value, n) in sorted(revenue_hourly.items())
+    ])
+    counts["revenue_by_method.csv"] = _write_table(out_dir, "revenue_by_method.csv", CSVSchemas.REVENUE_BY_METHOD, [
+        {"id": key, "date": key[:10], "payment_method": key[11:], "revenue": _money(value), "orders": str(n)}
+        for key, (value, n) in sorted(revenue_by_method.items())
+    ])
+    counts["item_sales.csv"] = _write_table(out_dir, "item_sales.csv", CSVSchemas.ITEM_SALES, [
+        {"id": key, "date": key[:10], "menu_item_id": key[11:], "quantity": str(n), "revenue": _money(value)}
+        for key, (n, value) in sorted(item_sales.items())
+    ])
+    counts["order_status_counts.csv"] = _write_table(
+        out_dir, "order_status_counts.csv", CSVSchemas.ORDER_STATUS_COUNTS, [
+            {"id": key, "status": key.split(" ")[0], "payment_status": key.split(" ")[1], "orders": str(n)}
+            for key, n in sorted(status_counts.items())
+        ])
+
+    customer_rows = []
+    for user in customer_users:
+        stats = customer_stats.get(user["email"])
+        if not stats:
+            continue
+        customer_rows.append({
+            "id": str(len(customer_rows) + 1), "name": user["name"], "email": user["email"],
+            "phone": user["phone"], "totalOrders": str(stats[0]), "totalSpent": _money(stats[1]),
+            "status": "active"
+        })
+    counts["customers.csv"] = _write_table(out_dir, "customers.csv", CSVSchemas.CUSTOMERS, customer_rows)
+
+    # Attendance: each staff member works about five days a week
+    attendance_rows = []
+    for d in range(days):
+        day = start_date + timedelta(days=d)
+        for member in staff_rows:
+            if rng.random() > 5 / 7:
+                continue
+            clock_in = day.replace(hour=rng.randint(6, 14), minute=rng.randrange(60), second=rng.randrange(60))
+            hours_worked = round(rng.uniform(6, 9), 2)
+            clock_out = clock_in + timedelta(hours=hours_worked)
+            attendance_rows.append({
+                "id": str(len(attendance_rows) + 1), "staff_email": member["email"],
+                "date": f"{day:%Y-%m-%d}", "clockIn": f"{clock_in:%H:%M:%S}", "clockOut": f"{clock_out:%H:%M:%S}",
+                "hours": str(hours_worked),
+                "status": AttendanceStatus.LATE if clock_in.minute > 45 else AttendanceStatus.PRESENT
+            })
+    counts["attendance.csv"] = _write_table(out_dir, "attendance.csv", CSVSchemas.ATTENDANCE, attendance_rows)
+    counts["attendance_totals.csv"] = _write_table(out_dir, "attendance_totals.csv", CSVSchemas.ATTENDANCE_TOTALS,
+                                                   attendance.total_rows(attendance_rows))
+
+    reservation_rows = []
+    for d in range(days + 7):
+        day = start_date + timedelta(days=d)
+        for _ in range(rng.randint(0, 3)):
+            booked = day.replace(hour=rng.randint(8, 20), minute=rng.choice([0, 30]))
+            upcoming = booked > end_date
+            reservation_rows.append({
+                "id": f"{OrderPrefix.RESERVATION}{booked:%Y%m%d%H%M}-{len(reservation_rows) + 1}",
+                "customer_email": rng.choices(customer_users, cum_weights=customer_weights)[0]["email"],
+                "date": f"{booked:%Y-%m-%d}", "time": f"{booked:%H:%M}", "guests": str(rng.randint(1, 6)),
+                "notes": "", "table_id": str(rng.randint(1, tables)),
+                "status": rng.choice([ReservationStatus.PENDING, ReservationStatus.CONFIRMED]) if upcoming
+                else rng.choice([ReservationStatus.COMPLETED, ReservationStatus.CANCELLED]),
+                "created_at": f"{booked - timedelta(days=rng.randint(1, 7)):%Y-%m-%d %H:%M:%S}"
+            })
+    counts["reservations.csv"] = _write_table(out_dir, "reservations.csv", CSVSchemas.RESERVATIONS, reservation_rows)
+
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic cafe data set")
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument("--scale", choices=SCALES, default="small",
+                      help="named size: small=10k, medium=1M, large=10M order_details rows")
+    size.add_argument("--order-details", type=int, help="exact number of order_details rows")
+    parser.add_argument("--out", default="bench_data", help="output directory (default: bench_data)")
+    parser.add_argument("--days", type=int, default=365, help="days of order history (default: 365)")
+    parser.add_argument("--customers", type=int, help="registered customers (default: order_details / 40)")
+    parser.add_argument("--staff", type=int, default=12)
+    parser.add_argument("--tables", type=int, default=20)
+    parser.add_argument("--end-date", help="last day of history, YYYY-MM-DD (default: today)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--force", action="store_true", help="allow overwriting the live data/ directory")
+    args = parser.parse_args(argv)
+
+    if os.path.abspath(args.out) == os.path.abspath("data") and not args.force:
+        print("Refusing to overwrite data/ (pass --force to do it anyway)")
+        sys.exit(1)
+
+    rows = args.order_details or SCALES[args.scale]
+    end_date = datetime.strptime(args.end_date, "%Y-%m-%d") if args.end_date else None
+    started = time.perf_counter()
+    counts = generate(args.out, rows, days=args.days, customers=args.customers, staff=args.staff,
+                      tables=args.tables, end_date=end_date, seed=args.seed)
+    for filename, count in sorted(counts.items()):
+        print(f"{filename}: {count} rows")
+    print(f"Wrote {args.out}/ in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
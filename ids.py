@@ -0,0 +1,91 @@
+"""
+Unique, time-ordered record IDs
+Replaces the one-per-second f"ORD-{datetime.now():%Y%m%d%H%M%S}" pattern
+"""
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+# Fixed widths keep IDs of one prefix sortable as plain strings
+WORKER_WIDTH = 5
+SEQ_WIDTH = 3
+_SEQ_LIMIT = 36 ** SEQ_WIDTH
+
+
+def _base36(value: int, width: int) -> str:
+    digits = ""
+    while value:
+        value, digit = divmod(value, 36)
+        digits = _DIGITS[digit] + digits
+    return digits.rjust(width, "0")[-width:]
+
+
+def _default_worker() -> str:
+    """Worker component of this process: its pid, distinct for every uvicorn worker"""
+    return _base36(os.getpid(), WORKER_WIDTH)
+
+
+class IdGenerator:
+    """
+    IDs shaped <prefix><YYYYmmddHHMMSSmmm>-<worker><seq>
+
+    The millisecond timestamp comes first so IDs sort by creation time; the
+    worker part separates processes and the base-36 sequence separates IDs
+    made in the same millisecond (46656 of them). The timestamp is local
+    time, like the older one-per-second IDs, so new IDs sort after them. If
+    the sequence runs out, or the local clock steps back (including when
+    daylight saving ends), the generator keeps counting on from the last
+    millisecond it used rather than repeat an ID.
+    """
+
+    def __init__(self, worker: str = None):
+        self.worker = worker or _default_worker()
+        self._last_ms = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def next_id(self, prefix: str) -> str:
+        with self._lock:
+            now_ms = time.time_ns() // 1_000_000
+            # Milliseconds of the local wall clock, so they step back with it
+            now_ms += time.localtime(now_ms // 1000).tm_gmtoff * 1000
+            if now_ms > self._last_ms:
+                self._last_ms, self._seq = now_ms, 0
+            else:
+                self._seq += 1
+                if self._seq == _SEQ_LIMIT:
+                    self._last_ms, self._seq = self._last_ms + 1, 0
+            ms, seq = self._last_ms, self._seq
+        # ms already holds the local offset: format it without applying another
+        stamp = datetime.fromtimestamp(ms // 1000, timezone.utc).strftime("%Y%m%d%H%M%S") + f"{ms % 1000:03d}"
+        return f"{prefix}{stamp}-{self.worker}{_base36(seq, SEQ_WIDTH)}"
+
+
+_generator = IdGenerator()
+
+
+def _reset_after_fork():
+    # A forked worker must not share its parent's worker component
+    global _generator
+    _generator = IdGenerator()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def new_id(prefix: str) -> str:
+    """
+    New unique ID for a prefix
+
+    Args:
+        prefix: Start of the ID, normally a constants.OrderPrefix value (e.g.
+            OrderPrefix.ORDER)
+
+    Returns:
+        ID such as "ORD-20251122013055123-000k2000"
+    """
+    return _generator.next_id(prefix)
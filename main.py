@@ -1,26 +1,42 @@
 from fastapi import FastAPI, Request, Form, HTTPException, Depends
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from starlette.middleware.sessions import SessionMiddleware
 from datetime import datetime, timedelta
 from typing import Optional
+import json
 import secrets
 import database as db
 from database import CSVSchemas
+import analytics
+import attendance
 import auth
+import archive
+import dashboard
+import events
+import ids
+import rollups
+import segments
 from constants import (
-    UserRole, TableStatus, OrderStatus, PaymentStatus, 
-    MenuItemStatus, PromotionStatus, OrderPrefix, SessionKey
+    UserRole, TableStatus, OrderStatus, PaymentStatus, PaymentMethod,
+    MenuItemStatus, PromotionStatus, OrderPrefix, SessionKey, Pagination,
+    CustomerSegment, AttendanceStatus
 )
 from validators import (
     validate_positive_float, validate_required, validate_email,
     validate_date_format, validate_future_datetime, validate_date_range,
-    validate_enum, handle_validation_error, ValidationError
+    validate_enum, validate_sort, validate_page_limit,
+    handle_validation_error, ValidationError
 )
 
 app = FastAPI()
 
+# Bring tables written under an older schema up to date, then finish
+# multi-table writes that a crashed worker left half applied
+db.migrate_tables()
+db.recover_transactions()
+
 # Add session middleware
 app.add_middleware(
     SessionMiddleware,
@@ -31,46 +47,69 @@ app.add_middleware(
 
 
 # Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", StaticFiles(directory="static", check_dir=False), name="static")
 
 # Templates
 templates = Jinja2Templates(directory="templates")
 
 # Use get_current_user from auth module
 get_current_user = auth.get_current_user
+aget_current_user = auth.aget_current_user
+
+# Shared by the list endpoints: filters, sorting and paging run in the storage
+# layer, so a narrow request never materializes the whole table
+async def list_page(filename: str, filters: dict, sort: Optional[str] = None,
+                    limit: Optional[int] = None, cursor: Optional[str] = None,
+                    date_from: Optional[str] = None, date_to: Optional[str] = None) -> tuple:
+    filters = {field: value for field, value in filters.items() if value}
+    sort_field, descending = validate_sort(sort, db.TABLE_SCHEMAS[filename])
+    ranges = None
+    if date_from or date_to:
+        if date_from:
+            validate_date_format(date_from, field_name="Từ ngày")
+        if date_to:
+            validate_date_format(date_to, field_name="Đến ngày")
+        ranges = {"date": (date_from or None, date_to or None)}
+    if cursor and limit is None:
+        limit = Pagination.DEFAULT_LIMIT
+    limit = validate_page_limit(limit, Pagination.MAX_LIMIT)
+    try:
+        return await db.aquery(filename, filters, ranges, sort_field, descending, limit, cursor, typed=True)
+    except ValueError:
+        raise ValidationError("Cursor không hợp lệ")
 
 # Routes
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
-    user = auth.get_current_user(request)
+    user = await auth.aget_current_user(request)
     if user:
         return RedirectResponse(url=f"/{user['role']}")
     return RedirectResponse(url="/login")
 
 @app.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
-    user = auth.get_current_user(request)
+    user = await auth.aget_current_user(request)
     if user:
         return RedirectResponse(url=f"/{user['role']}")
     return templates.TemplateResponse("login.html", {"request": request})
 
 @app.get("/register", response_class=HTMLResponse)
 async def register_page(request: Request):
-    user = auth.get_current_user(request)
+    user = await auth.aget_current_user(request)
     if user:
         return RedirectResponse(url=f"/{user['role']}")
     return templates.TemplateResponse("register.html", {"request": request})
 
 @app.get("/forgot-password", response_class=HTMLResponse)
 async def forgot_password_page(request: Request):
-    user = auth.get_current_user(request)
+    user = await auth.aget_current_user(request)
     if user:
         return RedirectResponse(url=f"/{user['role']}")
     return templates.TemplateResponse("forgot_password.html", {"request": request})
 
 @app.get("/reset-password", response_class=HTMLResponse)
 async def reset_password_page(request: Request, token: str = ""):
-    user = auth.get_current_user(request)
+    user = await auth.aget_current_user(request)
     if user:
         return RedirectResponse(url=f"/{user['role']}")
     return templates.TemplateResponse("reset_password.html", {"request": request, "token": token})
@@ -88,7 +127,7 @@ async def login(
     print("EMAIL RECEIVED:", email)
     print("PASSWORD RECEIVED:", password)
 
-    user = db.find_one("users.csv", "email", email)
+    user = await db.afind_one("users.csv", "email", email)
     
     if not user:
         return JSONResponse({"success": False, "message": "Email không tồn tại trong hệ thống"}, status_code=401)
@@ -109,32 +148,42 @@ async def logout(request: Request):
 
 @app.get("/customer", response_class=HTMLResponse)
 async def customer_dashboard(request: Request):
-    user = auth.get_current_user(request)
+    user = await auth.aget_current_user(request)
     if not user or user["role"] != UserRole.CUSTOMER:
         return RedirectResponse(url="/login")
     return templates.TemplateResponse("customer.html", {"request": request, "user": user})
 
 @app.get("/staff", response_class=HTMLResponse)
 async def staff_dashboard(request: Request):
-    user = auth.get_current_user(request)
+    user = await auth.aget_current_user(request)
     if not user or user["role"] != UserRole.STAFF:
         return RedirectResponse(url="/login")
     return templates.TemplateResponse("staff.html", {"request": request, "user": user})
 
 @app.get("/manager", response_class=HTMLResponse)
 async def manager_dashboard(request: Request):
-    user = auth.get_current_user(request)
+    user = await auth.aget_current_user(request)
     if not user or user["role"] != UserRole.MANAGER:
         return RedirectResponse(url="/login")
     return templates.TemplateResponse("manager.html", {"request": request, "user": user})
 
 # API Endpoints for data operations
 @app.get("/api/menu-items")
-async def get_menu_items():
-    items = db.read_csv("menu_items.csv")
-    # Convert price to float for JSON response
-    for item in items:
-        item["price"] = float(item["price"])
+async def get_menu_items(
+    category: Optional[str] = None,
+    status: Optional[str] = None,
+    sort: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+):
+    try:
+        items, next_cursor = await list_page(
+            "menu_items.csv", {"category": category, "status": status}, sort, limit, cursor
+        )
+    except ValidationError as e:
+        return handle_validation_error(e)
+    if limit is not None or cursor:
+        return {"items": items, "nextCursor": next_cursor}
     return {"items": items}
 
 # UC-13: Quản lý menu - Thêm món mới
@@ -153,8 +202,7 @@ async def create_menu_item(request: Request, user: dict = Depends(auth.require_m
         return handle_validation_error(e)
     
     # Get next ID
-    menu_items = db.read_csv("menu_items.csv")
-    item_id = str(len(menu_items) + 1)
+    item_id = await db.anext_sequence("menu_items.csv")
     
     new_item = {
         "id": item_id,
@@ -166,7 +214,7 @@ async def create_menu_item(request: Request, user: dict = Depends(auth.require_m
         "status": status
     }
     
-    db.append_csv("menu_items.csv", new_item, CSVSchemas.MENU_ITEMS)
+    await db.aappend_csv("menu_items.csv", new_item, CSVSchemas.MENU_ITEMS)
     
     return JSONResponse({
         "success": True,
@@ -180,7 +228,7 @@ async def update_menu_item(request: Request, item_id: str, user: dict = Depends(
     body = await request.json()
     
     # Check if item exists
-    existing_item = db.find_one("menu_items.csv", "id", item_id)
+    existing_item = await db.afind_one("menu_items.csv", "id", item_id)
     if not existing_item:
         return JSONResponse({
             "success": False,
@@ -218,7 +266,7 @@ async def update_menu_item(request: Request, item_id: str, user: dict = Depends(
         }, status_code=400)
     
     # Update item
-    db.update_csv("menu_items.csv", "id", item_id, updates, CSVSchemas.MENU_ITEMS)
+    await db.aupdate_csv("menu_items.csv", "id", item_id, updates, CSVSchemas.MENU_ITEMS)
     
     return JSONResponse({
         "success": True,
@@ -229,41 +277,90 @@ async def update_menu_item(request: Request, item_id: str, user: dict = Depends(
 @app.delete("/api/menu-items/{item_id}")
 async def delete_menu_item(request: Request, item_id: str, user: dict = Depends(auth.require_manager_role)):
     # Check if item exists
-    existing_item = db.find_one("menu_items.csv", "id", item_id)
+    existing_item = await db.afind_one("menu_items.csv", "id", item_id)
     if not existing_item:
         return JSONResponse({
             "success": False,
             "message": "Món không tồn tại"
         }, status_code=404)
     
-    # Check if item has order history
-    order_details = db.read_csv("order_details.csv")
-    has_history = any(od.get("menu_item_id") == item_id for od in order_details)
+    # Check if item has order history, live or archived (archived details
+    # are only kept compressed, with their item sales rolled up)
+    history, _ = await db.aquery("order_details.csv", filters={"menu_item_id": item_id}, limit=1)
+    if not history:
+        history, _ = await db.aquery("archived_item_sales.csv", filters={"menu_item_id": item_id}, limit=1)
+    has_history = bool(history)
     
     if has_history:
         # Hide item instead of deleting
-        db.update_csv("menu_items.csv", "id", item_id, {"status": MenuItemStatus.UNAVAILABLE}, CSVSchemas.MENU_ITEMS)
+        await db.aupdate_csv("menu_items.csv", "id", item_id, {"status": MenuItemStatus.UNAVAILABLE}, CSVSchemas.MENU_ITEMS)
         return JSONResponse({
             "success": True,
             "message": "Món đã được ẩn (ngưng bán) vì đã có lịch sử bán hàng."
         })
     else:
         # Delete item
-        db.delete_csv("menu_items.csv", "id", item_id, CSVSchemas.MENU_ITEMS)
+        await db.adelete_csv("menu_items.csv", "id", item_id, CSVSchemas.MENU_ITEMS)
         return JSONResponse({
             "success": True,
             "message": "Xóa món thành công."
         })
 
 @app.get("/api/orders")
-async def get_orders(request: Request):
-    user = get_current_user(request)
+async def get_orders(
+    request: Request,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    customer_email: Optional[str] = None,
+    sort: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    since: Optional[int] = None
+):
+    user = await aget_current_user(request)
     if not user:
         raise HTTPException(status_code=401)
     
-    orders = db.read_csv("orders.csv")
-    order_details = db.read_csv("order_details.csv")
-    menu_items = db.read_csv("menu_items.csv")
+    # Customers only ever see their own orders (looked up through the customer_email index)
+    if user["role"] == UserRole.CUSTOMER:
+        customer_email = user["email"]
+    
+    # Delta sync: with since=<seq> only orders changed after seq are returned,
+    # unless seq is too old to answer (then everything, with "full": true)
+    changed_ids, removed = None, []
+    if since is not None:
+        changed_ids, seq = db.changes_since("orders.csv", since)
+    
+    if changed_ids is not None:
+        found = await db.agroup_by("orders.csv", "id", changed_ids, typed=True)
+        orders = []
+        for order_id in changed_ids:
+            if not found[order_id]:
+                removed.append(order_id)
+            orders.extend(o for o in found[order_id]
+                          if not customer_email or o["customer_email"] == customer_email)
+        if user["role"] == UserRole.CUSTOMER:
+            # Ids of other customers' orders are never sent to a customer
+            removed = []
+    else:
+        filters = {
+            "status": status.split(",") if status else None,
+            "customer_email": customer_email
+        }
+        try:
+            orders, next_cursor = await list_page(
+                "orders.csv", filters, sort, limit, cursor, date_from, date_to
+            )
+        except ValidationError as e:
+            return handle_validation_error(e)
+    
+    if changed_ids is not None or customer_email or status or date_from or date_to or limit is not None or cursor:
+        # Join only the orders being returned
+        details_by_order = await db.agroup_by("order_details.csv", "order_id", [o["id"] for o in orders], typed=True)
+    else:
+        details_by_order = await db.agroup_by("order_details.csv", "order_id", typed=True)
+    menu_items = await db.aread_csv("menu_items.csv")
     
     # Create menu items lookup
     menu_lookup = {item["id"]: item["name"] for item in menu_items}
@@ -272,11 +369,11 @@ async def get_orders(request: Request):
     result_orders = []
     for order in orders:
         # Get order details
-        details = [od for od in order_details if od["order_id"] == order["id"]]
+        details = details_by_order.get(order["id"], [])
         items = []
         for detail in details:
             item_name = menu_lookup.get(detail["menu_item_id"], "Unknown")
-            quantity = int(detail["quantity"])
+            quantity = detail["quantity"] or 0
             if quantity > 1:
                 items.append(f"{item_name} x{quantity}")
             else:
@@ -286,14 +383,13 @@ async def get_orders(request: Request):
             "id": order["id"],
             "date": order["date"],
             "items": items,
-            "total": float(order["total"]),
+            "total": order["total"],
             "status": order["status"]
         }
         
         if user["role"] == UserRole.CUSTOMER:
-            # Only show customer's orders
-            if order.get("customer_email") == user["email"]:
-                result_orders.append(order_data)
+            # Already limited to this customer's orders above
+            result_orders.append(order_data)
         else:
             # Staff/Manager see all orders with customer info
             order_data["customer"] = order.get("customer_name") or order.get("customer_email", "Khách vãng lai")
@@ -306,21 +402,68 @@ async def get_orders(request: Request):
                     order_data["time"] = ""
             result_orders.append(order_data)
     
+    if since is not None:
+        if changed_ids is not None:
+            return {"orders": result_orders, "removed": removed, "seq": seq, "full": False}
+        return {"orders": result_orders, "seq": seq, "full": True}
+    if limit is not None or cursor:
+        return {"orders": result_orders, "nextCursor": next_cursor}
     return {"orders": result_orders}
 
+# Lịch sử đơn hàng đã lưu trữ (đọc từ các file nén theo tháng)
+@app.get("/api/orders/history")
+async def get_order_history(
+    request: Request,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    customer_email: Optional[str] = None
+):
+    user = await aget_current_user(request)
+    if not user:
+        raise HTTPException(status_code=401)
+    if user["role"] == UserRole.CUSTOMER:
+        customer_email = user["email"]
+    try:
+        if date_from:
+            validate_date_format(date_from, field_name="Từ ngày")
+        if date_to:
+            validate_date_format(date_to, field_name="Đến ngày")
+    except ValidationError as e:
+        return handle_validation_error(e)
+    
+    orders = await archive.aread_orders(date_from, date_to, customer_email)
+    menu_items = await db.aread_csv("menu_items.csv")
+    menu_lookup = {item["id"]: item["name"] for item in menu_items}
+    
+    result_orders = []
+    for order in orders:
+        items = []
+        for detail in order["details"]:
+            item_name = menu_lookup.get(detail["menu_item_id"], "Unknown")
+            quantity = detail["quantity"] or 0
+            items.append(f"{item_name} x{quantity}" if quantity > 1 else item_name)
+        order_data = {
+            "id": order["id"],
+            "date": order["date"],
+            "items": items,
+            "total": order["total"],
+            "status": order["status"],
+            "paymentMethod": order["payment_method"]
+        }
+        if user["role"] != UserRole.CUSTOMER:
+            order_data["customer"] = order.get("customer_name") or order.get("customer_email", "Khách vãng lai")
+        result_orders.append(order_data)
+    return {"orders": result_orders, "archived": True}
+
 @app.get("/api/tables")
 async def get_tables():
-    tables = db.read_csv("tables.csv")
-    # Convert number and capacity to int
-    for table in tables:
-        table["number"] = int(table["number"])
-        table["capacity"] = int(table["capacity"])
+    tables = await db.aread_csv("tables.csv", typed=True)
     return {"tables": tables}
 
 # UC-10: Cập nhật trạng thái bàn
 @app.put("/api/tables/{table_id}/status")
 async def update_table_status(request: Request, table_id: str):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] not in ["staff", "manager"]:
         raise HTTPException(status_code=403)
     
@@ -333,14 +476,14 @@ async def update_table_status(request: Request, table_id: str):
             "message": "Trạng thái không hợp lệ"
         }, status_code=400)
     
-    table = db.find_one("tables.csv", "id", table_id)
+    table = await db.afind_one("tables.csv", "id", table_id)
     if not table:
         return JSONResponse({
             "success": False,
             "message": "Bàn không tồn tại"
         }, status_code=404)
     
-    db.update_csv("tables.csv", "id", table_id, {"status": new_status}, CSVSchemas.TABLES)
+    await db.aupdate_csv("tables.csv", "id", table_id, {"status": new_status}, CSVSchemas.TABLES)
     
     return JSONResponse({
         "success": True,
@@ -352,14 +495,14 @@ async def update_table_status(request: Request, table_id: str):
 # UC-10: Gán bàn cho đơn hàng
 @app.post("/api/tables/{table_id}/assign")
 async def assign_table_to_order(request: Request, table_id: str):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] not in ["staff", "manager"]:
         raise HTTPException(status_code=403)
     
     body = await request.json()
     order_id = body.get("orderId")
     
-    table = db.find_one("tables.csv", "id", table_id)
+    table = await db.afind_one("tables.csv", "id", table_id, typed=True)
     if not table:
         return JSONResponse({
             "success": False,
@@ -374,30 +517,30 @@ async def assign_table_to_order(request: Request, table_id: str):
     
     # Update table status
     fieldnames = ["id", "number", "capacity", "status"]
-    db.update_csv("tables.csv", "id", table_id, {"status": TableStatus.OCCUPIED}, fieldnames)
+    await db.aupdate_csv("tables.csv", "id", table_id, {"status": TableStatus.OCCUPIED}, fieldnames)
     
     # Update order with table_id if order_id provided
     if order_id:
-        order = db.find_one("orders.csv", "id", order_id)
+        order = await db.afind_one("orders.csv", "id", order_id)
         if order:
             order_fieldnames = ["id", "customer_email", "customer_name", "date", "total", "status", "payment_method", "payment_status", "table_id", "created_at"]
-            db.update_csv("orders.csv", "id", order_id, {"table_id": table_id}, order_fieldnames)
+            await db.aupdate_csv("orders.csv", "id", order_id, {"table_id": table_id}, order_fieldnames)
     
     return JSONResponse({
         "success": True,
         "message": f"Đã gán bàn {table['number']} cho đơn hàng",
         "tableId": table_id,
-        "tableNumber": int(table["number"])
+        "tableNumber": table["number"]
     })
 
 # UC-10: Dọn bàn (Clear table)
 @app.post("/api/tables/{table_id}/clear")
 async def clear_table(request: Request, table_id: str):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] not in ["staff", "manager"]:
         raise HTTPException(status_code=403)
     
-    table = db.find_one("tables.csv", "id", table_id)
+    table = await db.afind_one("tables.csv", "id", table_id)
     if not table:
         return JSONResponse({
             "success": False,
@@ -405,7 +548,7 @@ async def clear_table(request: Request, table_id: str):
         }, status_code=404)
     
     fieldnames = ["id", "number", "capacity", "status"]
-    db.update_csv("tables.csv", "id", table_id, {"status": TableStatus.AVAILABLE}, fieldnames)
+    await db.aupdate_csv("tables.csv", "id", table_id, {"status": TableStatus.AVAILABLE}, fieldnames)
     
     return JSONResponse({
         "success": True,
@@ -416,7 +559,7 @@ async def clear_table(request: Request, table_id: str):
 # UC-04: Đặt bàn trước
 @app.post("/api/create-reservation")
 async def create_reservation(request: Request):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user:
         raise HTTPException(status_code=401)
     
@@ -447,14 +590,15 @@ async def create_reservation(request: Request):
         }, status_code=400)
     
     # Check available tables
-    tables = db.read_csv("tables.csv")
-    reservations = db.read_csv("reservations.csv")
+    tables = await db.aread_csv("tables.csv", typed=True)
+    reservations = await db.aread_csv("reservations.csv")
     
     # Find available tables that can accommodate the number of guests
     available_tables = []
+    guests_count = int(guests)
     for table in tables:
-        capacity = int(table["capacity"])
-        if capacity >= int(guests) and table["status"] == "available":
+        capacity = table["capacity"] or 0
+        if capacity >= guests_count and table["status"] == "available":
             # Check if table is already reserved at this time
             is_reserved = any(
                 r.get("date") == date and 
@@ -473,7 +617,7 @@ async def create_reservation(request: Request):
         }, status_code=400)
     
     # Create reservation
-    reservation_id = f"{OrderPrefix.RESERVATION}{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    reservation_id = ids.new_id(OrderPrefix.RESERVATION)
     # Assign first available table
     assigned_table = available_tables[0]
     
@@ -489,13 +633,13 @@ async def create_reservation(request: Request):
         "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     }
     
-    # Save reservation
+    # Save reservation and mark the table reserved in one transaction
     fieldnames = ["id", "customer_email", "date", "time", "guests", "notes", "status", "table_id", "created_at"]
-    db.append_csv("reservations.csv", new_reservation, fieldnames)
-    
-    # Update table status to reserved
     table_fieldnames = ["id", "number", "capacity", "status"]
-    db.update_csv("tables.csv", "id", assigned_table["id"], {"status": TableStatus.RESERVED}, table_fieldnames)
+    tx = db.Transaction()
+    tx.append_csv("reservations.csv", new_reservation, fieldnames)
+    tx.update_csv("tables.csv", "id", assigned_table["id"], {"status": TableStatus.RESERVED}, table_fieldnames)
+    await db.acommit(tx)
     
     return JSONResponse({
         "success": True,
@@ -505,69 +649,67 @@ async def create_reservation(request: Request):
     })
 
 @app.get("/api/reservations")
-async def get_reservations(request: Request):
-    user = get_current_user(request)
+async def get_reservations(
+    request: Request,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    customer_email: Optional[str] = None,
+    sort: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+):
+    user = await aget_current_user(request)
     if not user:
         raise HTTPException(status_code=401)
     
-    reservations = db.read_csv("reservations.csv")
-    tables = db.read_csv("tables.csv")
+    # Customers only see their own reservations; staff and manager see all
+    if user["role"] == UserRole.CUSTOMER:
+        customer_email = user["email"]
+    filters = {
+        "status": status.split(",") if status else None,
+        "customer_email": customer_email
+    }
+    try:
+        reservations, next_cursor = await list_page(
+            "reservations.csv", filters, sort, limit, cursor, date_from, date_to
+        )
+    except ValidationError as e:
+        return handle_validation_error(e)
+    tables = await db.aread_csv("tables.csv", typed=True)
     
     # Create table lookup
     table_lookup = {t["id"]: t for t in tables}
     
     result = []
     for res in reservations:
-        # Filter by user role
-        if user["role"] == UserRole.CUSTOMER:
-            if res.get("customer_email") != user["email"]:
-                continue
-        # Staff and manager see all reservations
-        
         table_info = table_lookup.get(res.get("table_id", ""), {})
         result.append({
             "id": res["id"],
             "customer_email": res.get("customer_email", ""),
             "date": res.get("date", ""),
             "time": res.get("time", ""),
-            "guests": int(res.get("guests", 0)),
+            "guests": res.get("guests") or 0,
             "notes": res.get("notes", ""),
             "status": res.get("status", "pending"),
-            "tableNumber": int(table_info.get("number", 0)) if table_info else None,
+            "tableNumber": (table_info.get("number") or 0) if table_info else None,
             "created_at": res.get("created_at", "")
         })
     
+    if limit is not None or cursor:
+        return {"reservations": result, "nextCursor": next_cursor}
     return {"reservations": result}
 
 @app.get("/api/inventory")
 async def get_inventory():
-    items = db.read_csv("inventory.csv")
-    # Convert quantity and minStock to int/float
-    alerts = []
-    for item in items:
-        try:
-            item["quantity"] = float(item["quantity"])
-            item["minStock"] = float(item["minStock"])
-            # UC-17: Cảnh báo tồn kho tối thiểu
-            if item["quantity"] < item["minStock"]:
-                alerts.append({
-                    "id": item["id"],
-                    "name": item["name"],
-                    "quantity": item["quantity"],
-                    "minStock": item["minStock"],
-                    "shortage": item["minStock"] - item["quantity"]
-                })
-        except:
-            pass
-    return {
-        "items": items,
-        "alerts": alerts  # UC-17: Trả về danh sách cảnh báo
-    }
+    items = await db.aread_csv("inventory.csv", typed=True)
+    # UC-17: Trả về kèm danh sách cảnh báo tồn kho tối thiểu
+    return dashboard.inventory_report(items)
 
 # UC-17: Cập nhật định mức tồn kho tối thiểu
 @app.put("/api/inventory/{item_id}/min-stock")
 async def update_min_stock(request: Request, item_id: str):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] != "manager":
         raise HTTPException(status_code=403)
     
@@ -593,14 +735,14 @@ async def update_min_stock(request: Request, item_id: str):
             "message": "Định mức tồn kho phải là số"
         }, status_code=400)
     
-    item = db.find_one("inventory.csv", "id", item_id)
+    item = await db.afind_one("inventory.csv", "id", item_id)
     if not item:
         return JSONResponse({
             "success": False,
             "message": "Nguyên liệu không tồn tại"
         }, status_code=404)
     
-    db.update_csv("inventory.csv", "id", item_id, {"minStock": str(min_stock)}, CSVSchemas.INVENTORY)
+    await db.aupdate_csv("inventory.csv", "id", item_id, {"minStock": str(min_stock)}, CSVSchemas.INVENTORY)
     
     return JSONResponse({
         "success": True,
@@ -608,14 +750,24 @@ async def update_min_stock(request: Request, item_id: str):
     })
 
 @app.get("/api/staff")
-async def get_staff():
-    staff = db.read_csv("staff.csv")
+async def get_staff(
+    status: Optional[str] = None,
+    sort: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+):
+    try:
+        staff, next_cursor = await list_page("staff.csv", {"status": status}, sort, limit, cursor)
+    except ValidationError as e:
+        return handle_validation_error(e)
+    if limit is not None or cursor:
+        return {"staff": staff, "nextCursor": next_cursor}
     return {"staff": staff}
 
 # UC-15: Tạo tài khoản nhân viên
 @app.post("/api/staff")
 async def create_staff(request: Request):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] != "manager":
         raise HTTPException(status_code=403)
     
@@ -634,7 +786,7 @@ async def create_staff(request: Request):
         }, status_code=400)
     
     # Check if phone already exists
-    existing_user = db.find_one("users.csv", "phone", phone)
+    existing_user = await db.afind_one("users.csv", "phone", phone)
     if existing_user:
         return JSONResponse({
             "success": False,
@@ -643,7 +795,7 @@ async def create_staff(request: Request):
     
     # Check if email already exists (if provided)
     if email:
-        existing_email = db.find_one("users.csv", "email", email)
+        existing_email = await db.afind_one("users.csv", "email", email)
         if existing_email:
             return JSONResponse({
                 "success": False,
@@ -651,8 +803,7 @@ async def create_staff(request: Request):
             }, status_code=400)
     
     # Create user account
-    users = db.read_csv("users.csv")
-    user_id = str(len(users) + 1)
+    user_id = await db.anext_sequence("users.csv")
     
     new_user = {
         "id": user_id,
@@ -664,11 +815,10 @@ async def create_staff(request: Request):
         "roles": ",".join(roles) if roles else "staff"  # Store roles as comma-separated
     }
     
-    db.append_csv("users.csv", new_user, CSVSchemas.USERS)
+    await db.aappend_csv("users.csv", new_user, CSVSchemas.USERS)
     
     # Create staff record
-    staff_list = db.read_csv("staff.csv")
-    staff_id = str(len(staff_list) + 1)
+    staff_id = await db.anext_sequence("staff.csv")
     
     new_staff = {
         "id": staff_id,
@@ -680,7 +830,7 @@ async def create_staff(request: Request):
         "schedule": ""
     }
     
-    db.append_csv("staff.csv", new_staff, CSVSchemas.STAFF)
+    await db.aappend_csv("staff.csv", new_staff, CSVSchemas.STAFF)
     
     return JSONResponse({
         "success": True,
@@ -691,13 +841,13 @@ async def create_staff(request: Request):
 # UC-15: Cập nhật thông tin/quyền nhân viên
 @app.put("/api/staff/{staff_id}")
 async def update_staff(request: Request, staff_id: str):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] != "manager":
         raise HTTPException(status_code=403)
     
     body = await request.json()
     
-    staff = db.find_one("staff.csv", "id", staff_id)
+    staff = await db.afind_one("staff.csv", "id", staff_id)
     if not staff:
         return JSONResponse({
             "success": False,
@@ -715,15 +865,15 @@ async def update_staff(request: Request, staff_id: str):
         updates["schedule"] = body["schedule"]
     
     if updates:
-        db.update_csv("staff.csv", "id", staff_id, updates, CSVSchemas.STAFF)
+        await db.aupdate_csv("staff.csv", "id", staff_id, updates, CSVSchemas.STAFF)
         
         # Also update user roles if provided
         if "roles" in body:
             user_email = staff.get("email")
             if user_email:
-                user_record = db.find_one("users.csv", "email", user_email)
+                user_record = await db.afind_one("users.csv", "email", user_email)
                 if user_record:
-                    db.update_csv("users.csv", "email", user_email, {
+                    await db.aupdate_csv("users.csv", "email", user_email, {
                         "role": UserRole.STAFF,
                         "roles": ",".join(body["roles"]) if isinstance(body["roles"], list) else body["roles"]
                     }, CSVSchemas.USERS)
@@ -736,14 +886,14 @@ async def update_staff(request: Request, staff_id: str):
 # UC-15: Reset mật khẩu khách hàng
 @app.post("/api/customers/{customer_email}/reset-password")
 async def reset_customer_password(request: Request, customer_email: str):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] != "manager":
         raise HTTPException(status_code=403)
     
     body = await request.json()
     new_password = body.get("newPassword", "123456")  # Default password
     
-    customer = db.find_one("users.csv", "email", customer_email)
+    customer = await db.afind_one("users.csv", "email", customer_email)
     if not customer or customer.get("role") != "customer":
         return JSONResponse({
             "success": False,
@@ -751,7 +901,7 @@ async def reset_customer_password(request: Request, customer_email: str):
         }, status_code=404)
     
     fieldnames = ["id", "name", "email", "password", "phone", "role"]
-    db.update_csv("users.csv", "email", customer_email, {"password": new_password}, fieldnames)
+    await db.aupdate_csv("users.csv", "email", customer_email, {"password": new_password}, fieldnames)
     
     return JSONResponse({
         "success": True,
@@ -761,7 +911,7 @@ async def reset_customer_password(request: Request, customer_email: str):
 # UC-15: Trả lời phản hồi
 @app.post("/api/feedback/{feedback_id}/respond")
 async def respond_to_feedback(request: Request, feedback_id: str):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] != "manager":
         raise HTTPException(status_code=403)
     
@@ -774,7 +924,7 @@ async def respond_to_feedback(request: Request, feedback_id: str):
             "message": "Vui lòng nhập nội dung trả lời"
         }, status_code=400)
     
-    feedback = db.find_one("feedback.csv", "id", feedback_id)
+    feedback = await db.afind_one("feedback.csv", "id", feedback_id)
     if not feedback:
         return JSONResponse({
             "success": False,
@@ -782,7 +932,7 @@ async def respond_to_feedback(request: Request, feedback_id: str):
         }, status_code=404)
     
     fieldnames = ["id", "customer_email", "customer_name", "date", "foodRating", "serviceRating", "comment", "status", "response"]
-    db.update_csv("feedback.csv", "id", feedback_id, {
+    await db.aupdate_csv("feedback.csv", "id", feedback_id, {
         "response": response_text,
         "status": "responded"
     }, fieldnames)
@@ -794,21 +944,13 @@ async def respond_to_feedback(request: Request, feedback_id: str):
 
 @app.get("/api/promotions")
 async def get_promotions():
-    promotions = db.read_csv("promotions.csv")
-    # Convert numeric fields
-    for promo in promotions:
-        try:
-            promo["discount"] = float(promo["discount"]) if promo["discount"] else 0
-            promo["maxDiscount"] = float(promo["maxDiscount"]) if promo.get("maxDiscount") else None
-            promo["minOrder"] = float(promo["minOrder"]) if promo.get("minOrder") else None
-        except:
-            pass
-    return {"promotions": promotions}
+    promotions = await db.aread_csv("promotions.csv", typed=True)
+    return dashboard.promotions_report(promotions)
 
 # UC-14: Tạo chương trình khuyến mãi
 @app.post("/api/promotions")
 async def create_promotion(request: Request):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] != "manager":
         raise HTTPException(status_code=403)
     
@@ -830,7 +972,7 @@ async def create_promotion(request: Request):
         }, status_code=400)
     
     # Check if code already exists
-    existing_promos = db.read_csv("promotions.csv")
+    existing_promos = await db.aread_csv("promotions.csv")
     if any(p.get("code") == code for p in existing_promos):
         return JSONResponse({
             "success": False,
@@ -867,7 +1009,7 @@ async def create_promotion(request: Request):
         }, status_code=400)
     
     # Get next ID
-    promo_id = str(len(existing_promos) + 1)
+    promo_id = await db.anext_sequence("promotions.csv")
     
     new_promo = {
         "id": promo_id,
@@ -884,7 +1026,7 @@ async def create_promotion(request: Request):
     }
     
     fieldnames = ["id", "code", "name", "description", "discount", "type", "maxDiscount", "minOrder", "startDate", "endDate", "status"]
-    db.append_csv("promotions.csv", new_promo, fieldnames)
+    await db.aappend_csv("promotions.csv", new_promo, fieldnames)
     
     return JSONResponse({
         "success": True,
@@ -894,13 +1036,13 @@ async def create_promotion(request: Request):
 
 @app.put("/api/promotions/{promo_id}")
 async def update_promotion(request: Request, promo_id: str):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] != "manager":
         raise HTTPException(status_code=403)
     
     body = await request.json()
     
-    existing_promo = db.find_one("promotions.csv", "id", promo_id)
+    existing_promo = await db.afind_one("promotions.csv", "id", promo_id)
     if not existing_promo:
         return JSONResponse({
             "success": False,
@@ -913,7 +1055,7 @@ async def update_promotion(request: Request, promo_id: str):
     if "code" in body:
         # Check if new code conflicts with existing
         if body["code"] != existing_promo.get("code"):
-            existing_promos = db.read_csv("promotions.csv")
+            existing_promos = await db.aread_csv("promotions.csv")
             if any(p.get("code") == body["code"] for p in existing_promos):
                 return JSONResponse({
                     "success": False,
@@ -939,7 +1081,7 @@ async def update_promotion(request: Request, promo_id: str):
     
     if updates:
         fieldnames = ["id", "code", "name", "description", "discount", "type", "maxDiscount", "minOrder", "startDate", "endDate", "status"]
-        db.update_csv("promotions.csv", "id", promo_id, updates, fieldnames)
+        await db.aupdate_csv("promotions.csv", "id", promo_id, updates, fieldnames)
     
     return JSONResponse({
         "success": True,
@@ -948,11 +1090,11 @@ async def update_promotion(request: Request, promo_id: str):
 
 @app.delete("/api/promotions/{promo_id}")
 async def delete_promotion(request: Request, promo_id: str):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] != "manager":
         raise HTTPException(status_code=403)
     
-    existing_promo = db.find_one("promotions.csv", "id", promo_id)
+    existing_promo = await db.afind_one("promotions.csv", "id", promo_id)
     if not existing_promo:
         return JSONResponse({
             "success": False,
@@ -960,7 +1102,7 @@ async def delete_promotion(request: Request, promo_id: str):
         }, status_code=404)
     
     fieldnames = ["id", "code", "name", "description", "discount", "type", "maxDiscount", "minOrder", "startDate", "endDate", "status"]
-    db.delete_csv("promotions.csv", "id", promo_id, fieldnames)
+    await db.adelete_csv("promotions.csv", "id", promo_id, fieldnames)
     
     return JSONResponse({
         "success": True,
@@ -968,108 +1110,89 @@ async def delete_promotion(request: Request, promo_id: str):
     })
 
 @app.get("/api/customers")
-async def get_customers():
-    customers = db.read_csv("customers.csv")
-    # Convert numeric fields
+async def get_customers(
+    status: Optional[str] = None,
+    segment: Optional[str] = None,
+    sort: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+):
+    emails = None
+    try:
+        if segment:
+            validate_enum(segment, [
+                CustomerSegment.CHAMPIONS, CustomerSegment.LOYAL, CustomerSegment.NEW,
+                CustomerSegment.POTENTIAL, CustomerSegment.AT_RISK, CustomerSegment.HIBERNATING
+            ], "Phân khúc")
+            segmented, _ = await db.aquery("customer_segments.csv", {"segment": segment})
+            emails = [row["email"] for row in segmented]
+        if emails == []:
+            customers, next_cursor = [], None
+        else:
+            customers, next_cursor = await list_page(
+                "customers.csv", {"status": status, "email": emails}, sort, limit, cursor
+            )
+    except ValidationError as e:
+        return handle_validation_error(e)
+    # RFM scores precomputed by the segmentation job (segments.py)
+    rfm = await db.agroup_by("customer_segments.csv", "email", [c["email"] for c in customers], typed=True)
     for customer in customers:
-        try:
-            customer["totalOrders"] = int(customer["totalOrders"])
-            customer["totalSpent"] = float(customer["totalSpent"])
-        except:
-            pass
+        rows = rfm.get(customer["email"])
+        customer["rfm"] = {k: v for k, v in rows[0].items() if k != "email"} if rows else None
+    if limit is not None or cursor:
+        return {"customers": customers, "nextCursor": next_cursor}
     return {"customers": customers}
 
 @app.get("/api/feedback")
-async def get_feedback():
-    feedback = db.read_csv("feedback.csv")
-    # Convert ratings to int and format response
-    result = []
-    for fb in feedback:
-        fb_data = {
-            "id": fb["id"],
-            "customer": fb.get("customer_name") or fb.get("customer_email", "Unknown"),
-            "date": fb["date"],
-            "foodRating": int(fb["foodRating"]),
-            "serviceRating": int(fb["serviceRating"]),
-            "comment": fb["comment"],
-            "status": fb["status"]
-        }
-        if fb.get("response"):
-            fb_data["response"] = fb["response"]
-        result.append(fb_data)
+async def get_feedback(
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    customer_email: Optional[str] = None,
+    sort: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+):
+    filters = {"status": status, "customer_email": customer_email}
+    try:
+        feedback, next_cursor = await list_page(
+            "feedback.csv", filters, sort, limit, cursor, date_from, date_to
+        )
+    except ValidationError as e:
+        return handle_validation_error(e)
+    result = [dashboard.feedback_entry(fb) for fb in feedback]
+    if limit is not None or cursor:
+        return {"feedback": result, "nextCursor": next_cursor}
     return {"feedback": result}
 
 @app.get("/api/revenue")
 async def get_revenue():
-    revenue_data = db.read_csv("revenue.csv")
-    
-    # Convert to proper format
-    daily = []
-    for r in revenue_data:
-        daily.append({
-            "date": r["date"],
-            "revenue": float(r["revenue"]),
-            "orders": int(r["orders"])
-        })
-    
-    # Calculate totals
-    today = datetime.now().strftime("%Y-%m-%d")
-    today_data = next((d for d in daily if d["date"] == today), None)
-    
-    week_total = sum(d["revenue"] for d in daily[-7:])
-    week_orders = sum(d["orders"] for d in daily[-7:])
-    
-    totals = {
-        "today": today_data["revenue"] if today_data else 0.0,
-        "week": week_total,
-        "month": sum(d["revenue"] for d in daily),
-        "orders_today": today_data["orders"] if today_data else 0,
-        "orders_week": week_orders,
-        "avg_order": week_total / week_orders if week_orders > 0 else 0
-    }
-    
-    return {
-        "daily": daily,
-        "totals": totals
-    }
+    # Answered from the daily/hourly/payment-method rollups (see rollups.py)
+    return await rollups.asummary()
 
 # Thống kê món bán chạy
 @app.get("/api/popular-items")
-async def get_popular_items():
-    # Calculate from order_details
-    order_details = db.read_csv("order_details.csv")
-    menu_items = db.read_csv("menu_items.csv")
-    
-    # Create menu lookup
-    menu_lookup = {item["id"]: item for item in menu_items}
-    
-    # Calculate totals
-    item_stats = {}
-    for detail in order_details:
-        item_id = detail["menu_item_id"]
-        if item_id not in item_stats:
-            item_stats[item_id] = {"totalSold": 0, "revenue": 0.0}
-        
-        item_stats[item_id]["totalSold"] += int(detail["quantity"])
-        item_stats[item_id]["revenue"] += float(detail["subtotal"])
-    
-    # Format results
-    items = []
-    for item_id, stats in item_stats.items():
-        menu_item = menu_lookup.get(item_id, {})
-        items.append({
-            "id": item_id,
-            "name": menu_item.get("name", "Unknown"),
-            "category": menu_item.get("category", ""),
-            "totalSold": stats["totalSold"],
-            "revenue": stats["revenue"],
-            "image": menu_item.get("image", "")
-        })
+async def get_popular_items(window: str = "all", category: Optional[str] = None,
+                            limit: int = 5, byCategory: bool = False):
+    # Served from in-memory counters fed by the item sales rollups (see rollups.py)
+    if window not in rollups.WINDOWS:
+        return JSONResponse({
+            "success": False,
+            "message": "Khoảng thời gian không hợp lệ (all, today, 7d, 30d)"
+        }, status_code=400)
+    limit = max(1, min(limit, 50))
     
-    # Sort by totalSold descending
-    items.sort(key=lambda x: x["totalSold"], reverse=True)
+    async def describe(top):
+        menu = {item_id: await db.afind_one("menu_items.csv", "id", item_id) for item_id, _, _ in top}
+        return dashboard.describe_items(top, menu)
     
-    return {"items": items[:5]}  # Top 5
+    result = {"items": await describe(await rollups.atop_items(window, limit, category)), "window": window}
+    if byCategory:
+        result["byCategory"] = {
+            name: await describe(top)
+            for name, top in sorted((await rollups.atop_by_category(window, limit)).items())
+        }
+    return result
 
 # Đăng ký tài khoản khách hàng
 @app.post("/api/register")
@@ -1084,7 +1207,7 @@ async def register(
     password = password.strip()
     
     # Check if email already exists
-    existing_user = db.find_one("users.csv", "email", email)
+    existing_user = await db.afind_one("users.csv", "email", email)
     if existing_user:
         return JSONResponse({"success": False, "message": "Email đã được sử dụng"}, status_code=400)
     
@@ -1093,8 +1216,7 @@ async def register(
         return JSONResponse({"success": False, "message": "Email không hợp lệ"}, status_code=400)
     
     # Get next user ID
-    users = db.read_csv("users.csv")
-    user_id = str(len(users) + 1)
+    user_id = await db.anext_sequence("users.csv")
     
     # Create new user
     new_user = {
@@ -1108,7 +1230,7 @@ async def register(
     
     # Save to CSV
     fieldnames = ["id", "name", "email", "password", "phone", "role"]
-    db.append_csv("users.csv", new_user, fieldnames)
+    await db.aappend_csv("users.csv", new_user, fieldnames)
     
     return JSONResponse({"success": True, "message": "Đăng ký thành công"})
 
@@ -1120,13 +1242,12 @@ async def submit_feedback(
     serviceRating: int = Form(...),
     comment: str = Form(...)
 ):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user:
         raise HTTPException(status_code=401)
     
     # Get next ID
-    feedback_list = db.read_csv("feedback.csv")
-    feedback_id = str(len(feedback_list) + 1)
+    feedback_id = await db.anext_sequence("feedback.csv")
     
     # Create feedback record
     new_feedback = {
@@ -1143,7 +1264,7 @@ async def submit_feedback(
     
     # Save to CSV
     fieldnames = ["id", "customer_email", "customer_name", "date", "foodRating", "serviceRating", "comment", "status", "response"]
-    db.append_csv("feedback.csv", new_feedback, fieldnames)
+    await db.aappend_csv("feedback.csv", new_feedback, fieldnames)
     
     return JSONResponse({
         "success": True,
@@ -1158,7 +1279,7 @@ async def process_payment(
     paymentMethod: str = None,
     amount: float = None
 ):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user:
         raise HTTPException(status_code=401)
     
@@ -1177,23 +1298,19 @@ async def process_payment(
             "message": "Thiếu thông tin thanh toán"
         }, status_code=400)
     
-    # Update order status
-    order = db.find_one("orders.csv", "id", orderId)
+    # Mark the order paid and completed; the revenue rollups move with it
+    order = await rollups.aupdate_order(orderId, {
+        "payment_method": paymentMethod,
+        "payment_status": PaymentStatus.PAID,
+        "status": OrderStatus.COMPLETED
+    })
     if not order:
         return JSONResponse({
             "success": False,
             "message": "Đơn hàng không tồn tại"
         }, status_code=404)
     
-    # Update order payment status
-    fieldnames = ["id", "customer_email", "customer_name", "date", "total", "status", "payment_method", "payment_status", "table_id", "created_at"]
-    db.update_csv("orders.csv", "id", orderId, {
-        "payment_method": paymentMethod,
-        "payment_status": "paid",
-        "status": "completed" if order["status"] != "completed" else order["status"]
-    }, fieldnames)
-    
-    transaction_id = f"TXN-{orderId}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    transaction_id = ids.new_id(f"{OrderPrefix.TRANSACTION}{orderId}-")
     
     return JSONResponse({
         "success": True,
@@ -1206,7 +1323,7 @@ async def process_payment(
 # Tạo đơn hàng từ khách hàng
 @app.post("/api/customer/create-order")
 async def customer_create_order(request: Request):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] != "customer":
         raise HTTPException(status_code=403)
     
@@ -1223,7 +1340,7 @@ async def customer_create_order(request: Request):
     subtotal = sum(item["price"] * item["quantity"] for item in items)
     
     # Generate order ID
-    order_id = f"ORD-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    order_id = ids.new_id(OrderPrefix.ORDER)
     
     # Create order record
     new_order = {
@@ -1239,21 +1356,25 @@ async def customer_create_order(request: Request):
         "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     }
     
-    # Save order
+    # Save order and its details in one transaction
+    tx = db.Transaction()
     order_fieldnames = ["id", "customer_email", "customer_name", "date", "total", "status", "payment_method", "payment_status", "table_id", "created_at"]
-    db.append_csv("orders.csv", new_order, order_fieldnames)
+    tx.append_csv("orders.csv", new_order, order_fieldnames)
     
-    # Save order details
     detail_fieldnames = ["order_id", "menu_item_id", "quantity", "price", "subtotal"]
-    for item in items:
-        order_detail = {
+    order_details = [
+        {
             "order_id": order_id,
             "menu_item_id": item["id"],
             "quantity": str(item["quantity"]),
             "price": str(item["price"]),
             "subtotal": str(item["price"] * item["quantity"])
         }
-        db.append_csv("order_details.csv", order_detail, detail_fieldnames)
+        for item in items
+    ]
+    tx.append_many("order_details.csv", order_details, detail_fieldnames)
+    # The item sales rollups are updated in the same transaction
+    await rollups.acommit(tx)
     
     return JSONResponse({
         "success": True,
@@ -1266,7 +1387,7 @@ async def customer_create_order(request: Request):
 # Tạo đơn hàng tại quầy
 @app.post("/api/create-order")
 async def create_order(request: Request):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] != "staff":
         raise HTTPException(status_code=403)
     
@@ -1285,22 +1406,25 @@ async def create_order(request: Request):
         }, status_code=400)
     
     # Generate order ID
-    order_id = f"ORD-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    order_id = ids.new_id(OrderPrefix.ORDER)
     total = subtotal - discount
     
     # Get customer name if phone provided
     customer_name = ""
     if customer_phone:
-        customer = db.find_one("users.csv", "phone", customer_phone)
+        customer = await db.afind_one("users.csv", "phone", customer_phone)
         if customer:
             customer_name = customer.get("name", "")
     
+    # The table, the order and its details are written in one transaction
+    tx = db.Transaction()
+    
     # UC-06: Cập nhật trạng thái bàn nếu có table_id
     if table_id:
-        table = db.find_one("tables.csv", "id", table_id)
+        table = await db.afind_one("tables.csv", "id", table_id)
         if table:
             table_fieldnames = ["id", "number", "capacity", "status"]
-            db.update_csv("tables.csv", "id", table_id, {"status": TableStatus.OCCUPIED}, table_fieldnames)
+            tx.update_csv("tables.csv", "id", table_id, {"status": TableStatus.OCCUPIED}, table_fieldnames)
     
     # Create order record
     new_order = {
@@ -1318,19 +1442,23 @@ async def create_order(request: Request):
     
     # Save order
     order_fieldnames = ["id", "customer_email", "customer_name", "date", "total", "status", "payment_method", "payment_status", "table_id", "created_at"]
-    db.append_csv("orders.csv", new_order, order_fieldnames)
+    tx.append_csv("orders.csv", new_order, order_fieldnames)
     
     # Save order details
     detail_fieldnames = ["order_id", "menu_item_id", "quantity", "price", "subtotal"]
-    for item in items:
-        order_detail = {
+    order_details = [
+        {
             "order_id": order_id,
             "menu_item_id": item["id"],
             "quantity": str(item["quantity"]),
             "price": str(item["price"]),
             "subtotal": str(item["price"] * item["quantity"])
         }
-        db.append_csv("order_details.csv", order_detail, detail_fieldnames)
+        for item in items
+    ]
+    tx.append_many("order_details.csv", order_details, detail_fieldnames)
+    # The item sales rollups are updated in the same transaction
+    await rollups.acommit(tx)
     
     return JSONResponse({
         "success": True,
@@ -1343,7 +1471,7 @@ async def create_order(request: Request):
 # Cập nhật trạng thái đơn hàng
 @app.post("/api/update-order-status")
 async def update_order_status(request: Request):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] not in ["staff", "manager"]:
         raise HTTPException(status_code=403)
     
@@ -1357,17 +1485,14 @@ async def update_order_status(request: Request):
             "message": "Thiếu thông tin"
         }, status_code=400)
     
-    # Update order status
-    order = db.find_one("orders.csv", "id", order_id)
+    # Update order status (completing a paid order adds it to the revenue rollups)
+    order = await rollups.aupdate_order(order_id, {"status": new_status})
     if not order:
         return JSONResponse({
             "success": False,
             "message": "Đơn hàng không tồn tại"
         }, status_code=404)
     
-    fieldnames = ["id", "customer_email", "customer_name", "date", "total", "status", "payment_method", "payment_status", "table_id", "created_at"]
-    db.update_csv("orders.csv", "id", order_id, {"status": new_status}, fieldnames)
-    
     return JSONResponse({
         "success": True,
         "message": "Cập nhật trạng thái đơn hàng thành công",
@@ -1378,7 +1503,7 @@ async def update_order_status(request: Request):
 # Kiểm kê kho
 @app.post("/api/inventory-check")
 async def inventory_check(request: Request):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] != "staff":
         raise HTTPException(status_code=403)
     
@@ -1394,7 +1519,7 @@ async def inventory_check(request: Request):
     # Update inventory quantities
     inventory_fieldnames = ["id", "name", "quantity", "unit", "minStock", "supplier"]
     for adj in adjustments:
-        db.update_csv("inventory.csv", "id", adj["id"], {
+        await db.aupdate_csv("inventory.csv", "id", adj["id"], {
             "quantity": str(adj["actualQuantity"])
         }, inventory_fieldnames)
     
@@ -1407,7 +1532,7 @@ async def inventory_check(request: Request):
 # Nhập kho
 @app.post("/api/inventory-import")
 async def inventory_import(request: Request):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] != "staff":
         raise HTTPException(status_code=403)
     
@@ -1426,14 +1551,14 @@ async def inventory_import(request: Request):
     inventory_fieldnames = ["id", "name", "quantity", "unit", "minStock", "supplier"]
     for item in items:
         if item["id"]:
-            existing = db.find_one("inventory.csv", "id", item["id"])
+            existing = await db.afind_one("inventory.csv", "id", item["id"], typed=True)
             if existing:
-                new_quantity = float(existing["quantity"]) + float(item["quantity"])
-                db.update_csv("inventory.csv", "id", item["id"], {
+                new_quantity = (existing["quantity"] or 0.0) + float(item["quantity"])
+                await db.aupdate_csv("inventory.csv", "id", item["id"], {
                     "quantity": str(new_quantity)
                 }, inventory_fieldnames)
     
-    import_id = f"IMP-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    import_id = ids.new_id(OrderPrefix.IMPORT)
     
     return JSONResponse({
         "success": True,
@@ -1445,7 +1570,7 @@ async def inventory_import(request: Request):
 # Xuất/Hủy kho
 @app.post("/api/inventory-export")
 async def inventory_export(request: Request):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] != "staff":
         raise HTTPException(status_code=403)
     
@@ -1461,14 +1586,14 @@ async def inventory_export(request: Request):
         }, status_code=400)
     
     # Update inventory quantity
-    existing = db.find_one("inventory.csv", "id", item_id)
+    existing = await db.afind_one("inventory.csv", "id", item_id, typed=True)
     if not existing:
         return JSONResponse({
             "success": False,
             "message": "Nguyên liệu không tồn tại"
         }, status_code=404)
     
-    current_quantity = float(existing["quantity"])
+    current_quantity = existing["quantity"] or 0.0
     if quantity > current_quantity:
         return JSONResponse({
             "success": False,
@@ -1477,11 +1602,11 @@ async def inventory_export(request: Request):
     
     new_quantity = current_quantity - quantity
     inventory_fieldnames = ["id", "name", "quantity", "unit", "minStock", "supplier"]
-    db.update_csv("inventory.csv", "id", item_id, {
+    await db.aupdate_csv("inventory.csv", "id", item_id, {
         "quantity": str(new_quantity)
     }, inventory_fieldnames)
     
-    export_id = f"EXP-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    export_id = ids.new_id(OrderPrefix.EXPORT)
     
     return JSONResponse({
         "success": True,
@@ -1497,118 +1622,98 @@ async def clock_in_out(
     request: Request,
     action: str = Form(...)  # "clock_in" or "clock_out"
 ):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] != "staff":
         raise HTTPException(status_code=403)
     
-    current_time = datetime.now()
-    current_date = current_time.strftime("%Y-%m-%d")
-    current_time_str = current_time.strftime("%Y-%m-%d %H:%M:%S")
-    time_str = current_time.strftime("%H:%M:%S")
-    
+    # Open sessions and weekly/monthly totals are kept by attendance.py
     if action == "clock_in":
-        # Check if already clocked in today
-        today_record = db.find_many("attendance.csv", lambda x: 
-            x.get("staff_email") == user["email"] and 
-            x.get("date") == current_date and 
-            x.get("clockOut") == ""
-        )
+        record, open_record = await attendance.aclock_in(user["email"])
         
-        if today_record:
+        if open_record:
             return JSONResponse({
                 "success": False,
-                "message": f"Bạn đã vào ca lúc {today_record[0].get('clockIn')}. Bạn có muốn ra ca không?"
+                "message": f"Bạn đã vào ca lúc {open_record.get('clockIn')}. Bạn có muốn ra ca không?"
             }, status_code=400)
         
-        # Create new attendance record
-        attendance_list = db.read_csv("attendance.csv")
-        attendance_id = str(len(attendance_list) + 1)
-        
-        new_record = {
-            "id": attendance_id,
-            "staff_email": user["email"],
-            "date": current_date,
-            "clockIn": time_str,
-            "clockOut": "",
-            "hours": "0",
-            "status": "present"
-        }
-        
-        fieldnames = ["id", "staff_email", "date", "clockIn", "clockOut", "hours", "status"]
-        db.append_csv("attendance.csv", new_record, fieldnames)
-        
-        message = f"Đã chấm công vào lúc {time_str}"
+        message = f"Đã chấm công vào lúc {record['clockIn']}"
     else:
-        # Find today's record
-        today_record = db.find_many("attendance.csv", lambda x: 
-            x.get("staff_email") == user["email"] and 
-            x.get("date") == current_date and 
-            x.get("clockOut") == ""
-        )
+        record = await attendance.aclock_out(user["email"])
         
-        if not today_record:
+        if not record:
             return JSONResponse({
                 "success": False,
                 "message": "Bạn chưa chấm công vào ca. Vui lòng vào ca trước."
             }, status_code=400)
         
-        # Calculate hours worked
-        clock_in = datetime.strptime(f"{current_date} {today_record[0]['clockIn']}", "%Y-%m-%d %H:%M:%S")
-        hours_worked = (current_time - clock_in).total_seconds() / 3600
-        
-        # Update record
-        fieldnames = ["id", "staff_email", "date", "clockIn", "clockOut", "hours", "status"]
-        db.update_csv("attendance.csv", "id", today_record[0]["id"], {
-            "clockOut": time_str,
-            "hours": str(round(hours_worked, 2))
-        }, fieldnames)
-        
-        message = f"Đã chấm công ra lúc {time_str}. Tổng thời gian làm việc: {round(hours_worked, 2)}h"
+        message = f"Đã chấm công ra lúc {record['clockOut']}. Tổng thời gian làm việc: {record['hours']}h"
     
     return JSONResponse({
         "success": True,
         "message": message,
-        "time": current_time_str
+        "time": f"{record['date']} {record['clockOut'] or record['clockIn']}"
     })
 
 # Lấy thông tin chấm công
 @app.get("/api/attendance")
 async def get_attendance(request: Request):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] != "staff":
         raise HTTPException(status_code=403)
     
     # Get attendance records for this staff
-    attendance_records = db.find_many("attendance.csv", lambda x: x.get("staff_email") == user["email"])
+    attendance_records, _ = await db.aquery("attendance.csv", {"staff_email": user["email"]}, typed=True)
     
     # Format and calculate summary
-    attendance = []
+    records = []
     total_hours = 0.0
     for record in attendance_records:
-        attendance.append({
+        records.append({
             "date": record["date"],
             "clockIn": record["clockIn"],
             "clockOut": record["clockOut"],
-            "hours": float(record["hours"]),
+            "hours": record["hours"] or 0.0,
             "status": record["status"]
         })
-        total_hours += float(record["hours"])
+        total_hours += record["hours"] or 0.0
     
+    days_worked = sum(1 for record in records if record["status"] != AttendanceStatus.ABSENT)
     summary = {
         "totalHours": total_hours,
-        "daysWorked": len(attendance),
-        "avgHoursPerDay": total_hours / len(attendance) if len(attendance) > 0 else 0
+        "daysWorked": days_worked,
+        "avgHoursPerDay": total_hours / days_worked if days_worked > 0 else 0
     }
     
     return {
-        "attendance": attendance,
+        "attendance": records,
         "summary": summary
     }
 
+# Tổng giờ làm theo tuần / tháng của nhân viên (quản lý)
+@app.get("/api/manager/payroll")
+async def get_payroll(
+    period: str = "week",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    staff_email: Optional[str] = None,
+    user: dict = Depends(auth.require_manager_role)
+):
+    try:
+        validate_enum(period, list(attendance.PERIODS), "Kỳ")
+        if date_from:
+            validate_date_format(date_from, field_name="Từ ngày")
+        if date_to:
+            validate_date_format(date_to, field_name="Đến ngày")
+    except ValidationError as e:
+        return handle_validation_error(e)
+    # Shift days nobody clocked in for count as absences
+    await attendance.amark_absences(date_from, date_to)
+    return await attendance.apayroll(period, date_from, date_to, staff_email)
+
 # UC-12: Báo cáo ca làm
 @app.post("/api/shift-report")
 async def submit_shift_report(request: Request):
-    user = get_current_user(request)
+    user = await aget_current_user(request)
     if not user or user["role"] != "staff":
         raise HTTPException(status_code=403)
     
@@ -1631,51 +1736,37 @@ async def submit_shift_report(request: Request):
             "message": "Tiền mặt thực tế phải là số"
         }, status_code=400)
     
-    # Check if there are incomplete orders
-    orders = db.read_csv("orders.csv")
-    incomplete_orders = [
-        o for o in orders 
-        if o.get("status") in ["pending", "in_preparation"] and 
-        o.get("payment_status") != "paid"
-    ]
+    # Check if there are incomplete orders (kept as a running count, see rollups.py)
+    incomplete_orders = await rollups.aopen_orders()
     
     if incomplete_orders:
         return JSONResponse({
             "success": False,
-            "message": f"Bạn còn {len(incomplete_orders)} đơn hàng chưa hoàn tất. Vui lòng xử lý trước khi kết ca.",
-            "incompleteOrders": len(incomplete_orders)
+            "message": f"Bạn còn {incomplete_orders} đơn hàng chưa hoàn tất. Vui lòng xử lý trước khi kết ca.",
+            "incompleteOrders": incomplete_orders
         }, status_code=400)
     
-    # Calculate expected cash from completed orders
+    # Expected cash is today's running cash total of paid orders
     today = datetime.now().strftime("%Y-%m-%d")
-    today_orders = [
-        o for o in orders 
-        if o.get("date") == today and 
-        o.get("payment_status") == "paid" and
-        o.get("payment_method") == "cash"
-    ]
-    expected_cash = sum(float(o.get("total", 0)) for o in today_orders)
+    _, expected_cash = await rollups.aday_revenue(today, PaymentMethod.CASH)
+    orders_completed, total_revenue = await rollups.aday_revenue(today)
     
     # Calculate difference
     difference = actual_cash - expected_cash
     
     # Get today's attendance record
     current_date = datetime.now().strftime("%Y-%m-%d")
-    today_attendance = db.find_many("attendance.csv", lambda x: 
-        x.get("staff_email") == user["email"] and 
-        x.get("date") == current_date and 
-        x.get("clockOut") != ""
-    )
+    today_attendance, _ = await db.aquery("attendance.csv", {"staff_email": user["email"], "date": current_date})
     
-    if not today_attendance:
+    if not any(record["clockOut"] for record in today_attendance):
         return JSONResponse({
             "success": False,
             "message": "Bạn chưa chấm công ra ca. Vui lòng ra ca trước khi chốt ca."
         }, status_code=400)
     
-    # Create shift report record (you may want to create a shift_reports.csv)
-    # For now, we'll just return the report data
+    # Save the shift report for later audits
     report_data = {
+        "id": ids.new_id(OrderPrefix.SHIFT_REPORT),
         "staff_email": user["email"],
         "date": current_date,
         "expectedCash": expected_cash,
@@ -1683,13 +1774,14 @@ async def submit_shift_report(request: Request):
         "difference": difference,
         "notes": notes,
         "equipmentStatus": equipment_status,
-        "ordersCompleted": len([o for o in orders if o.get("date") == today and o.get("status") == "completed"]),
-        "totalRevenue": sum(float(o.get("total", 0)) for o in today_orders),
+        "ordersCompleted": orders_completed,
+        "totalRevenue": total_revenue,
         "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     }
-    
-    # In a real system, you would save this to shift_reports.csv
-    # For now, we'll return it
+    await db.aappend_csv("shift_reports.csv", {
+        **report_data,
+        "equipmentStatus": json.dumps(equipment_status, ensure_ascii=False)
+    }, CSVSchemas.SHIFT_REPORTS)
     
     return JSONResponse({
         "success": True,
@@ -1698,6 +1790,140 @@ async def submit_shift_report(request: Request):
         "cashMatched": difference == 0
     })
 
+# Tra cứu báo cáo ca làm đã lưu (quản lý)
+@app.get("/api/manager/shift-reports")
+async def get_shift_reports(
+    staff_email: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    sort: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    user: dict = Depends(auth.require_manager_role)
+):
+    filters = {"staff_email": staff_email}
+    try:
+        reports, next_cursor = await list_page(
+            "shift_reports.csv", filters, sort, limit, cursor, date_from, date_to
+        )
+    except ValidationError as e:
+        return handle_validation_error(e)
+    for report in reports:
+        report["equipmentStatus"] = json.loads(report["equipmentStatus"] or "{}")
+    if limit is not None or cursor:
+        return {"reports": reports, "nextCursor": next_cursor}
+    return {"reports": reports}
+
+# Số liệu lưu trữ (hàng đợi I/O, bộ nhớ đệm)
+@app.get("/api/metrics/storage")
+async def get_storage_metrics(user: dict = Depends(auth.require_manager_role)):
+    return {
+        "ioPool": db.get_io_pool_stats(),
+        "journal": db.get_journal_stats(),
+        "cache": db.get_cache_stats(),
+        "events": events.hub.stats(),
+        "archive": archive.stats(),
+        "analytics": analytics.engine.stats(),
+        "segments": segments.stats(),
+        "dashboard": dashboard.engine.stats(),
+        "users": auth.users.stats()
+    }
+
+# Lưu trữ đơn hàng cũ (chạy nền, không chặn các thao tác ghi)
+@app.post("/api/manager/archive")
+async def start_archive(user: dict = Depends(auth.require_manager_role)):
+    if not archive.start_archive():
+        return JSONResponse({
+            "success": False,
+            "message": "Đang có tác vụ lưu trữ chạy"
+        }, status_code=409)
+    return JSONResponse({
+        "success": True,
+        "message": f"Đã bắt đầu lưu trữ các đơn hàng cũ hơn {archive.ARCHIVE_AFTER_DAYS} ngày"
+    }, status_code=202)
+
+# Toàn bộ dữ liệu trang quản lý trong một lần gọi (có bộ nhớ đệm, xem dashboard.py)
+@app.get("/api/manager/dashboard")
+async def get_manager_dashboard(sections: Optional[str] = None,
+                                user: dict = Depends(auth.require_manager_role)):
+    names = [name.strip() for name in sections.split(",") if name.strip()] if sections else None
+    unknown = [name for name in names or [] if name not in dashboard.SECTIONS]
+    if unknown:
+        return JSONResponse({
+            "success": False,
+            "message": f"Phần không hợp lệ: {', '.join(unknown)} ({', '.join(dashboard.SECTIONS)})"
+        }, status_code=400)
+    return await dashboard.asnapshot(names)
+
+# Tính lại phân khúc khách hàng RFM (chạy nền)
+@app.post("/api/manager/customer-segments")
+async def start_customer_segments(user: dict = Depends(auth.require_manager_role)):
+    if not segments.start_segmentation():
+        return JSONResponse({
+            "success": False,
+            "message": "Đang có tác vụ phân khúc khách hàng chạy"
+        }, status_code=409)
+    return JSONResponse({
+        "success": True,
+        "message": "Đã bắt đầu tính lại phân khúc khách hàng"
+    }, status_code=202)
+
+# Phân tích lịch sử đơn hàng (NumPy, xem analytics.py); date_from/date_to tùy chọn
+def _validate_analytics_range(date_from: Optional[str], date_to: Optional[str]):
+    if date_from:
+        validate_date_format(date_from, field_name="Từ ngày")
+    if date_to:
+        validate_date_format(date_to, field_name="Đến ngày")
+
+@app.get("/api/manager/analytics/heatmap")
+async def get_analytics_heatmap(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                                user: dict = Depends(auth.require_manager_role)):
+    try:
+        _validate_analytics_range(date_from, date_to)
+    except ValidationError as e:
+        return handle_validation_error(e)
+    return await analytics.aheatmap(date_from, date_to)
+
+@app.get("/api/manager/analytics/basket-size")
+async def get_analytics_basket_size(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                                    user: dict = Depends(auth.require_manager_role)):
+    try:
+        _validate_analytics_range(date_from, date_to)
+    except ValidationError as e:
+        return handle_validation_error(e)
+    return await analytics.abasket_sizes(date_from, date_to)
+
+@app.get("/api/manager/analytics/average-ticket")
+async def get_analytics_average_ticket(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                                       user: dict = Depends(auth.require_manager_role)):
+    try:
+        _validate_analytics_range(date_from, date_to)
+    except ValidationError as e:
+        return handle_validation_error(e)
+    return await analytics.aaverage_ticket(date_from, date_to)
+
+@app.get("/api/manager/analytics/category-mix")
+async def get_analytics_category_mix(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                                     user: dict = Depends(auth.require_manager_role)):
+    try:
+        _validate_analytics_range(date_from, date_to)
+    except ValidationError as e:
+        return handle_validation_error(e)
+    return {"categories": await analytics.acategory_mix(date_from, date_to)}
+
+# Live order/payment/table events (Server-Sent Events); customers only get their own orders
+@app.get("/api/events")
+async def get_events(request: Request):
+    user = await aget_current_user(request)
+    if not user:
+        raise HTTPException(status_code=401)
+    subscriber = events.hub.subscribe(user["role"], user["email"])
+    return StreamingResponse(
+        events.stream(request, subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Mock password reset tokens storage (in production, use database with expiry)
 RESET_TOKENS = {}
 
@@ -1705,7 +1931,7 @@ RESET_TOKENS = {}
 @app.post("/api/forgot-password")
 async def forgot_password(email: str = Form(...)):
     email = email.strip()
-    user = db.find_one("users.csv", "email", email)
+    user = await db.afind_one("users.csv", "email", email)
     if not user:
         return JSONResponse({"success": False, "message": "Email không tồn tại trong hệ thống"}, status_code=404)
     
@@ -1745,11 +1971,11 @@ async def reset_password(
     
     # Update password
     email = token_data["email"]
-    user = db.find_one("users.csv", "email", email)
+    user = await db.afind_one("users.csv", "email", email)
     if user:
         # Update password in CSV
         fieldnames = ["id", "name", "email", "password", "phone", "role"]
-        db.update_csv("users.csv", "email", email, {"password": newPassword}, fieldnames)
+        await db.aupdate_csv("users.csv", "email", email, {"password": newPassword}, fieldnames)
         del RESET_TOKENS[token]  # Remove used token
         
         return JSONResponse({
@@ -0,0 +1,551 @@
+"""
+Revenue, item sales, order status and customer rollups
+Daily, hourly and per-payment-method revenue, daily sales per menu item,
+order counts per status and each customer's totalOrders / totalSpent, kept
+up to date as orders are created, paid and completed, so reports (and
+closing a shift) never scan the orders
+
+An order counts towards revenue, and towards its customer's totals, once it
+is both completed and paid, on its order date (and the hour it was created);
+its items count as sold as soon as it is created. Archiving an order does
+not change the rollups.
+
+Usage:
+    python rollups.py rebuild         # recompute every rollup from order history
+"""
+import argparse
+import bisect
+import os
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import archive
+import database as db
+from database import CSVSchemas
+from constants import CustomerStatus, OrderStatus, PaymentStatus
+
+ROLLUP_TABLES = {
+    "revenue.csv": CSVSchemas.REVENUE,
+    "revenue_hourly.csv": CSVSchemas.REVENUE_HOURLY,
+    "revenue_by_method.csv": CSVSchemas.REVENUE_BY_METHOD,
+    "item_sales.csv": CSVSchemas.ITEM_SALES,
+    "order_status_counts.csv": CSVSchemas.ORDER_STATUS_COUNTS,
+}
+
+# Count and revenue columns of each table the deltas move (None: no
+# revenue). customers.csv is not a rollup table of its own: only its totals
+# are moved, its other columns are kept.
+TOTAL_FIELDS = {
+    "revenue.csv": ("orders", "revenue"),
+    "revenue_hourly.csv": ("orders", "revenue"),
+    "revenue_by_method.csv": ("orders", "revenue"),
+    "item_sales.csv": ("quantity", "revenue"),
+    "order_status_counts.csv": ("orders", None),
+    "customers.csv": ("totalOrders", "totalSpent"),
+}
+
+# Orders that still need work before a shift can be closed (unless paid)
+OPEN_STATUSES = (OrderStatus.PENDING, OrderStatus.IN_PREPARATION)
+
+# Seconds after which the popular items counters are rebuilt from
+# item_sales.csv, to take in sales recorded by other worker processes
+TOP_ITEMS_RESYNC = float(os.environ.get("CAFE_TOP_ITEMS_RESYNC", 30))
+
+# Popular items windows, as days back from today (None: all time)
+WINDOWS = {"all": None, "today": 1, "7d": 7, "30d": 30}
+
+# Held from reading an order until the transaction updating it is applied,
+# so that two updates of one order cannot both take away its old totals.
+# Striped by order id, so updates of different orders rarely wait for each
+# other: the thread lock orders this process's writers, the file lock other
+# worker processes. The rollup rows themselves are only locked while the
+# transaction is applied (see Transaction.add_csv).
+ORDER_LOCK_STRIPES = 16
+_order_locks = [threading.Lock() for _ in range(ORDER_LOCK_STRIPES)]
+
+
+def _order_lock(order_id: str) -> Tuple[threading.Lock, str]:
+    """(thread lock, lock file path) of an order's stripe"""
+    stripe = zlib.crc32(order_id.encode("utf-8")) % ORDER_LOCK_STRIPES
+    return _order_locks[stripe], db.get_csv_path("orders.csv") + f".{stripe}.lock"
+
+
+def customer_email(value: str) -> Optional[str]:
+    """
+    Email of the customer an order's customer_email field names, or None
+
+    Orders taken by staff hold the customer's phone number there, which is
+    looked up in users.csv, then customers.csv. A value that resolves to no
+    email is not a customer key.
+    """
+    if not value:
+        return None
+    if "@" in value:
+        return value
+    for filename in ("users.csv", "customers.csv"):
+        row = db.find_one(filename, "phone", value)
+        if row is not None and "@" in (row.get("email") or ""):
+            return row["email"]
+    return None
+
+
+def _counted(order: Optional[Dict]) -> bool:
+    return (order is not None
+            and order.get("status") == OrderStatus.COMPLETED
+            and order.get("payment_status") == PaymentStatus.PAID)
+
+
+# Deltas map (filename, key field, key) -> [key columns, count, revenue],
+# stored in the TOTAL_FIELDS columns of the table.
+
+def _bump(deltas: Dict, filename: str, key_field: str, columns: Dict, count: int, revenue: float):
+    delta = deltas.setdefault((filename, key_field, columns[key_field]), [columns, 0, 0.0])
+    delta[1] += count
+    delta[2] += revenue
+
+
+def _order_deltas(deltas: Dict, order: Optional[Dict], sign: int):
+    """Add (sign=1) or take away (sign=-1) an order's status and revenue"""
+    if order is None:
+        return
+    status, payment_status = order.get("status") or "", order.get("payment_status") or ""
+    _bump(deltas, "order_status_counts.csv", "id",
+          {"id": f"{status} {payment_status}", "status": status, "payment_status": payment_status}, sign, 0.0)
+    if not _counted(order):
+        return
+    total = sign * (db._decode_row("orders.csv", order)["total"] or 0.0)
+    email = customer_email(order.get("customer_email") or "")
+    if email:
+        _bump(deltas, "customers.csv", "email", {"email": email, "name": order.get("customer_name") or ""},
+              sign, total)
+    date = order.get("date") or ""
+    method = order.get("payment_method") or ""
+    _bump(deltas, "revenue.csv", "date", {"date": date}, sign, total)
+    _bump(deltas, "revenue_by_method.csv", "id",
+          {"id": f"{date} {method}", "date": date, "payment_method": method}, sign, total)
+    hour = (order.get("created_at") or "")[11:13]
+    if hour.isdigit():
+        _bump(deltas, "revenue_hourly.csv", "id", {"id": f"{date} {hour}", "date": date, "hour": hour}, sign, total)
+
+
+def _sale_deltas(deltas: Dict, date: str, item_id: str, quantity: int, revenue: float):
+    _bump(deltas, "item_sales.csv", "id", {"id": f"{date} {item_id}", "date": date, "menu_item_id": item_id},
+          quantity, revenue)
+
+
+def _detail_deltas(deltas: Dict, date: str, detail: Dict):
+    """Add an order detail's quantity and subtotal to its item's day"""
+    typed = db._decode_row("order_details.csv", detail)
+    _sale_deltas(deltas, date, detail["menu_item_id"], typed["quantity"] or 0, typed["subtotal"] or 0.0)
+
+
+def _format(filename: str, count: int, revenue: float) -> Dict:
+    count_field, revenue_field = TOTAL_FIELDS[filename]
+    if revenue_field is None:
+        return {count_field: str(count)}
+    return {count_field: str(count), revenue_field: f"{revenue:.2f}"}
+
+
+def _new_customer(columns: Dict) -> Dict:
+    """customers.csv row for a customer's first paid order"""
+    user = db.find_one("users.csv", "email", columns["email"]) or {}
+    return {
+        "id": db.next_sequence("customers.csv"),
+        "name": columns["name"] or user.get("name") or "",
+        "email": columns["email"],
+        "phone": user.get("phone") or "",
+        "status": CustomerStatus.ACTIVE
+    }
+
+
+def _add_to_rollups(tx: db.Transaction, deltas: Dict):
+    """Queue on tx the deltas, added to the rollup rows as the transaction is applied"""
+    for (filename, key_field, key), (columns, count, revenue) in deltas.items():
+        if not count and not round(revenue, 2):
+            continue
+        count_field, revenue_field = TOTAL_FIELDS[filename]
+        amounts = {count_field: count}
+        if revenue_field is not None:
+            amounts[revenue_field] = float(revenue)
+        if filename == "customers.csv":
+            # Only inserted if the customer still has no row by then
+            columns = db.find_one(filename, key_field, key) or _new_customer(columns)
+        tx.add_csv(filename, key_field, key, amounts, columns, db.TABLE_SCHEMAS[filename])
+
+
+def commit(tx: db.Transaction):
+    """
+    Commit a transaction together with the rollup rows of the orders and
+    order details it inserts
+
+    Args:
+        tx: Transaction creating orders (e.g. the one of /api/create-order)
+    """
+    deltas: Dict = {}
+    dates = {}
+    for op in tx.ops:
+        if op["op"] == "insert" and op["file"] == "orders.csv":
+            for order in op["rows"]:
+                dates[order["id"]] = order["date"]
+                _order_deltas(deltas, order, 1)
+    for op in tx.ops:
+        if op["op"] == "insert" and op["file"] == "order_details.csv":
+            for detail in op["rows"]:
+                if detail["order_id"] not in dates:
+                    order = db.find_one("orders.csv", "id", detail["order_id"])
+                    dates[detail["order_id"]] = order["date"] if order else ""
+                _detail_deltas(deltas, dates[detail["order_id"]], detail)
+    _add_to_rollups(tx, deltas)
+    tx.commit()
+
+
+async def acommit(tx: db.Transaction):
+    """Async commit"""
+    await db.arun(commit, tx)
+
+
+def update_order(order_id: str, updates: Dict) -> Optional[Dict]:
+    """
+    Update an order and, in the same transaction, the rollups the change
+    moves (e.g. payment, completion, or reopening a completed order)
+
+    Args:
+        order_id: ID of the order
+        updates: Columns to change, as for db.update_csv
+
+    Returns:
+        The order as it was before the update, or None if there is no such order
+    """
+    lock, lock_path = _order_lock(order_id)
+    with lock, db._locked_file(lock_path):
+        before = db.find_one("orders.csv", "id", order_id)
+        if before is None:
+            return None
+        after = {**before, **db._normalize_row(updates, list(updates))}
+        deltas: Dict = {}
+        _order_deltas(deltas, before, -1)
+        _order_deltas(deltas, after, 1)
+        tx = db.Transaction()
+        tx.update_csv("orders.csv", "id", order_id, updates, CSVSchemas.ORDERS)
+        _add_to_rollups(tx, deltas)
+        tx.commit()
+        return before
+
+
+async def aupdate_order(order_id: str, updates: Dict) -> Optional[Dict]:
+    """Async update_order"""
+    return await db.arun(update_order, order_id, updates)
+
+
+def _history(deltas: Dict) -> int:
+    """Roll every order ever placed up into deltas; returns how many of them were counted as paid"""
+    # An archive job stopped between writing a segment and deleting the live
+    # rows leaves an order in both places
+    archived = set()
+    paid = 0
+    for month in archive.archived_months():
+        for order in archive._read_segment(archive.get_segment_path("orders", month)):
+            archived.add(order["id"])
+            paid += _counted(order)
+            _order_deltas(deltas, order, 1)
+    # Item sales of archived orders were rolled up as they were archived
+    for sale in db.iter_rows("archived_item_sales.csv", typed=True):
+        _sale_deltas(deltas, sale["date"], sale["menu_item_id"], sale["quantity"] or 0, sale["revenue"] or 0.0)
+
+    dates = {}
+    for order in db.iter_rows("orders.csv"):
+        if order["id"] in archived:
+            continue
+        dates[order["id"]] = order["date"]
+        paid += _counted(order)
+        _order_deltas(deltas, order, 1)
+    for detail in db.iter_rows("order_details.csv"):
+        if detail["order_id"] in dates:
+            _detail_deltas(deltas, dates[detail["order_id"]], detail)
+    return paid
+
+
+def rebuild() -> Dict:
+    """
+    Recompute every rollup from the live and archived orders, replacing
+    whatever the rollup tables held, and every customer's totals
+
+    Returns:
+        {"orders": n, "days": n, "revenue": total}
+    """
+    # Holds off the transactions adding to the rollups until they are replaced
+    with db.locked_tables([*ROLLUP_TABLES, "customers.csv"]):
+        deltas: Dict = {}
+        count = _history(deltas)
+        tables: Dict[str, List[Dict]] = {filename: [] for filename in ROLLUP_TABLES}
+        spent: Dict[str, Tuple] = {}
+        for (filename, _, key), (columns, total, revenue) in sorted(deltas.items()):
+            if filename == "customers.csv":
+                spent[key] = (columns, total, revenue)
+            else:
+                tables[filename].append({**columns, **_format(filename, total, revenue)})
+        for filename, fieldnames in ROLLUP_TABLES.items():
+            db.write_csv(filename, tables[filename], fieldnames)
+
+        # Customers without a paid order go back to zero
+        customers = []
+        for customer in db.read_csv("customers.csv"):
+            _, total, revenue = spent.pop(customer["email"], (None, 0, 0.0))
+            customers.append({**customer, **_format("customers.csv", total, revenue)})
+        for columns, total, revenue in spent.values():
+            customers.append({**_new_customer(columns), **_format("customers.csv", total, revenue)})
+        db.write_csv("customers.csv", customers, CSVSchemas.CUSTOMERS)
+    revenue = sum(float(row["revenue"]) for row in tables["revenue.csv"])
+    result = {"orders": count, "days": len(tables["revenue.csv"]), "revenue": round(revenue, 2)}
+    print(f"Rebuilt revenue rollups from {count} orders over {result['days']} day(s)")
+    return result
+
+
+def summary(today: Optional[datetime] = None, days: int = 30) -> Dict:
+    """
+    Revenue of the last `days` days from the rollups alone
+
+    Returns:
+        {"daily": [...], "hourly": [...], "byMethod": [...], "totals": {...}},
+        daily holding one entry per day (oldest first, zero for days without
+        sales), hourly today's hours and byMethod the whole period
+    """
+    today = today or datetime.now()
+    dates = [(today - timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(days - 1, -1, -1)]
+    period = {"date": (dates[0], dates[-1])}
+
+    rows, _ = db.query("revenue.csv", ranges=period, typed=True)
+    by_date = {row["date"]: row for row in rows}
+    daily = [
+        {"date": date,
+         "revenue": (by_date[date]["revenue"] or 0.0) if date in by_date else 0.0,
+         "orders": (by_date[date]["orders"] or 0) if date in by_date else 0}
+        for date in dates
+    ]
+
+    hourly, _ = db.query("revenue_hourly.csv", filters={"date": dates[-1]}, sort="hour", typed=True)
+
+    methods: Dict[str, Dict] = {}
+    rows, _ = db.query("revenue_by_method.csv", ranges=period, typed=True)
+    for row in rows:
+        if not row["orders"]:
+            continue
+        method = methods.setdefault(row["payment_method"], {"method": row["payment_method"], "revenue": 0.0, "orders": 0})
+        method["revenue"] += row["revenue"] or 0.0
+        method["orders"] += row["orders"] or 0
+
+    week = daily[-7:]
+    week_total = sum(d["revenue"] for d in week)
+    week_orders = sum(d["orders"] for d in week)
+    return {
+        "daily": daily,
+        "hourly": [{"hour": row["hour"], "revenue": row["revenue"] or 0.0, "orders": row["orders"] or 0}
+                   for row in hourly if row["orders"]],
+        "byMethod": sorted(methods.values(), key=lambda m: m["revenue"], reverse=True),
+        "totals": {
+            "today": daily[-1]["revenue"],
+            "week": week_total,
+            "month": sum(d["revenue"] for d in daily),
+            "orders_today": daily[-1]["orders"],
+            "orders_week": week_orders,
+            "avg_order": week_total / week_orders if week_orders > 0 else 0
+        }
+    }
+
+
+async def asummary(today: Optional[datetime] = None, days: int = 30) -> Dict:
+    """Async summary"""
+    return await db.arun(summary, today, days)
+
+
+def open_orders() -> int:
+    """Orders pending or in preparation and not paid yet, from the status counts"""
+    rows, _ = db.query("order_status_counts.csv", filters={"status": list(OPEN_STATUSES)}, typed=True)
+    return sum(row["orders"] or 0 for row in rows if row["payment_status"] != PaymentStatus.PAID)
+
+
+def day_revenue(date: str, payment_method: Optional[str] = None) -> Tuple[int, float]:
+    """(orders, revenue) of one day, or of one payment method that day"""
+    if payment_method is None:
+        row = db.find_one("revenue.csv", "date", date, typed=True)
+    else:
+        row = db.find_one("revenue_by_method.csv", "id", f"{date} {payment_method}", typed=True)
+    if row is None:
+        return 0, 0.0
+    return row["orders"] or 0, row["revenue"] or 0.0
+
+
+async def aopen_orders() -> int:
+    """Async open_orders"""
+    return await db.arun(open_orders)
+
+
+async def aday_revenue(date: str, payment_method: Optional[str] = None) -> Tuple[int, float]:
+    """Async day_revenue"""
+    return await db.arun(day_revenue, date, payment_method)
+
+
+class TopK:
+    """
+    Sold quantity and revenue per menu item, kept ranked by quantity (then
+    id) so the top k is a slice rather than a sort
+    """
+
+    def __init__(self):
+        self.counts: Dict[str, List] = {}
+        self._ranking: List[Tuple[int, str]] = []
+
+    def add(self, item_id: str, quantity: int, revenue: float):
+        counts = self.counts.get(item_id)
+        if counts is None:
+            counts = self.counts[item_id] = [0, 0.0]
+        else:
+            del self._ranking[bisect.bisect_left(self._ranking, (-counts[0], item_id))]
+        counts[0] += quantity
+        counts[1] += revenue
+        if counts[0] > 0:
+            bisect.insort(self._ranking, (-counts[0], item_id))
+        else:
+            del self.counts[item_id]
+
+    def top(self, k: int) -> List[Tuple[str, int, float]]:
+        """[(item id, quantity, revenue)] of the k best sellers"""
+        return [(item_id, -quantity, self.counts[item_id][1]) for quantity, item_id in self._ranking[:k]]
+
+
+class PopularItems:
+    """
+    Ranked item sales per window (all time, today, 7 and 30 days), overall
+    and per menu category, fed by the writes to item_sales.csv
+
+    The counters are built from item_sales.csv on first use, again when the
+    day changes (the windows move) and every TOP_ITEMS_RESYNC seconds to
+    take in the sales of other worker processes. In between, every write
+    this process makes to item_sales.csv moves them directly.
+    """
+
+    def __init__(self, resync: float = TOP_ITEMS_RESYNC):
+        self.resync = resync
+        self._lock = threading.Lock()
+        self._day: Optional[str] = None
+        self._built = 0.0
+        self._writes = 0
+        self._counters: Dict[Tuple[str, str], TopK] = {}
+        self._categories: Dict[str, str] = {}
+
+    def _windows(self, date: str) -> List[str]:
+        """Windows a day's sales fall in"""
+        if not date or date > self._day:
+            return ["all"]
+        age = (datetime.strptime(self._day, "%Y-%m-%d") - datetime.strptime(date, "%Y-%m-%d")).days
+        return [name for name, days in WINDOWS.items() if days is None or age < days]
+
+    def _add(self, date: str, item_id: str, quantity: int, revenue: float):
+        category = self._categories.get(item_id, "")
+        for window in self._windows(date):
+            for key in {(window, ""), (window, category)}:
+                counter = self._counters.get(key)
+                if counter is None:
+                    counter = self._counters[key] = TopK()
+                counter.add(item_id, quantity, revenue)
+
+    def _refresh(self, day: str):
+        with self._lock:
+            if self._day == day and time.monotonic() - self._built <= self.resync:
+                return
+            writes = self._writes
+        # Read without holding our lock: the listeners below take it while
+        # the writer holds the table's lock
+        categories = {item["id"]: item.get("category", "") for item in db.read_csv("menu_items.csv")}
+        sales = list(db.iter_rows("item_sales.csv", typed=True))
+        with self._lock:
+            self._day, self._categories, self._counters = day, categories, {}
+            for sale in sales:
+                self._add(sale["date"], sale["menu_item_id"], sale["quantity"] or 0, sale["revenue"] or 0.0)
+            # A write made while reading may or may not be in what was read
+            self._built = time.monotonic() if self._writes == writes else 0.0
+
+    def on_write(self, filename: str, op: str, before: Optional[Dict], after: Optional[Dict]):
+        with self._lock:
+            self._writes += 1
+            if self._day is None:
+                return
+            if op == "write":
+                self._day = None
+                return
+            for row, sign in ((before, -1), (after, 1)):
+                if row is not None:
+                    sale = db._decode_row(filename, row)
+                    self._add(sale["date"], sale["menu_item_id"],
+                              sign * (sale["quantity"] or 0), sign * (sale["revenue"] or 0.0))
+
+    def on_menu_write(self, filename: str, op: str, before: Optional[Dict], after: Optional[Dict]):
+        # A new item has no sales yet; an item moved to another category needs a rebuild
+        with self._lock:
+            if op == "insert":
+                self._categories[after["id"]] = after.get("category", "")
+            elif op == "write" or (op == "update" and before.get("category") != after.get("category")):
+                self._day = None
+
+    def top(self, window: str = "all", k: int = 5, category: Optional[str] = None,
+            today: Optional[datetime] = None) -> List[Tuple[str, int, float]]:
+        """[(item id, quantity, revenue)] of the k best sellers of a window (and category)"""
+        self._refresh((today or datetime.now()).strftime("%Y-%m-%d"))
+        with self._lock:
+            counter = self._counters.get((window, category or ""))
+            return counter.top(k) if counter is not None else []
+
+    def top_by_category(self, window: str = "all", k: int = 5,
+                        today: Optional[datetime] = None) -> Dict[str, List[Tuple[str, int, float]]]:
+        """{category: [(item id, quantity, revenue)]} of the k best sellers of a window per category"""
+        self._refresh((today or datetime.now()).strftime("%Y-%m-%d"))
+        with self._lock:
+            return {category: counter.top(k)
+                    for (name, category), counter in self._counters.items()
+                    if name == window and category}
+
+
+popular_items = PopularItems()
+db.add_listener("item_sales.csv", popular_items.on_write)
+db.add_listener("menu_items.csv", popular_items.on_menu_write)
+
+
+def top_items(window: str = "all", k: int = 5, category: Optional[str] = None) -> List[Tuple[str, int, float]]:
+    """
+    Best selling menu items, from counters kept in memory
+
+    Args:
+        window: One of WINDOWS ("all", "today", "7d", "30d")
+        k: How many items
+        category: Only items of this menu category
+
+    Returns:
+        [(menu item id, quantity sold, revenue)], best seller first
+    """
+    return popular_items.top(window, k, category)
+
+
+async def atop_items(window: str = "all", k: int = 5, category: Optional[str] = None):
+    """Async top_items"""
+    return await db.arun(top_items, window, k, category)
+
+
+async def atop_by_category(window: str = "all", k: int = 5):
+    """Async top_items of every category, as {category: items}"""
+    return await db.arun(popular_items.top_by_category, window, k)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Revenue, item sales and order status rollups")
+    parser.add_argument("command", choices=["rebuild"], help="rebuild: recompute the rollups from order history")
+    parser.parse_args(argv)
+    db.migrate_tables()
+    db.recover_transactions()
+    rebuild()
+
+
+if __name__ == "__main__":
+    main()
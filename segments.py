@@ -0,0 +1,187 @@
+"""
+Customer segmentation (RFM)
+Scores every customer on recency (days since their last paid order),
+frequency (paid orders) and monetary value (total spent) in one vectorized
+pass over the order history, live and archived, and stores the scores and
+segment of each customer in customer_segments.csv, which /api/customers
+serves as is
+
+Each score runs from 1 to 5 by quintile among the customers who ordered,
+5 being the most recent, most frequent or highest spending. Like the
+revenue rollups, only completed, paid orders count.
+
+Usage:
+    python segments.py                # recompute every customer's segment
+"""
+import argparse
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import analytics
+import archive
+import database as db
+import rollups
+from database import CSVSchemas
+from constants import CustomerSegment
+
+_job_lock = threading.Lock()
+_last_run: Dict = {}
+
+
+def _paid_orders() -> List[Dict]:
+    """
+    Completed, paid orders placed by a customer, live or archived (each
+    once), with customer_email resolved to the customer's email
+    """
+    orders = []
+    emails: Dict[str, Optional[str]] = {}
+
+    def add(order: Dict):
+        if not rollups._counted(order) or not order.get("customer_email"):
+            return
+        value = order["customer_email"]
+        if value not in emails:
+            emails[value] = rollups.customer_email(value)
+        if emails[value]:
+            orders.append({**order, "customer_email": emails[value]})
+
+    # An archive job stopped between writing a segment and deleting the live
+    # rows leaves an order in both places
+    archived = set()
+    for month in archive.archived_months():
+        for order in archive._read_segment(archive.get_segment_path("orders", month)):
+            archived.add(order["id"])
+            add(order)
+    for order in db.iter_rows("orders.csv"):
+        if order["id"] not in archived:
+            add(order)
+    return orders
+
+
+def _scores(values: np.ndarray) -> np.ndarray:
+    """
+    Quintile (1-5) of each value among all of them, higher values scoring
+    higher. Equal values share the quintile of their middle rank, so a lone
+    customer (or one value shared by everyone) scores 3.
+    """
+    ordered = np.sort(values)
+    ranks = np.searchsorted(ordered, values, side="left") + np.searchsorted(ordered, values, side="right")
+    return np.minimum(1 + ranks * 5 // (2 * len(values)), 5)
+
+
+def _segments(recency: np.ndarray, frequency: np.ndarray, monetary: np.ndarray) -> np.ndarray:
+    return np.select(
+        [(recency >= 4) & (frequency >= 4) & (monetary >= 4),
+         (recency >= 3) & (frequency >= 3),
+         recency >= 4,
+         frequency >= 3,
+         recency >= 3],
+        [CustomerSegment.CHAMPIONS, CustomerSegment.LOYAL, CustomerSegment.NEW,
+         CustomerSegment.AT_RISK, CustomerSegment.POTENTIAL],
+        default=CustomerSegment.HIBERNATING
+    )
+
+
+def compute(orders: List[Dict], today: Optional[datetime] = None) -> List[Dict]:
+    """customer_segments.csv rows for the given paid orders, one per customer email"""
+    if not orders:
+        return []
+    today = today or datetime.now()
+    customers, codes = np.unique(np.array([order["customer_email"] for order in orders], dtype=str),
+                                 return_inverse=True)
+    # Order dates as days since 1970
+    days = analytics._timestamps([{"date": order.get("date") or ""} for order in orders]) // 86400
+    totals = analytics._floats([order.get("total") or "" for order in orders])
+
+    last = np.full(len(customers), np.iinfo(np.int64).min, dtype=np.int64)
+    np.maximum.at(last, codes, days)
+    frequency = np.bincount(codes, minlength=len(customers))
+    monetary = np.bincount(codes, weights=totals, minlength=len(customers))
+    recency = np.maximum(np.datetime64(today.strftime("%Y-%m-%d"), "D").astype(np.int64) - last, 0)
+
+    recency_scores = _scores(-recency)
+    frequency_scores = _scores(frequency)
+    monetary_scores = _scores(monetary)
+    segments = _segments(recency_scores, frequency_scores, monetary_scores)
+    last_orders = last.astype("datetime64[D]").astype(str)
+    computed_at = today.strftime("%Y-%m-%d %H:%M:%S")
+    return [
+        {"email": email, "lastOrder": last_order, "recencyDays": str(r), "frequency": str(f),
+         "monetary": f"{m:.2f}", "recencyScore": str(rs), "frequencyScore": str(fs),
+         "monetaryScore": str(ms), "segment": segment, "computed_at": computed_at}
+        for email, last_order, r, f, m, rs, fs, ms, segment in zip(
+            customers.tolist(), last_orders.tolist(), recency.tolist(), frequency.tolist(),
+            monetary.tolist(), recency_scores.tolist(), frequency_scores.tolist(),
+            monetary_scores.tolist(), segments.tolist()
+        )
+    ]
+
+
+def run_segmentation(today: Optional[datetime] = None) -> Dict:
+    """
+    Recompute every customer's RFM scores and segment, replacing customer_segments.csv
+
+    Args:
+        today: Date recency is counted from (default: now)
+
+    Returns:
+        {"customers": n, "segments": {segment: n}, "seconds": s}
+    """
+    if not _job_lock.acquire(blocking=False):
+        raise RuntimeError("A segmentation job is already running")
+    try:
+        started = time.perf_counter()
+        rows = compute(_paid_orders(), today)
+        db.write_csv("customer_segments.csv", rows, CSVSchemas.CUSTOMER_SEGMENTS)
+        counts: Dict[str, int] = {}
+        for row in rows:
+            counts[row["segment"]] = counts.get(row["segment"], 0) + 1
+        result = {
+            "customers": len(rows),
+            "segments": counts,
+            "seconds": round(time.perf_counter() - started, 3)
+        }
+        _last_run.clear()
+        _last_run.update(result, finishedAt=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        print(f"Segmented {len(rows)} customers")
+        return result
+    finally:
+        _job_lock.release()
+
+
+def start_segmentation() -> bool:
+    """Run the segmentation job on a background thread; False if one is already running"""
+    if _job_lock.locked():
+        return False
+
+    def job():
+        try:
+            run_segmentation()
+        except Exception as e:
+            print(f"Error segmenting customers: {e}")
+
+    threading.Thread(target=job, name="segments", daemon=True).start()
+    return True
+
+
+def stats() -> Dict:
+    return {
+        "running": _job_lock.locked(),
+        "lastRun": dict(_last_run) or None
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute customer RFM segments")
+    parser.parse_args(argv)
+    db.migrate_tables()
+    db.recover_transactions()
+    run_segmentation()
+
+
+if __name__ == "__main__":
+    main()
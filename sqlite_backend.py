@@ -0,0 +1,400 @@
+"""
+SQLite storage backend
+Keeps every table in one SQLite database behind the database.py API
+
+Select it with CAFE_STORAGE_BACKEND=sqlite (and optionally CAFE_SQLITE_PATH).
+Load the existing CSV files once with:
+
+    python sqlite_backend.py
+"""
+import os
+import sqlite3
+import threading
+from typing import List, Dict, Optional, Tuple
+
+import database as db
+
+
+def _quote(identifier: str) -> str:
+    """Quote a table or column name for use in SQL"""
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def table_name(filename: str) -> str:
+    """SQLite table holding a CSV file's rows (orders.csv -> orders)"""
+    return os.path.splitext(filename)[0].replace("/", "_").replace("\\", "_")
+
+
+class SQLiteBackend(db.StorageBackend):
+    """
+    SQLite database in WAL mode
+
+    Every column is TEXT so rows read back exactly as they do from the CSV
+    files, and rowid preserves insertion order. Each declared TABLE_INDEXES
+    field (or tuple of fields) gets a real index; they are not UNIQUE because
+    the CSV data already tolerates duplicates. Each thread has its own
+    connection, and the connection's statement cache keeps the parameterized
+    queries prepared.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._columns: Dict[str, List[str]] = {}
+        self._schema_lock = threading.Lock()
+        for filename, fieldnames in db.TABLE_SCHEMAS.items():
+            self._ensure_table(filename, fieldnames)
+            self._ensure_indexes(filename)
+        # Id high-water marks for next_sequence, keyed by CSV filename
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS _sequences (filename TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _existing_columns(self, filename: str) -> Optional[List[str]]:
+        """Columns of a table, or None if it has not been created"""
+        columns = self._columns.get(filename)
+        if columns is not None:
+            return columns
+        info = self._conn().execute(f"PRAGMA table_info({_quote(table_name(filename))})").fetchall()
+        if not info:
+            return None
+        columns = self._columns[filename] = [col[1] for col in info]
+        return columns
+
+    def _ensure_table(self, filename: str, fieldnames: List[str]) -> List[str]:
+        """Create the table (and its indexes) or add any new columns"""
+        columns = self._existing_columns(filename)
+        if columns is not None and all(field in columns for field in fieldnames):
+            return columns
+
+        with self._schema_lock:
+            conn = self._conn()
+            table = _quote(table_name(filename))
+            columns = self._existing_columns(filename)
+            if columns is None:
+                column_sql = ", ".join(f"{_quote(field)} TEXT NOT NULL DEFAULT ''" for field in fieldnames)
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({column_sql})")
+                columns = list(fieldnames)
+            else:
+                for field in fieldnames:
+                    if field not in columns:
+                        conn.execute(f"ALTER TABLE {table} ADD COLUMN {_quote(field)} TEXT NOT NULL DEFAULT ''")
+                        columns = columns + [field]
+            self._columns[filename] = columns
+        self._ensure_indexes(filename)
+        return columns
+
+    def _ensure_indexes(self, filename: str):
+        """Create the declared TABLE_INDEXES (also for databases made before they were declared)"""
+        columns = self._existing_columns(filename) or []
+        table = _quote(table_name(filename))
+        for field in db.TABLE_INDEXES.get(filename, {}):
+            fields = field if isinstance(field, tuple) else (field,)
+            if all(f in columns for f in fields):
+                index = _quote(f"idx_{table_name(filename)}_{'_'.join(fields)}")
+                self._conn().execute(
+                    f"CREATE INDEX IF NOT EXISTS {index} ON {table} ({', '.join(_quote(f) for f in fields)})"
+                )
+
+    @staticmethod
+    def _rows(columns: List[str], records) -> List[Dict]:
+        return [dict(zip(columns, record)) for record in records]
+
+    def read_csv(self, filename: str, typed: bool = False) -> List[Dict]:
+        columns = self._existing_columns(filename)
+        if columns is None:
+            return []
+        column_sql = ", ".join(_quote(col) for col in columns)
+        records = self._conn().execute(
+            f"SELECT {column_sql} FROM {_quote(table_name(filename))} ORDER BY rowid"
+        ).fetchall()
+        rows = self._rows(columns, records)
+        return db._decode_rows(filename, rows) if typed else rows
+
+    def write_csv(self, filename: str, data: List[Dict], fieldnames: List[str]):
+        for row in data:
+            db._check_fields(row, fieldnames)
+        self._ensure_table(filename, fieldnames)
+        table = _quote(table_name(filename))
+        insert_sql = (f"INSERT INTO {table} ({', '.join(_quote(f) for f in fieldnames)}) "
+                      f"VALUES ({', '.join('?' for _ in fieldnames)})")
+        values = [[db._normalize_row(row, fieldnames)[f] for f in fieldnames] for row in data]
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"DELETE FROM {table}")
+            conn.executemany(insert_sql, values)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def append_csv(self, filename: str, row: Dict, fieldnames: List[str]):
+        self.append_many(filename, [row], fieldnames)
+
+    def append_many(self, filename: str, rows: List[Dict], fieldnames: List[str]):
+        if not rows:
+            return
+        try:
+            for row in rows:
+                db._check_fields(row, fieldnames)
+        except ValueError as e:
+            print(f"Error appending to {filename}: {e}")
+            raise
+        self._ensure_table(filename, fieldnames)
+        values = [[db._normalize_row(row, fieldnames)[f] for f in fieldnames] for row in rows]
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                f"INSERT INTO {_quote(table_name(filename))} ({', '.join(_quote(f) for f in fieldnames)}) "
+                f"VALUES ({', '.join('?' for _ in fieldnames)})",
+                values
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def update_csv(self, filename: str, key_field: str, key_value: str, updates: Dict, fieldnames: List[str]):
+        db._check_fields(updates, fieldnames)
+        columns = self._ensure_table(filename, fieldnames)
+        if key_field not in columns or not updates:
+            return
+        table = _quote(table_name(filename))
+        fields = list(updates)
+        set_sql = ", ".join(f"{_quote(f)} = ?" for f in fields)
+        values = ["" if updates[f] is None else str(updates[f]) for f in fields]
+        # Like the CSV backend, only the first matching row is updated
+        self._conn().execute(
+            f"UPDATE {table} SET {set_sql} WHERE rowid = "
+            f"(SELECT rowid FROM {table} WHERE {_quote(key_field)} = ? ORDER BY rowid LIMIT 1)",
+            values + [key_value]
+        )
+
+    def delete_csv(self, filename: str, key_field: str, key_value: str, fieldnames: List[str]):
+        columns = self._existing_columns(filename)
+        if columns is None or key_field not in columns:
+            return
+        self._conn().execute(
+            f"DELETE FROM {_quote(table_name(filename))} WHERE {_quote(key_field)} = ?",
+            [key_value]
+        )
+
+    def delete_many(self, filename: str, key_field: str, key_values: List[str], fieldnames: List[str]):
+        columns = self._existing_columns(filename)
+        if columns is None or key_field not in columns:
+            return
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                f"DELETE FROM {_quote(table_name(filename))} WHERE {_quote(key_field)} = ?",
+                [[value] for value in dict.fromkeys(key_values)]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def next_sequence(self, filename: str) -> str:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            record = conn.execute("SELECT value FROM _sequences WHERE filename = ?", [filename]).fetchone()
+            if record is not None:
+                last = record[0]
+            elif "id" in (self._existing_columns(filename) or []):
+                # First use: start above the largest all-digit id stored
+                last = conn.execute(
+                    f"SELECT COALESCE(MAX(CAST(id AS INTEGER)), 0) FROM {_quote(table_name(filename))} "
+                    f"WHERE id != '' AND id NOT GLOB '*[^0-9]*'"
+                ).fetchone()[0]
+            else:
+                last = 0
+            conn.execute(
+                "INSERT OR REPLACE INTO _sequences (filename, value) VALUES (?, ?)", [filename, last + 1]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return str(last + 1)
+
+    def sync(self, filename: str):
+        # synchronous=NORMAL leaves the last commits in the WAL unsynced;
+        # a FULL checkpoint writes them into the database file and syncs it
+        self._conn().execute("PRAGMA wal_checkpoint(FULL)")
+
+    def find_one(self, filename: str, key_field: str, key_value: str, typed: bool = False) -> Optional[Dict]:
+        columns = self._existing_columns(filename)
+        if columns is None or key_field not in columns:
+            return None
+        column_sql = ", ".join(_quote(col) for col in columns)
+        record = self._conn().execute(
+            f"SELECT {column_sql} FROM {_quote(table_name(filename))} "
+            f"WHERE {_quote(key_field)} = ? ORDER BY rowid LIMIT 1",
+            [key_value]
+        ).fetchone()
+        if not record:
+            return None
+        row = dict(zip(columns, record))
+        return db._decode_row(filename, row) if typed else row
+
+    def find_all(self, filename: str, key_field: str, key_value: str, typed: bool = False) -> List[Dict]:
+        columns = self._existing_columns(filename)
+        if columns is None or key_field not in columns:
+            return []
+        column_sql = ", ".join(_quote(col) for col in columns)
+        records = self._conn().execute(
+            f"SELECT {column_sql} FROM {_quote(table_name(filename))} "
+            f"WHERE {_quote(key_field)} = ? ORDER BY rowid",
+            [key_value]
+        ).fetchall()
+        rows = self._rows(columns, records)
+        return db._decode_rows(filename, rows) if typed else rows
+
+    def group_by(self, filename: str, key_field: str, keys: Optional[List[str]] = None,
+                 typed: bool = False) -> Dict[str, List[Dict]]:
+        columns = self._existing_columns(filename)
+        if keys is None or columns is None or key_field not in columns:
+            return super().group_by(filename, key_field, keys, typed)
+        groups = {key: [] for key in keys}
+        column_sql = ", ".join(_quote(col) for col in columns)
+        key_list = list(groups)
+        # Stay well under SQLite's limit on bound parameters per statement
+        for start in range(0, len(key_list), 500):
+            chunk = key_list[start:start + 500]
+            records = self._conn().execute(
+                f"SELECT {column_sql} FROM {_quote(table_name(filename))} "
+                f"WHERE {_quote(key_field)} IN ({', '.join('?' for _ in chunk)}) ORDER BY rowid",
+                chunk
+            ).fetchall()
+            rows = self._rows(columns, records)
+            for row in db._decode_rows(filename, rows) if typed else rows:
+                groups[row[key_field]].append(row)
+        return groups
+
+    def query(self, filename: str, filters: Optional[Dict] = None, ranges: Optional[Dict] = None,
+              sort: Optional[str] = None, descending: bool = False, limit: Optional[int] = None,
+              cursor: Optional[str] = None, typed: bool = False) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Filters and ranges become a WHERE clause so SQLite can use its
+        indexes. Unsorted pages are cut with LIMIT/OFFSET; sorted ones are
+        ordered in Python so typed columns sort exactly as with the CSV backend.
+        """
+        position = db._read_cursor(cursor, sort, descending)
+        columns = self._existing_columns(filename)
+        if columns is None:
+            return [], None
+        conditions, params = [], []
+        for field, value in (filters or {}).items():
+            if field not in columns:
+                return [], None
+            if isinstance(value, (list, tuple, set)):
+                values = list(dict.fromkeys(value))
+                if not values:
+                    return [], None
+                conditions.append(f"{_quote(field)} IN ({', '.join('?' for _ in values)})")
+                params.extend(values)
+            else:
+                conditions.append(f"{_quote(field)} = ?")
+                params.append(value)
+        for field, (low, high) in (ranges or {}).items():
+            if field not in columns:
+                return [], None
+            conditions.append(f"{_quote(field)} != ''")
+            if low is not None:
+                conditions.append(f"{_quote(field)} >= ?")
+                params.append(low)
+            if high is not None:
+                conditions.append(f"{_quote(field)} <= ?")
+                params.append(high)
+
+        column_sql = ", ".join(_quote(col) for col in columns)
+        sql = f"SELECT {column_sql} FROM {_quote(table_name(filename))}"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY rowid"
+        if not sort and limit is not None:
+            # One spare row tells whether another page follows
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([limit + 1, position["offset"]])
+        elif not sort and position["offset"]:
+            sql += " LIMIT -1 OFFSET ?"
+            params.append(position["offset"])
+        rows = self._rows(columns, self._conn().execute(sql, params).fetchall())
+
+        if sort:
+            page, next_cursor = db._paginate(filename, rows, sort, descending, limit, cursor)
+        else:
+            page, next_cursor = db._offset_page(rows, position, limit)
+        return (db._decode_rows(filename, page) if typed else page), next_cursor
+
+
+def _csv_header(filename: str) -> List[str]:
+    """Columns of a table's CSV file, or of all its partitions when it is partitioned"""
+    manifest = db._partitions(filename)
+    files = [db._partition_file(filename, key) for key in manifest["partitions"]] if manifest else [filename]
+    fieldnames = []
+    for name in files:
+        for field in db._file_header(name) or []:
+            if field not in fieldnames:
+                fieldnames.append(field)
+    return fieldnames
+
+
+def import_csv_data(path: str = None) -> Dict[str, int]:
+    """
+    Load every table in DATA_DIR into an SQLite database
+
+    Covers the tables of TABLE_SCHEMAS, whether in one file or partitioned,
+    and any other CSV file in DATA_DIR. Existing SQLite tables with the same
+    names are replaced. Rows are read through the CSV backend, so partitions
+    and pending change logs are included.
+
+    Returns:
+        Dict of filename -> number of rows imported
+    """
+    target = SQLiteBackend(path or db.SQLITE_PATH)
+    source = db.CSVBackend()
+    counts = {}
+
+    filenames = set(db.TABLE_SCHEMAS)
+    filenames.update(name for name in os.listdir(db.DATA_DIR) if name.endswith(".csv"))
+    for filename in sorted(filenames):
+        if not (os.path.exists(db.get_csv_path(filename)) or os.path.exists(db.get_manifest_path(filename))):
+            continue
+        fieldnames = _csv_header(filename)
+        for field in db.TABLE_SCHEMAS.get(filename, []):
+            if field not in fieldnames:
+                fieldnames.append(field)
+
+        rows = []
+        for row in source.read_csv(filename):
+            if None in row:
+                print(f"Warning: {filename} row {row.get(fieldnames[0])} has extra values, dropping them")
+                del row[None]
+            rows.append(row)
+
+        target.write_csv(filename, rows, fieldnames)
+        counts[filename] = len(rows)
+
+    return counts
+
+
+if __name__ == "__main__":
+    for filename, count in import_csv_data().items():
+        print(f"{filename}: {count} rows")
+    print(f"Imported into {db.SQLITE_PATH}")
@@ -232,6 +232,47 @@ def validate_enum(value: str, allowed_values: list, field_name: str = "Giá tr
     return value
 
 
+def validate_sort(sort: Optional[str], allowed_fields: list) -> tuple:
+    """
+    Validate a sort parameter: a field name, prefixed with "-" for descending
+    
+    Args:
+        sort: Sort parameter (e.g. "-created_at"), or None for no sorting
+        allowed_fields: Fields that may be sorted on
+        
+    Returns:
+        Tuple of (field or None, descending)
+        
+    Raises:
+        ValidationError: If the field cannot be sorted on
+    """
+    if not sort:
+        return None, False
+    descending = sort.startswith("-")
+    field = sort[1:] if descending else sort
+    validate_enum(field, allowed_fields, "Trường sắp xếp")
+    return field, descending
+
+
+def validate_page_limit(limit: Optional[int], max_limit: int) -> Optional[int]:
+    """
+    Validate a page size, capping it at max_limit
+    
+    Args:
+        limit: Requested number of rows per page, or None for no paging
+        max_limit: Largest page size served
+        
+    Returns:
+        Page size, or None
+        
+    Raises:
+        ValidationError: If limit is not a positive integer
+    """
+    if limit is None:
+        return None
+    return min(validate_positive_integer(limit, "Số dòng mỗi trang"), max_limit)
+
+
 def handle_validation_error(error: ValidationError) -> JSONResponse:
     """
     Convert ValidationError to JSONResponse